@@ -0,0 +1,140 @@
+"""
+Статические страницы и файлы веб-приложения, подготовленные заранее
+
+Тело каждого ресурса читается (или рендерится) один раз, для него сразу
+считаются ETag и сжатые варианты gzip и brotli (если установлен пакет
+brotli). На запрос остаётся выбрать вариант по Accept-Encoding и отдать
+готовые байты. Отдаются только файлы из явного списка приложения: каталог
+с ними содержит и базу, и журналы, и токен бота. Файлы списка готовятся
+при запуске сервера (preload), поэтому кэш ограничен этим списком. Файл
+перечитывается, только если изменилось время его изменения.
+
+В режиме отпечатков (ASSET_FINGERPRINT=1) файл доступен также по имени
+с хэшем содержимого (index.1a2b3c4d.html): такой адрес не меняется, пока
+не изменится файл, поэтому кэшируется браузером навсегда.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+from flask import Response, request
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Ресурсы меньше этого размера не сжимаются
+COMPRESS_MIN_SIZE = 1024
+# Время кэширования файлов без отпечатка (секунды); HTML всегда перепроверяется
+STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 3600))
+ASSET_FINGERPRINT = os.environ.get('ASSET_FINGERPRINT', '0') == '1'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class Asset:
+    """Готовый к отдаче ресурс: тело, сжатые варианты и ETag"""
+
+    def __init__(self, name, body, content_type, mtime=None):
+        self.name = name
+        self.content_type = content_type
+        self.mtime = mtime
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+        # Кодировка -> тело; выбираются в порядке предпочтения сервера
+        self.variants = {}
+        if len(body) >= COMPRESS_MIN_SIZE:
+            if brotli is not None:
+                self.variants['br'] = brotli.compress(body, quality=11)
+            self.variants['gzip'] = gzip.compress(body, compresslevel=9)
+        self.variants['identity'] = body
+        if content_type.startswith('text/html'):
+            self.cache_control = 'no-cache'
+        else:
+            self.cache_control = f'public, max-age={STATIC_MAX_AGE}'
+
+    @property
+    def fingerprinted_name(self):
+        stem, ext = os.path.splitext(self.name)
+        return f'{stem}.{self.digest[:8]}{ext}'
+
+    def response(self, immutable=False):
+        """Ответ с вариантом по Accept-Encoding или 304 по If-None-Match"""
+        encoding = next((e for e in self.variants
+                         if e == 'identity' or e in request.accept_encodings), 'identity')
+        # Сильный ETag своего для каждой кодировки: байты вариантов разные
+        etag = f'{self.digest}-{encoding}'
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(self.variants[encoding], content_type=self.content_type)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if immutable else self.cache_control
+        if len(self.variants) > 1:
+            response.vary.add('Accept-Encoding')
+        return response
+
+
+class AssetStore:
+    """Файлы names из каталога directory; остальные файлы каталога не отдаются"""
+
+    def __init__(self, directory, names, fingerprint=ASSET_FINGERPRINT):
+        self.directory = directory
+        self.names = frozenset(names)
+        self.fingerprint = fingerprint
+        self.lock = threading.Lock()
+        self.assets = {}
+
+    def _load(self, name):
+        if name not in self.names:
+            return None
+        path = safe_join(self.directory, name)
+        if path is None:
+            return None
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        asset = self.assets.get(name)
+        if asset is not None and asset.mtime == mtime:
+            return asset
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            body = f.read()
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type == 'application/javascript':
+            content_type += '; charset=utf-8'
+        asset = Asset(name, body, content_type, mtime)
+        with self.lock:
+            self.assets[name] = asset
+        return asset
+
+    def preload(self):
+        """Готовит файлы заранее, чтобы сжатие не попало в первый запрос"""
+        for name in sorted(self.names):
+            if self._load(name) is None:
+                print(f"⚠️  Файл приложения не найден: {name}")
+
+    def url(self, name, prefix='/app/'):
+        """Адрес файла для страниц: с отпечатком, если режим включён"""
+        asset = self._load(name) if self.fingerprint else None
+        return prefix + (asset.fingerprinted_name if asset is not None else name)
+
+    def response(self, name):
+        """Ответ для файла или None, если его нет"""
+        if self.fingerprint:
+            # index.1a2b3c4d.html -> index.html; отпечаток должен совпасть с текущим
+            stem, ext = os.path.splitext(name)
+            base, _, digest = stem.rpartition('.')
+            if base and len(digest) == 8:
+                asset = self._load(base + ext)
+                if asset is not None and asset.fingerprinted_name == name:
+                    return asset.response(immutable=True)
+        asset = self._load(name)
+        return asset.response() if asset is not None else None
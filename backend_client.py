@@ -0,0 +1,156 @@
+"""
+Клиент backend API для бота
+
+Одна aiohttp-сессия на всё время работы бота: пул keep-alive соединений
+и кэш DNS вместо нового соединения на каждую команду. Запросы ограничены
+таймаутом, обрывы соединения и ответы 5xx повторяются с нарастающей
+паузой. Редко меняющиеся ответы (статистика) кэшируются на несколько
+секунд, а одновременные промахи по одному ключу ждут общий запрос:
+всплеск /stats из многих чатов стоит одного обращения к backend.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+import aiohttp
+
+# Таймаут запроса целиком и подключения (секунды). Для подключения берётся
+# sock_connect: connect в aiohttp включает и ожидание свободного соединения
+# пула, и всплеск запросов падал бы по таймауту при живом backend
+BACKEND_TIMEOUT = float(os.environ.get('BOT_BACKEND_TIMEOUT', 5))
+BACKEND_CONNECT_TIMEOUT = 2
+# Сколько раз повторить запрос после ошибки и пауза перед первым повтором
+BACKEND_RETRIES = 2
+BACKEND_RETRY_DELAY = 0.2
+BACKEND_POOL_SIZE = int(os.environ.get('BOT_BACKEND_POOL_SIZE', 20))
+# Сколько секунд статистика из кэша считается свежей
+STATS_CACHE_TTL = float(os.environ.get('BOT_STATS_CACHE_TTL', 30))
+CACHE_MAX_ENTRIES = 256
+# Сколько ждать строки потока событий: сервер шлёт ping каждые 15 секунд
+EVENTS_READ_TIMEOUT = 60
+
+
+class BackendError(Exception):
+    """Backend недоступен или ответил ошибкой"""
+
+
+class TTLCache:
+    """Ответы по ключу на ttl секунд с объединением одновременных промахов"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        # Ключ -> (момент устаревания по time.monotonic, значение)
+        self.entries = {}
+        # Ключ -> задача, которая сейчас загружает значение
+        self.inflight = {}
+
+    async def get(self, key, ttl, load):
+        """Значение из кэша или результат load(); ошибки load не кэшируются"""
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(load())
+            self.inflight[key] = task
+            task.add_done_callback(lambda done: self._store(key, ttl, done))
+        # Отмена одного ожидающего не отменяет загрузку для остальных
+        return await asyncio.shield(task)
+
+    def _store(self, key, ttl, task):
+        self.inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        now = time.monotonic()
+        if len(self.entries) >= self.max_entries:
+            self.entries = {k: e for k, e in self.entries.items() if e[0] > now}
+        self.entries[key] = (now + ttl, task.result())
+
+
+class BackendClient:
+    """Запросы бота к backend через общий пул соединений"""
+
+    def __init__(self, base_url, timeout=BACKEND_TIMEOUT, retries=BACKEND_RETRIES,
+                 pool_size=BACKEND_POOL_SIZE):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=BACKEND_CONNECT_TIMEOUT)
+        self.retries = retries
+        self.pool_size = pool_size
+        self.session = None
+        self.cache = TTLCache()
+
+    def _session(self):
+        # Сессия создаётся в работающем цикле событий, при первом запросе
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self.session
+
+    async def get_json(self, path, params=None):
+        """GET {base_url}{path} -> JSON; BackendError, если не удалось"""
+        url = self.base_url + path
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(BACKEND_RETRY_DELAY * 2 ** (attempt - 1))
+            try:
+                async with self._session().get(url, params=params) as response:
+                    if response.status >= 500:
+                        error = BackendError(f'{path}: HTTP {response.status}')
+                        continue
+                    if response.status != 200:
+                        raise BackendError(f'{path}: HTTP {response.status}')
+                    return await response.json()
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                error = BackendError(f'{path}: {e!r}')
+                logging.warning(f"Ошибка запроса к backend {path} (попытка {attempt + 1}): {e!r}")
+        raise error
+
+    async def cached_json(self, path, ttl):
+        return await self.cache.get(path, ttl, lambda: self.get_json(path))
+
+    async def stats(self):
+        """Общая статистика (/stats), не старше STATS_CACHE_TTL секунд"""
+        return await self.cached_json('/stats', STATS_CACHE_TTL)
+
+    async def events(self, url):
+        """Поток Server-Sent Events: пары (тип события, data) до обрыва
+
+        url - полный адрес или путь относительно base_url. Первой идёт пара
+        ('open', None), как только поток подключён: всё, что изменится
+        после неё, придёт в потоке. Повторов нет: переподключается вызывающий.
+        """
+        if '://' not in url:
+            url = self.base_url + url
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=BACKEND_CONNECT_TIMEOUT,
+                                        sock_read=EVENTS_READ_TIMEOUT)
+        try:
+            async with self._session().get(url, timeout=timeout,
+                                           headers={'Accept': 'text/event-stream'}) as response:
+                if response.status != 200:
+                    raise BackendError(f'{url}: HTTP {response.status}')
+                yield 'open', None
+                event_type, data = None, []
+                async for raw in response.content:
+                    line = raw.decode('utf-8').rstrip('\r\n')
+                    if not line:
+                        if data:
+                            payload = json.loads('\n'.join(data))
+                            yield event_type or payload.get('type'), payload.get('data')
+                        event_type, data = None, []
+                    elif not line.startswith(':'):
+                        field, _, value = line.partition(':')
+                        value = value[1:] if value.startswith(' ') else value
+                        if field == 'event':
+                            event_type = value
+                        elif field == 'data':
+                            data.append(value)
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+            raise BackendError(f'{url}: {e!r}')
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
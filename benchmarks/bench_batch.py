@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Импорт меток пакетом (DataStore.write_batch) и по одной (Table.put)
+
+Для каждого хранилища (log, flock, sqlite) во временном каталоге
+записывается MARKERS меток одним пакетом и по одной записи на метку.
+
+    python benchmarks/bench_batch.py
+    python benchmarks/bench_batch.py --markers 1000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import FileLockStorage, LogStorage, SQLiteStorage  # noqa: E402
+from store import DataStore  # noqa: E402
+
+MARKERS = 10000
+BACKENDS = {
+    'log': lambda directory: LogStorage(),
+    'flock': lambda directory: FileLockStorage(),
+    'sqlite': lambda directory: SQLiteStorage(os.path.join(directory, 'data.db')),
+}
+
+
+def new_marker(i):
+    return {'id': str(uuid.uuid4()), 'lat': 55.75 + i * 1e-5, 'lng': 37.61, 'comment': f'метка {i}',
+            'rating': 4, 'city': 'Москва', 'timestamp': datetime.now().isoformat()}
+
+
+def import_markers(backend, count, batched):
+    with tempfile.TemporaryDirectory() as directory:
+        storage = BACKENDS[backend](directory)
+        store = DataStore(storage, *(os.path.join(directory, name) for name in
+                                     ('markers.json', 'comments.json', 'routes.json')), sweep=False)
+        markers = [new_marker(i) for i in range(count)]
+        started = time.perf_counter()
+        if batched:
+            store.write_batch([(store.markers, 'put', marker) for marker in markers])
+        else:
+            for marker in markers:
+                store.markers.put(marker)
+        storage.sync()
+        elapsed = time.perf_counter() - started
+        assert len(store.markers.records) == count
+        return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--markers', type=int, default=MARKERS)
+    args = parser.parse_args()
+    print(f"Импорт {args.markers} меток: пакетом / по одной")
+    for backend in BACKENDS:
+        batched = import_markers(backend, args.markers, True)
+        single = import_markers(backend, args.markers, False)
+        print(f"  {backend:<6} {batched:.2f} с / {single:.2f} с")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Запросы бота к backend: сессия на запрос, общий пул и кэш /stats
+
+Запускает main.py, заполняет метки через /api/batch и отправляет всплеск
+из --burst одновременных запросов /api/stats (как /stats из многих чатов)
+тремя способами: новая aiohttp.ClientSession на каждый запрос (как бот
+делал раньше), BackendClient.get_json через общий пул и
+BackendClient.stats() с кэшем. Для каждого - время всплеска, задержки
+p50/p99 и сколько запросов дошло до backend. В конце - цена попадания
+в тёплый кэш.
+
+    python benchmarks/bench_bot_client.py [--burst 2000] [--markers 5000]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import aiohttp
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backend_client import BackendClient  # noqa: E402
+from servers import run_servers  # noqa: E402
+
+BACKEND_PORT = 5610
+WARM_LOOKUPS = 100000
+
+
+async def burst(lookup, count):
+    async def timed():
+        started = time.perf_counter()
+        await lookup()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    latencies = sorted(await asyncio.gather(*(timed() for _ in range(count))))
+    return time.perf_counter() - started, latencies
+
+
+def counted(client):
+    """Считает запросы BackendClient к backend"""
+    calls = [0]
+    get_json = client.get_json
+
+    async def wrapper(path, params=None):
+        calls[0] += 1
+        return await get_json(path, params)
+    client.get_json = wrapper
+    return calls
+
+
+async def run(api_url, count):
+    async def session_per_request():
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f'{api_url}/stats') as response:
+                return await response.json()
+
+    pooled = BackendClient(api_url)
+    pooled_calls = counted(pooled)
+    cached = BackendClient(api_url)
+    cached_calls = counted(cached)
+    modes = (('сессия на запрос', session_per_request, [count]),
+             ('общий пул', lambda: pooled.get_json('/stats'), pooled_calls),
+             ('пул и кэш', cached.stats, cached_calls))
+    for title, lookup, calls in modes:
+        elapsed, latencies = await burst(lookup, count)
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        print(f"  {title:<17} {elapsed * 1000:7.0f} мс, p50 {statistics.median(latencies) * 1000:6.0f} мс, "
+              f"p99 {p99 * 1000:6.0f} мс, запросов к backend {calls[0]}")
+
+    started = time.perf_counter()
+    for _ in range(WARM_LOOKUPS):
+        await cached.stats()
+    print(f"  попадание в кэш: {(time.perf_counter() - started) / WARM_LOOKUPS * 1e6:.2f} мкс")
+    await pooled.close()
+    await cached.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--burst', type=int, default=2000)
+    parser.add_argument('--markers', type=int, default=5000)
+    args = parser.parse_args()
+
+    backend_url = f'http://localhost:{BACKEND_PORT}'
+    with run_servers(('main.py', BACKEND_PORT, '/', {})):
+        operations = [{'action': 'create', 'type': 'marker', 'data': {
+            'lat': 55.0 + i % 100 * 0.01, 'lng': 37.0 + i // 100 * 0.01,
+            'comment': f'метка {i}', 'rating': 1 + i % 5}} for i in range(args.markers)]
+        requests.post(f'{backend_url}/api/batch', json={'operations': operations}).raise_for_status()
+        print(f"Всплеск {args.burst} одновременных /api/stats ({args.markers} меток):")
+        asyncio.run(run(f'{backend_url}/api', args.burst))
+
+
+if __name__ == '__main__':
+    main()
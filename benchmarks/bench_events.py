@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Рассылка событий подписчикам /api/events (events.EventHub)
+
+Без аргументов: запись меток в DataStore с подключённым EventHub и
+SUBSCRIBERS подписчиками в одном процессе - сколько стоит запись вместе
+с раскладкой события по очередям и сколько событий доставлено.
+
+С --stream-url и --backend-url: живой замер против запущенных main.py и
+stream.py (нужен aiohttp) - N соединений SSE, метки создаются через
+POST /api/markers, задержка считается до получения события всеми.
+С --live оба процесса запускаются сами (sqlite во временном каталоге).
+Задержку снизу ограничивает EVENTS_POLL_INTERVAL: stream.py узнаёт о
+записях main.py, опрашивая общее хранилище.
+
+    python benchmarks/bench_events.py
+    python benchmarks/bench_events.py --live --clients 1000
+    python benchmarks/bench_events.py --stream-url http://localhost:5001 \\
+        --backend-url http://localhost:5000 --clients 1000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from events import EventHub  # noqa: E402
+from storage import LogStorage  # noqa: E402
+from store import DataStore  # noqa: E402
+
+SUBSCRIBERS = (1, 1000, 10000)
+WRITES = 200
+LIVE_BACKEND_PORT = 5640
+LIVE_STREAM_PORT = 5641
+
+
+def new_marker(i):
+    return {'id': str(uuid.uuid4()), 'lat': 55.75 + i * 1e-4, 'lng': 37.61, 'comment': f'метка {i}',
+            'rating': 4, 'city': 'Москва', 'timestamp': datetime.now().isoformat()}
+
+
+def bench_in_process():
+    for subscribers in SUBSCRIBERS:
+        with tempfile.TemporaryDirectory() as directory:
+            store = DataStore(LogStorage(), *(os.path.join(directory, name) for name in
+                                              ('markers.json', 'comments.json', 'routes.json')),
+                              sweep=False)
+            hub = EventHub(queue_size=WRITES + 1)
+            store.markers.listen(hub.listener('marker'))
+            subscriptions = [hub.subscribe() for _ in range(subscribers)]
+            started = time.perf_counter()
+            for i in range(WRITES):
+                store.markers.put(new_marker(i))
+            elapsed = time.perf_counter() - started
+            delivered = sum(len(s.drain()) for s in subscriptions)
+            print(f"{subscribers:>6} подписчиков: {elapsed / WRITES * 1000:.3f} мс на запись, "
+                  f"{elapsed / (WRITES * subscribers) * 1e6:.2f} мкс на доставку, "
+                  f"доставлено {delivered}/{WRITES * subscribers}")
+
+
+async def bench_live(stream_url, backend_url, clients, writes):
+    import aiohttp
+
+    received = {}
+    connected = asyncio.Event()
+    ready = 0
+
+    async def client(session):
+        nonlocal ready
+        async with session.get(stream_url.rstrip('/') + '/api/events',
+                               timeout=aiohttp.ClientTimeout(total=None)) as response:
+            ready += 1
+            if ready == clients:
+                connected.set()
+            async for line in response.content:
+                if line.startswith(b'data:') and b'marker.put' in line:
+                    marker_id = line.split(b'"id":"', 1)[1].split(b'"', 1)[0].decode()
+                    received.setdefault(marker_id, []).append(time.perf_counter())
+
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        tasks = [asyncio.create_task(client(session)) for _ in range(clients)]
+        await asyncio.wait_for(connected.wait(), 60)
+        latencies = []
+        for i in range(writes):
+            sent = time.perf_counter()
+            async with session.post(backend_url.rstrip('/') + '/api/markers', json={
+                    'lat': 55.75, 'lng': 37.61, 'comment': f'замер {i}', 'rating': 3}) as response:
+                marker_id = (await response.json())['id']
+            while len(received.get(marker_id, ())) < clients:
+                await asyncio.sleep(0.001)
+            latencies.append(max(received[marker_id]) - sent)
+        for task in tasks:
+            task.cancel()
+    latencies.sort()
+    print(f"{clients} клиентов, {writes} меток: медиана {latencies[len(latencies) // 2] * 1000:.1f} мс, "
+          f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} мс до последнего клиента")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--stream-url')
+    parser.add_argument('--backend-url')
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--writes', type=int, default=50)
+    parser.add_argument('--live', action='store_true', help='запустить main.py и stream.py')
+    args = parser.parse_args()
+    if args.live:
+        from servers import run_servers
+        with run_servers(('main.py', LIVE_BACKEND_PORT, '/', {}),
+                         ('stream.py', LIVE_STREAM_PORT, '/health', {})):
+            asyncio.run(bench_live(f'http://localhost:{LIVE_STREAM_PORT}',
+                                   f'http://localhost:{LIVE_BACKEND_PORT}', args.clients, args.writes))
+    elif args.stream_url and args.backend_url:
+        asyncio.run(bench_live(args.stream_url, args.backend_url, args.clients, args.writes))
+    else:
+        bench_in_process()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Поиск ближайших меток по сетке (geo.nearest_records)
+
+MARKERS меток: 90% - вокруг городов из cities.json, остальные - по всей
+Земле. Для QUERIES случайных точек (тоже в основном у городов) меряется
+время k-NN и поиска по радиусу. Затем на CHECK_MARKERS метках результаты
+сверяются с полным перебором, в том числе у полюсов и 180-го меридиана.
+
+    python benchmarks/bench_nearby.py
+    python benchmarks/bench_nearby.py --markers 100000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geo import grid_cell, haversine_m, nearest_records  # noqa: E402
+
+MARKERS = 1000000
+QUERIES = 300
+CHECK_MARKERS = 20000
+CHECK_QUERIES = 200
+CASES = (('k=10', 10, None), ('k=100', 100, None),
+         ('radius 1 km', None, 1000), ('radius 10 km', None, 10000))
+
+
+def load_cities():
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cities.json')
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['cities']
+
+
+def random_point(rng, cities):
+    if rng.random() < 0.9:
+        city = rng.choice(cities)
+        # Около 0.1 градуса (10 км) вокруг центра города
+        return city['lat'] + rng.gauss(0, 0.1), city['lng'] + rng.gauss(0, 0.1)
+    return rng.uniform(-90, 90), rng.uniform(-180, 180)
+
+
+def build_grid(points):
+    grid = {}
+    for i, (lat, lng) in enumerate(points):
+        lat = max(-90.0, min(90.0, lat))
+        grid.setdefault(grid_cell(lat, lng), {})[i] = {'id': i, 'lat': lat, 'lng': lng}
+    return grid
+
+
+def bench(count):
+    rng = random.Random(1)
+    cities = load_cities()
+    grid = build_grid(random_point(rng, cities) for _ in range(count))
+    queries = [random_point(rng, cities) for _ in range(QUERIES)]
+    print(f"{count} меток, {QUERIES} запросов:")
+    for title, k, radius in CASES:
+        started = time.perf_counter()
+        for lat, lng in queries:
+            nearest_records(grid, lat, lng, k=k, radius_m=radius)
+        elapsed = time.perf_counter() - started
+        print(f"  {title:<13} {elapsed / QUERIES * 1000:.1f} мс на запрос")
+
+
+def check():
+    rng = random.Random(2)
+    cities = load_cities()
+    points = [random_point(rng, cities) for _ in range(CHECK_MARKERS)]
+    # Метки у полюсов и по обе стороны 180-го меридиана
+    points += [(rng.uniform(85, 90), rng.uniform(-180, 180)) for _ in range(200)]
+    points += [(rng.uniform(60, 70), rng.choice((-180.0, 180.0)) + rng.uniform(-0.5, 0.5))
+               for _ in range(200)]
+    points += [(65.0, 180.0), (65.0, -180.0)]
+    grid = build_grid(points)
+    records = [record for cell in grid.values() for record in cell.values()]
+    queries = [random_point(rng, cities) for _ in range(CHECK_QUERIES)]
+    queries += [(89.9, 0.0), (-89.9, 90.0), (65.0, 180.0), (65.0, -179.9), (65.0, 179.9)]
+    mismatches = 0
+    for lat, lng in queries:
+        distances = sorted(haversine_m((lat, lng), (r['lat'], r['lng'])) for r in records)
+        for _, k, radius in CASES:
+            expected = [d for d in distances if radius is None or d <= radius][:k]
+            found = [d for d, _ in nearest_records(grid, lat, lng, k=k, radius_m=radius)]
+            if [round(d, 6) for d in found] != [round(d, 6) for d in expected]:
+                mismatches += 1
+    print(f"Сверка с перебором на {len(records)} метках: {len(queries) * len(CASES)} запросов, "
+          f"расхождений {mismatches}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--markers', type=int, default=MARKERS)
+    args = parser.parse_args()
+    bench(args.markers)
+    check()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Рассылка уведомлений подписчикам города (notifications.Notifier)
+
+Настоящий Telegram здесь не нужен: FakeTelegram пропускает не больше
+--limit сообщений в секунду всего и одно в секунду на чат, сверх
+этого отвечает 429 (RetryLater). Время сжато в --speedup раз: все
+интервалы и пределы пересчитываются, результаты выводятся в обычных
+секундах. Нагрузка - --subscribers чатов (половина подписана на Казань,
+остальные на Казань или Самару) и 20 новых меток в Казани за 2 с.
+
+Сравниваются отправка каждого события сразу в каждый чат и очередь
+Notifier со сводками и ограничением темпа.
+
+    python benchmarks/bench_notify.py
+    python benchmarks/bench_notify.py --limit 20 --speedup 40
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from notifications import Notifier, RetryLater, Subscriptions, format_digest  # noqa: E402
+
+EVENTS = 20
+EVENTS_PERIOD = 2.0
+SEND_LATENCY = 0.2
+RETRY_AFTER = 5.0
+NAIVE_CONCURRENCY = 64
+
+
+class FakeTelegram:
+    """Пределы Bot API: limit сообщений в секунду всего и одно в секунду на чат"""
+
+    def __init__(self, limit, speedup):
+        self.limit = limit
+        self.speedup = speedup
+        self.window = collections.deque()
+        self.last = {}
+        self.sent = 0
+        self.finished = None
+        self.flood = 0
+        self.events = 0
+
+    async def send(self, chat_id, text):
+        await asyncio.sleep(SEND_LATENCY / self.speedup)
+        now = time.monotonic()
+        while self.window and self.window[0] < now - 1.0 / self.speedup:
+            self.window.popleft()
+        if len(self.window) >= self.limit or now - self.last.get(chat_id, -1e9) < 1.0 / self.speedup:
+            self.flood += 1
+            raise RetryLater(RETRY_AFTER / self.speedup)
+        self.window.append(now)
+        self.last[chat_id] = now
+        self.sent += 1
+        self.finished = now
+        for line in text.split('\n'):
+            if line.startswith(('📍', '💬')):
+                self.events += 1
+            elif line.startswith('… и ещё'):
+                self.events += int(line.split()[-1])
+
+
+def load_subscriptions(directory, count):
+    rng = random.Random(1)
+    data = {str(chat): ['Казань' if chat % 2 == 0 else rng.choice(['Казань', 'Самара'])]
+            for chat in range(count)}
+    path = os.path.join(directory, 'subscriptions.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    return Subscriptions(path)
+
+
+def new_events():
+    return [{'kind': 'marker', 'city': 'Казань', 'text': f'место {i}', 'rating': 4}
+            for i in range(EVENTS)]
+
+
+async def run_naive(subscriptions, telegram):
+    semaphore = asyncio.Semaphore(NAIVE_CONCURRENCY)
+
+    async def send(chat_id, event):
+        async with semaphore:
+            try:
+                await telegram.send(chat_id, format_digest([event]))
+            except RetryLater:
+                pass
+
+    await asyncio.gather(*(send(chat_id, event) for event in new_events()
+                           for chat_id in subscriptions.chats('Казань')))
+
+
+async def run_queue(subscriptions, telegram, speedup):
+    notifier = Notifier(telegram.send, subscriptions, rate=25 * speedup,
+                        chat_interval=3 / speedup, digest_delay=10 / speedup)
+    notifier.start()
+    publish_times = []
+    for event in new_events():
+        started = time.perf_counter()
+        notifier.publish(event)
+        publish_times.append(time.perf_counter() - started)
+        await asyncio.sleep(EVENTS_PERIOD / EVENTS / speedup)
+    # Сводка может ждать паузы после 429 вне очередей: ждём, пока отправка не затихнет
+    while True:
+        while notifier.pending or notifier.schedule or notifier.ready.qsize():
+            await asyncio.sleep(0.01)
+        sent = telegram.sent
+        await asyncio.sleep((RETRY_AFTER + 2 * SEND_LATENCY) / speedup)
+        if telegram.sent == sent and not notifier.pending:
+            break
+    await notifier.stop()
+    return notifier.stats(), sorted(publish_times)[len(publish_times) // 2]
+
+
+async def main(args):
+    chats = None
+    for mode in ('naive', 'queue'):
+        with tempfile.TemporaryDirectory() as directory:
+            subscriptions = load_subscriptions(directory, args.subscribers)
+            chats = len(subscriptions.chats('Казань'))
+            telegram = FakeTelegram(args.limit, args.speedup)
+            started = time.monotonic()
+            if mode == 'naive':
+                await run_naive(subscriptions, telegram)
+                extra = ''
+            else:
+                stats, publish = await run_queue(subscriptions, telegram, args.speedup)
+                extra = f", повторов {stats['retried']}, потеряно {stats['dropped']}, publish события {publish * 1000:.1f} мс (медиана)"
+            elapsed = (telegram.finished - started) * args.speedup
+            print(f"{mode:<5} сообщений {telegram.sent}, 429: {telegram.flood}, "
+                  f"событий доставлено {telegram.events}/{EVENTS * chats}, {elapsed:.0f} с{extra}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--subscribers', type=int, default=10000)
+    parser.add_argument('--limit', type=int, default=30, help='сообщений в секунду у FakeTelegram')
+    parser.add_argument('--speedup', type=float, default=40)
+    # Предупреждения о 429 от FakeTelegram только мешают читать итог
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Накладные расходы прокси /api/* в server.py
+
+Запускает main.py и server.py, заполняет метки через /api/batch и
+сравнивает одни и те же GET напрямую к backend и через прокси (обе
+стороны - keep-alive сессия requests). Заодно проверяет, что в ответе
+прокси заголовки Server и Date не повторяются.
+
+    python benchmarks/bench_proxy.py [--markers 5000] [--requests 300]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from servers import run_servers  # noqa: E402
+
+BACKEND_PORT = 5600
+PROXY_PORT = 5601
+
+
+def timings(session, url, count):
+    result = []
+    for _ in range(count):
+        started = time.perf_counter()
+        response = session.get(url)
+        response.content
+        result.append(time.perf_counter() - started)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--markers', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=300)
+    args = parser.parse_args()
+
+    backend_url = f'http://localhost:{BACKEND_PORT}'
+    proxy_url = f'http://localhost:{PROXY_PORT}'
+    with run_servers(('main.py', BACKEND_PORT, '/', {}),
+                     ('server.py', PROXY_PORT, '/health', {'BACKEND_URL': backend_url})):
+        operations = [{'action': 'create', 'type': 'marker', 'data': {
+            'lat': 55.0 + i % 100 * 0.01, 'lng': 37.0 + i // 100 * 0.01,
+            'comment': f'метка {i}', 'rating': 1 + i % 5}} for i in range(args.markers)]
+        requests.post(f'{backend_url}/api/batch', json={'operations': operations}).raise_for_status()
+
+        headers = requests.get(f'{proxy_url}/api/stats').raw.headers
+        for name in ('Server', 'Date'):
+            print(f"{name} в ответе прокси: {len(headers.getlist(name))} раз")
+
+        direct, proxied = requests.Session(), requests.Session()
+        for path in ('/api/stats', '/api/markers', '/api/markers?limit=100'):
+            # Прогрев: кэш ответов backend и соединения пула
+            timings(direct, backend_url + path, 5)
+            timings(proxied, proxy_url + path, 5)
+            a = statistics.median(timings(direct, backend_url + path, args.requests)) * 1000
+            b = statistics.median(timings(proxied, proxy_url + path, args.requests)) * 1000
+            size = len(direct.get(backend_url + path).content)
+            print(f"{path:<24} {size / 1024:8.1f} КБ: напрямую {a:6.2f} мс, "
+                  f"через прокси {b:6.2f} мс (+{b - a:.2f} мс)")
+
+
+if __name__ == '__main__':
+    main()
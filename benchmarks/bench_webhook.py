@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Приём обновлений бота: долгий опрос (dp.start_polling) и webhook (webhook.py)
+
+Настоящий Telegram заменён локальным сервером Bot API (FakeBotAPI), бот
+направлен на него так же, как TELEGRAM_API_URL в bot.py. Обработчик
+каждого сообщения ждёт --work мс (обращение к backend) и отвечает
+sendMessage. В каждом режиме бот получает всплеск из --updates
+сообщений: при опросе они отдаются через getUpdates, в режиме webhook
+приходят POST-запросами по --connections одновременно (max_connections
+у Telegram, по умолчанию 40). Задержка - от появления обновления до
+ответа бота.
+
+    python benchmarks/bench_webhook.py [--updates 5000] [--work 20]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import aiohttp
+from aiogram import Bot, Dispatcher, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import webhook  # noqa: E402
+
+API_PORT = 5620
+WEBHOOK_PORT = 5621
+TOKEN = '123456:bench-token'
+SECRET = 'bench-secret'
+GET_UPDATES_LIMIT = 100
+
+
+class FakeBotAPI:
+    """Bot API с очередью обновлений для getUpdates и учётом ответов бота"""
+
+    def __init__(self):
+        self.updates = []
+        self.arrived = asyncio.Event()
+        # chat_id -> момент появления обновления и момент ответа
+        self.created = {}
+        self.answered = {}
+        self.done = asyncio.Event()
+        self.expected = 0
+        self.get_updates_calls = 0
+
+    def new_update(self, update_id):
+        self.created[update_id] = time.perf_counter()
+        return {'update_id': update_id, 'message': {
+            'message_id': update_id, 'date': int(time.time()), 'text': 'ping',
+            'chat': {'id': update_id, 'type': 'private'},
+            'from': {'id': update_id, 'is_bot': False, 'first_name': 'bench'}}}
+
+    def publish(self, count):
+        self.expected = count
+        self.updates.extend(self.new_update(i + 1) for i in range(count))
+        self.arrived.set()
+
+    async def handle(self, request):
+        method = request.match_info['method'].lower()
+        data = await request.post()
+        if method == 'getme':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        elif method == 'getupdates':
+            result = await self.get_updates(int(data.get('offset', 0)), float(data.get('timeout', 0)))
+        elif method == 'sendmessage':
+            chat_id = int(data['chat_id'])
+            self.answered[chat_id] = time.perf_counter()
+            if len(self.answered) == self.expected:
+                self.done.set()
+            result = {'message_id': chat_id, 'date': int(time.time()), 'text': data['text'],
+                      'chat': {'id': chat_id, 'type': 'private'}}
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def get_updates(self, offset, timeout):
+        self.get_updates_calls += 1
+        self.updates = [u for u in self.updates if u['update_id'] >= offset]
+        if not self.updates:
+            self.arrived.clear()
+            try:
+                await asyncio.wait_for(self.arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        return self.updates[:GET_UPDATES_LIMIT]
+
+    def latencies(self):
+        return sorted(self.answered[i] - self.created[i] for i in self.answered)
+
+
+def create_dispatcher(work):
+    router = Router()
+
+    @router.message()
+    async def answer(message):
+        await asyncio.sleep(work)
+        await message.answer('pong')
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+async def start_site(app, port):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, 'localhost', port).start()
+    return runner
+
+
+async def run_polling(api, bot, dp, count):
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+    # Первый getUpdates уже ждёт: обновления появляются во время долгого опроса
+    while not api.get_updates_calls:
+        await asyncio.sleep(0.01)
+    started = time.perf_counter()
+    api.publish(count)
+    await api.done.wait()
+    elapsed = time.perf_counter() - started
+    await dp.stop_polling()
+    await polling
+    return elapsed
+
+
+async def run_webhook(api, bot, dp, count, connections):
+    app = webhook.create_webhook_app(dp, bot, f'http://localhost:{WEBHOOK_PORT}', SECRET)
+    runner = await start_site(app, WEBHOOK_PORT)
+    url = f'http://localhost:{WEBHOOK_PORT}{webhook.WEBHOOK_PATH}'
+    queue = asyncio.Queue()
+
+    async def deliver(session):
+        # Как Telegram: следующее обновление по соединению - после ответа на предыдущее
+        while not queue.empty():
+            update = queue.get_nowait()
+            async with session.post(url, json=update, headers={webhook.SECRET_HEADER: SECRET}) as response:
+                assert response.status == 200, response.status
+
+    started = time.perf_counter()
+    api.expected = count
+    for i in range(count):
+        queue.put_nowait(api.new_update(i + 1))
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=connections)) as session:
+        await asyncio.gather(*(deliver(session) for _ in range(connections)))
+    await api.done.wait()
+    elapsed = time.perf_counter() - started
+    await runner.cleanup()
+    return elapsed
+
+
+async def main(args):
+    for mode in ('polling', 'webhook'):
+        api = FakeBotAPI()
+        api_runner = await start_site(_api_app(api), API_PORT)
+        session = AiohttpSession(api=TelegramAPIServer.from_base(f'http://localhost:{API_PORT}'))
+        bot = Bot(TOKEN, session=session)
+        dp = create_dispatcher(args.work / 1000)
+        if mode == 'polling':
+            elapsed = await run_polling(api, bot, dp, args.updates)
+            extra = f", getUpdates {api.get_updates_calls}"
+        else:
+            elapsed = await run_webhook(api, bot, dp, args.updates, args.connections)
+            extra = f", одновременно не больше {webhook.WEBHOOK_MAX_CONCURRENCY}"
+        await bot.session.close()
+        await api_runner.cleanup()
+        latencies = api.latencies()
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        print(f"  {mode:<8} {args.updates / elapsed:6.0f} обновлений/с, "
+              f"задержка p50 {statistics.median(latencies) * 1000:5.0f} мс, "
+              f"p99 {p99 * 1000:5.0f} мс{extra}")
+
+
+def _api_app(api):
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', api.handle)
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--work', type=float, default=20, help='мс работы обработчика')
+    parser.add_argument('--connections', type=int, default=40)
+    args = parser.parse_args()
+    print(f"{args.updates} обновлений, обработчик {args.work:.0f} мс:")
+    asyncio.run(main(args))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Размер и разбор ответов в обычном JSON и компактном формате (wire.py)
+
+MARKERS меток и ROUTES маршрутов по ROUTE_POINTS точек сериализуются
+так же, как cached_json в main.py: обычный JSON - через app.json.dumps,
+компактный - упакованный и без пробелов. Для обоих считаются размер
+и размер после gzip, наибольшая ошибка координат после распаковки и,
+если установлен node, время JSON.parse с распаковкой той же функцией
+unpackMarkers/unpackRoutes, что в index.html.
+
+    python benchmarks/bench_wire.py
+"""
+
+import gzip
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+
+from wire import compact_markers, compact_routes, decode_polyline  # noqa: E402
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MARKERS = 10000
+ROUTES = 1000
+ROUTE_POINTS = 1000
+NODE_RUNS = 5
+
+NODE_SCRIPT = """
+const fs = require('fs');
+const [client, file, kind, runs] = process.argv.slice(2);
+eval(fs.readFileSync(client, 'utf8'));
+const body = fs.readFileSync(file, 'utf8');
+const unpack = kind === 'markers' ? unpackMarkers : unpackRoutes;
+const compact = file.endsWith('.compact.json');
+const times = [];
+for (let i = 0; i < Number(runs); i++) {
+    const started = process.hrtime.bigint();
+    const data = JSON.parse(body);
+    if (compact) unpack(data);
+    times.push(Number(process.hrtime.bigint() - started) / 1e6);
+}
+console.log(Math.min(...times).toFixed(0) + '-' + Math.max(...times).toFixed(0));
+"""
+
+
+def new_markers(rng):
+    return [{'id': str(uuid.uuid4()), 'lat': rng.uniform(43, 70), 'lng': rng.uniform(28, 180),
+             'comment': f'метка {i}', 'rating': rng.randint(1, 5), 'city': 'Москва',
+             'timestamp': datetime.now().isoformat(), 'user_id': str(rng.randint(1, 1000)),
+             'revision': i + 1} for i in range(MARKERS)]
+
+
+def new_routes(rng):
+    routes = []
+    for i in range(ROUTES):
+        lat, lng = rng.uniform(43, 70), rng.uniform(28, 180)
+        coordinates = []
+        for _ in range(ROUTE_POINTS):
+            # Шаг GPS-трека: несколько метров
+            lat += rng.gauss(0, 3e-5)
+            lng += rng.gauss(0, 5e-5)
+            coordinates.append([lat, lng])
+        routes.append({'id': str(uuid.uuid4()), 'user_id': str(rng.randint(1, 1000)),
+                       'created_at': datetime.now().isoformat(), 'coordinates': coordinates,
+                       'revision': i + 1})
+    return routes
+
+
+def client_code():
+    """decodePolyline, unpackMarkers и unpackRoutes из index.html"""
+    with open(os.path.join(PROJECT_DIR, 'index.html'), encoding='utf-8') as f:
+        html = f.read()
+    precision = re.search(r'const POLYLINE_PRECISION = \d+;', html).group(0)
+    start = html.index('function decodePolyline')
+    end = html.index('// Загрузка изменений маршрутов')
+    return precision + '\n' + html[start:end]
+
+
+def max_error(original, decoded):
+    return max(abs(a - b) for p, q in zip(original, decoded) for a, b in zip(p, q))
+
+
+def main():
+    rng = random.Random(1)
+    dumps = Flask(__name__).json.dumps
+    node = shutil.which('node')
+    payloads = {'markers': (new_markers(rng), compact_markers),
+                'routes': (new_routes(rng), compact_routes)}
+    with tempfile.TemporaryDirectory() as directory:
+        client = os.path.join(directory, 'client.js')
+        with open(client, 'w', encoding='utf-8') as f:
+            f.write(client_code())
+        script = os.path.join(directory, 'parse.js')
+        with open(script, 'w', encoding='utf-8') as f:
+            f.write(NODE_SCRIPT)
+        for kind, (records, pack) in payloads.items():
+            packed = pack(records)
+            bodies = {
+                'json': dumps(records).encode('utf-8'),
+                'compact': json.dumps(packed, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+            }
+            if kind == 'markers':
+                error = max_error([(m['lat'], m['lng']) for m in records], decode_polyline(packed['position']))
+            else:
+                error = max(max_error(r['coordinates'], decode_polyline(p['polyline']))
+                            for r, p in zip(records, packed))
+            print(f"{kind} ({len(records)}), ошибка координат {error:.1e} градуса:")
+            for name, body in bodies.items():
+                line = f"  {name:<8} {len(body) / 1e6:6.2f} МБ, gzip {len(gzip.compress(body, 6)) / 1e6:5.2f} МБ"
+                if node:
+                    path = os.path.join(directory, f'{kind}.{name}.json')
+                    with open(path, 'wb') as f:
+                        f.write(body)
+                    parse = subprocess.run([node, script, client, path, kind, str(NODE_RUNS)],
+                                           capture_output=True, text=True, check=True).stdout.strip()
+                    line += f", node {parse} мс"
+                print(line)
+
+
+if __name__ == '__main__':
+    main()
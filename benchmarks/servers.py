@@ -0,0 +1,43 @@
+"""Запуск main.py, server.py и stream.py во временном каталоге данных для замеров"""
+
+import contextlib
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.05)
+    raise RuntimeError(f'{url} не ответил за {timeout} с')
+
+
+@contextlib.contextmanager
+def run_servers(*commands, storage_backend='sqlite'):
+    """commands: (скрипт, порт, путь проверки, доп. окружение); отдаёт каталог данных"""
+    with tempfile.TemporaryDirectory() as directory:
+        processes = []
+        try:
+            for script, port, health, env in commands:
+                process_env = dict(os.environ, PORT=str(port), STREAM_PORT=str(port),
+                                   STORAGE_BACKEND=storage_backend, **env)
+                processes.append(subprocess.Popen(
+                    [sys.executable, os.path.join(PROJECT_DIR, script)], cwd=directory,
+                    env=process_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+                wait_ready(f'http://localhost:{port}{health}')
+            yield directory
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait(10)
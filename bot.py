@@ -1,178 +1,109 @@
 import asyncio
 import logging
+import os
 from aiogram import Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
 from aiogram.filters import Command
-from aiogram.types import WebAppInfo, InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.types import (WebAppInfo, InlineKeyboardButton, InlineKeyboardMarkup,
+                           InlineQueryResultArticle, InputTextMessageContent)
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-import aiohttp
 import json
+from functools import lru_cache
+
+from backend_client import BackendClient, BackendError
+from city_catalog import get_catalog
+from notifications import ChatUnavailable, Notifier, RetryLater, Subscriptions, follow_changes
 
 # Конфигурация
 API_TOKEN = 'YOUR_BOT_TOKEN_HERE'  # Замените на ваш токен
 BACKEND_URL = 'http://localhost:5000/api'
+# Режим получения обновлений: polling (getUpdates) или webhook (см. webhook.py)
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+# Публичный https-адрес бота для webhook, секрет и порт локального сервера
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', 8443))
+# Другой сервер Bot API (локальный telegram-bot-api или тестовый)
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL')
+# Поток изменений backend для уведомлений (stream.py, порт 5001)
+EVENTS_URL = os.environ.get('EVENTS_URL', 'http://localhost:5001/api/events')
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 
 # Инициализация бота и диспетчера
-bot = Bot(token=API_TOKEN)
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=API_TOKEN, session=session)
 dp = Dispatcher()
+backend = BackendClient(BACKEND_URL)
+
+# Каталог городов (city_catalog.py, данные в cities.json), общий с backend
+catalog = get_catalog()
+
+# Отправка сводки уведомлений; ошибки Telegram переводятся для очереди (notifications.py)
+async def send_notification(chat_id, text):
+    try:
+        await bot.send_message(chat_id, text, parse_mode="HTML", disable_web_page_preview=True)
+    except TelegramRetryAfter as e:
+        raise RetryLater(e.retry_after)
+    except TelegramForbiddenError as e:
+        raise ChatUnavailable(str(e))
+    except TelegramBadRequest as e:
+        if 'chat not found' in str(e).lower():
+            raise ChatUnavailable(str(e))
+        raise
+
+# Подписки на новые метки и комментарии городов и очередь их отправки
+subscriptions = Subscriptions()
+notifier = Notifier(send_notification, subscriptions)
+notifications_task = None
 
-# Список городов России
-CITIES = [
-    'Москва', 'Санкт-Петербург', 'Новосибирск', 'Екатеринбург', 'Казань',
-    'Нижний Новгород', 'Челябинск', 'Самара', 'Омск', 'Ростов-на-Дону',
-    'Уфа', 'Красноярск', 'Пермь', 'Воронеж', 'Волгоград', 'Краснодар',
-    'Саратов', 'Тюмень', 'Тольятти', 'Ижевск', 'Барнаул', 'Ульяновск',
-    'Иркутск', 'Хабаровск', 'Ярославль', 'Владивосток', 'Махачкала',
-    'Томск', 'Оренбург', 'Кемерово', 'Новокузнецк', 'Рязань', 'Астрахань',
-    'Набережные Челны', 'Пенза', 'Липецк', 'Киров', 'Чебоксары', 'Тула',
-    'Калининград', 'Курск', 'Улан-Удэ', 'Ставрополь', 'Сочи', 'Иваново',
-    'Брянск', 'Белгород', 'Архангельск', 'Владимир', 'Севастополь', 'Чита',
-    'Грозный', 'Калуга', 'Смоленск', 'Вологда', 'Курган', 'Орёл', 'Армавир',
-    'Стерлитамак', 'Череповец', 'Владикавказ', 'Мурманск', 'Сургут', 'Волжский',
-    'Саранск', 'Уссурийск', 'Йошкар-Ола', 'Новороссийск', 'Сыктывкар', 'Нижнекамск',
-    'Шахты', 'Дзержинск', 'Орск', 'Бийск', 'Энгельс', 'Благовещенск', 'Рыбинск',
-    'Прокопьевск', 'Нальчик', 'Балаково', 'Ухта', 'Северодвинск', 'Рубцовск',
-    'Сызрань', 'Королёв', 'Владимир', 'Мытищи', 'Красногорск', 'Артём', 'Люберцы',
-    'Балашиха', 'Старый Оскол', 'Элиста', 'Бердск', 'Находка', 'Абакан', 'Рубцовск',
-    'Салават', 'Усть-Илимск', 'Миасс', 'Ангарск', 'Котлас', 'Петрозаводск', 'Стерлитамак'
-]
-
-# Геокодинг городов (координаты)
-CITY_COORDINATES = {
-    'Москва': [55.7558, 37.6176],
-    'Санкт-Петербург': [59.9311, 30.3609],
-    'Новосибирск': [55.0084, 82.9357],
-    'Екатеринбург': [56.8519, 60.6122],
-    'Казань': [55.8304, 49.0661],
-    'Нижний Новгород': [56.2965, 43.9361],
-    'Челябинск': [55.1644, 61.4368],
-    'Самара': [53.2001, 50.1500],
-    'Омск': [54.9924, 73.3686],
-    'Ростов-на-Дону': [47.2357, 39.7015],
-    'Уфа': [54.7388, 55.9721],
-    'Красноярск': [56.0184, 92.8672],
-    'Пермь': [58.0105, 56.2502],
-    'Воронеж': [51.6720, 39.1843],
-    'Волгоград': [48.7080, 44.5133],
-    'Краснодар': [45.0355, 38.9753],
-    'Саратов': [51.5924, 46.0347],
-    'Тюмень': [57.1522, 65.5272],
-    'Тольятти': [53.5078, 49.4204],
-    'Ижевск': [56.8519, 53.2324],
-    'Барнаул': [53.3548, 83.7698],
-    'Ульяновск': [54.3176, 48.3702],
-    'Иркутск': [52.2896, 104.2806],
-    'Хабаровск': [48.4802, 135.0719],
-    'Ярославль': [57.6261, 39.8875],
-    'Владивосток': [43.1198, 131.8869],
-    'Махачкала': [42.9849, 47.5047],
-    'Томск': [56.4977, 84.9744],
-    'Оренбург': [51.7727, 55.0988],
-    'Кемерово': [55.3904, 86.0468],
-    'Новокузнецк': [53.7945, 87.2088],
-    'Рязань': [54.6269, 39.6916],
-    'Астрахань': [46.3588, 48.0506],
-    'Набережные Челны': [55.7436, 52.3958],
-    'Пенза': [53.2007, 45.0046],
-    'Липецк': [52.6031, 39.5708],
-    'Киров': [58.6035, 49.6668],
-    'Чебоксары': [56.1322, 47.2519],
-    'Тула': [54.1961, 37.6182],
-    'Калининград': [54.7074, 20.5072],
-    'Курск': [51.7373, 36.1873],
-    'Улан-Удэ': [51.8335, 107.5841],
-    'Ставрополь': [45.0428, 41.9734],
-    'Сочи': [43.6028, 39.7342],
-    'Иваново': [57.0004, 40.9739],
-    'Брянск': [53.2521, 34.3717],
-    'Белгород': [50.5977, 36.5858],
-    'Архангельск': [64.5473, 40.5602],
-    'Владимир': [56.1296, 40.4066],
-    'Севастополь': [44.6166, 33.5254],
-    'Чита': [52.0515, 113.4719],
-    'Грозный': [43.3178, 45.6949],
-    'Калуга': [54.5293, 36.2754],
-    'Смоленск': [54.7818, 32.0401],
-    'Вологда': [59.2239, 39.8839],
-    'Курган': [55.4649, 65.3053],
-    'Орёл': [52.9686, 36.0703],
-    'Армавир': [44.9892, 41.1234],
-    'Стерлитамак': [53.6306, 55.9496],
-    'Череповец': [59.1339, 37.9093],
-    'Владикавказ': [43.0253, 44.6818],
-    'Мурманск': [68.9792, 33.0925],
-    'Сургут': [61.2540, 73.3962],
-    'Волжский': [48.7975, 44.7469],
-    'Саранск': [54.1838, 45.1749],
-    'Уссурийск': [43.7973, 131.9527],
-    'Йошкар-Ола': [56.6324, 47.8842],
-    'Новороссийск': [44.7239, 37.7683],
-    'Сыктывкар': [61.6748, 50.8474],
-    'Нижнекамск': [55.6366, 51.8245],
-    'Шахты': [47.7085, 40.2159],
-    'Дзержинск': [56.2376, 43.4599],
-    'Орск': [51.2296, 58.4751],
-    'Бийск': [52.5186, 85.2072],
-    'Энгельс': [51.4856, 46.1168],
-    'Благовещенск': [50.2908, 127.5272],
-    'Рыбинск': [58.0484, 38.8584],
-    'Прокопьевск': [53.8834, 86.7193],
-    'Нальчик': [43.4975, 43.6079],
-    'Балаково': [52.0278, 47.8007],
-    'Ухта': [63.5671, 53.6835],
-    'Северодвинск': [64.5622, 39.8182],
-    'Рубцовск': [51.5273, 81.2188],
-    'Сызрань': [53.1586, 48.4681],
-    'Королёв': [55.9142, 37.8255],
-    'Мытищи': [55.9104, 37.7365],
-    'Красногорск': [55.8314, 37.3315],
-    'Артём': [43.3594, 132.1884],
-    'Люберцы': [55.6758, 37.8939],
-    'Балашиха': [55.8094, 37.9581],
-    'Старый Оскол': [51.3026, 37.8417],
-    'Элиста': [46.3078, 44.2558],
-    'Бердск': [54.7551, 83.0967],
-    'Находка': [42.8240, 132.8925],
-    'Абакан': [53.7156, 91.4292],
-    'Салават': [53.3616, 55.9246],
-    'Усть-Илимск': [58.0006, 102.6619],
-    'Миасс': [55.0475, 60.1076],
-    'Ангарск': [52.5448, 103.8884],
-    'Котлас': [61.2540, 46.6333],
-    'Петрозаводск': [61.7849, 34.3469],
-    'Стерлитамак': [53.6306, 55.9496]
-}
-
-# Функция для создания клавиатуры с городами
-def create_city_keyboard():
+# Адрес карты города в WebApp
+def webapp_url(city):
+    coords = catalog.coordinates(city) or [55.7558, 37.6176]  # По умолчанию Москва
+    return f"http://localhost:8080/webapp/index.html?city={city}&lat={coords[0]}&lng={coords[1]}"
+
+# Функция для создания клавиатуры с городами (одной страницы каталога)
+def build_city_keyboard(page):
     builder = InlineKeyboardBuilder()
     
     # Группируем города по 3 в ряд
-    for i in range(0, len(CITIES), 3):
-        row = []
-        for j in range(3):
-            if i + j < len(CITIES):
-                city = CITIES[i + j]
-                row.append(InlineKeyboardButton(
-                    text=city,
-                    callback_data=f"city_{city}"
-                ))
-        builder.row(*row)
+    cities = [city['name'] for city in catalog.page(page)]
+    for i in range(0, len(cities), 3):
+        builder.row(*[
+            InlineKeyboardButton(text=city, callback_data=f"city_{city}")
+            for city in cities[i:i + 3]
+        ])
+    
+    # Листание страниц и поиск по названию (inline-запрос в этом же чате)
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton(text="◀️", callback_data=f"cities_page_{page - 1}"))
+    navigation.append(InlineKeyboardButton(text=f"{page + 1}/{catalog.page_count}",
+                                           callback_data="cities_noop"))
+    if page + 1 < catalog.page_count:
+        navigation.append(InlineKeyboardButton(text="▶️", callback_data=f"cities_page_{page + 1}"))
+    builder.row(*navigation)
+    builder.row(InlineKeyboardButton(text="🔍 Найти город", switch_inline_query_current_chat=""))
     
     return builder.as_markup()
 
-# Функция для создания клавиатуры с WebApp
+# Клавиатуры всех страниц строятся один раз при запуске
+CITY_KEYBOARDS = [build_city_keyboard(page) for page in range(catalog.page_count)]
+
+def create_city_keyboard(page=0):
+    return CITY_KEYBOARDS[min(max(page, 0), len(CITY_KEYBOARDS) - 1)]
+
+# Функция для создания клавиатуры с WebApp (одна на город, из кэша)
+@lru_cache(maxsize=256)
 def create_webapp_keyboard(city):
     builder = InlineKeyboardBuilder()
     
-    # Получаем координаты города
-    coords = CITY_COORDINATES.get(city, [55.7558, 37.6176])  # По умолчанию Москва
-    
     webapp_button = InlineKeyboardButton(
         text="🗺 Открыть карту",
-        web_app=WebAppInfo(url=f"http://localhost:8080/webapp/index.html?city={city}&lat={coords[0]}&lng={coords[1]}")
+        web_app=WebAppInfo(url=webapp_url(city))
     )
     
     back_button = InlineKeyboardButton(
@@ -180,11 +111,32 @@ def create_webapp_keyboard(city):
         callback_data="back_to_cities"
     )
     
+    subscribe_button = InlineKeyboardButton(
+        text="🔔 Подписаться на новые метки",
+        callback_data=f"sub_{city}"
+    )
+    
     builder.row(webapp_button)
+    builder.row(subscribe_button)
     builder.row(back_button)
     
     return builder.as_markup()
 
+# Результаты inline-поиска по каждому городу, готовые заранее. В чужих
+# чатах кнопки WebApp недоступны, поэтому карта открывается по ссылке
+def build_city_article(index, city):
+    return InlineQueryResultArticle(
+        id=str(index),
+        title=city['name'],
+        description=f"📍 {city['lat']}, {city['lng']}",
+        input_message_content=InputTextMessageContent(message_text=f"🏙 {city['name']}"),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="🗺 Открыть карту", url=webapp_url(city['name']))
+        ]])
+    )
+
+CITY_ARTICLES = {city['name']: build_city_article(index, city) for index, city in enumerate(catalog.cities)}
+
 # Обработчик команды /start
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message):
@@ -234,6 +186,9 @@ async def cmd_help(message: types.Message):
 /start - Главное меню
 /help - Эта справка
 /stats - Статистика меток
+/subscribe город - Уведомления о новых метках города
+/unsubscribe [город] - Отписаться от города или от всех
+/subscriptions - Ваши подписки
 """
     
     await message.answer(help_text, parse_mode="HTML")
@@ -242,12 +197,15 @@ async def cmd_help(message: types.Message):
 @dp.message(Command("stats"))
 async def cmd_stats(message: types.Message):
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{BACKEND_URL}/stats") as response:
-                if response.status == 200:
-                    stats = await response.json()
-                    
-                    stats_text = f"""
+        # Общая для всех чатов копия, не старше STATS_CACHE_TTL секунд
+        stats = await backend.stats()
+    except BackendError as e:
+        logging.error(f"Ошибка при получении статистики: {e}")
+        await message.answer("❌ Ошибка при получении статистики")
+        return
+    
+    try:
+        stats_text = f"""
 📊 <b>Статистика карты России:</b>
 
 📍 Всего меток: <b>{stats['total_markers']}</b>
@@ -257,14 +215,53 @@ async def cmd_stats(message: types.Message):
 🏙 <b>Города с метками:</b>
 {', '.join(stats['cities'][:10])}{'...' if len(stats['cities']) > 10 else ''}
 """
-                    
-                    await message.answer(stats_text, parse_mode="HTML")
-                else:
-                    await message.answer("❌ Ошибка при получении статистики")
+        
+        await message.answer(stats_text, parse_mode="HTML")
     except Exception as e:
         logging.error(f"Ошибка при получении статистики: {e}")
         await message.answer("❌ Ошибка при получении статистики")
 
+# Подписка чата на город (команда или кнопка в карточке города)
+async def subscribe_chat(chat_id, name):
+    city = catalog.get(name)
+    if city is None:
+        return f"❌ Город «{name}» не найден. Попробуйте поиск: кнопка «🔍 Найти город» в /start"
+    if city['name'] in subscriptions.cities(chat_id):
+        return f"🔔 Вы уже подписаны на {city['name']}"
+    if not subscriptions.subscribe(chat_id, city['name']):
+        return "❌ Слишком много подписок, отпишитесь от ненужных: /unsubscribe город"
+    return f"🔔 Вы подписаны на новые метки и комментарии: {city['name']}"
+
+@dp.message(Command("subscribe"))
+async def cmd_subscribe(message: types.Message):
+    name = message.text.partition(' ')[2].strip()
+    if not name:
+        await message.answer("Укажите город: /subscribe Казань")
+        return
+    await message.answer(await subscribe_chat(message.chat.id, name))
+
+@dp.message(Command("unsubscribe"))
+async def cmd_unsubscribe(message: types.Message):
+    name = message.text.partition(' ')[2].strip()
+    removed = subscriptions.unsubscribe(message.chat.id, name or None)
+    if removed:
+        await message.answer(f"🔕 Вы отписаны: {', '.join(removed)}")
+    else:
+        await message.answer("У вас нет такой подписки. Список: /subscriptions")
+
+@dp.message(Command("subscriptions"))
+async def cmd_subscriptions(message: types.Message):
+    cities = subscriptions.cities(message.chat.id)
+    if cities:
+        await message.answer(f"🔔 Ваши подписки: {', '.join(cities)}")
+    else:
+        await message.answer("Подписок нет. Подписаться: /subscribe город")
+
+@dp.callback_query(lambda c: c.data.startswith('sub_'))
+async def process_subscribe(callback: types.CallbackQuery):
+    text = await subscribe_chat(callback.message.chat.id, callback.data.replace('sub_', '', 1))
+    await callback.answer(text, show_alert=True)
+
 # Обработчик выбора города
 @dp.callback_query(lambda c: c.data.startswith('city_'))
 async def process_city_selection(callback: types.CallbackQuery):
@@ -273,7 +270,7 @@ async def process_city_selection(callback: types.CallbackQuery):
     city_info = f"""
 🏙 <b>{city}</b>
 
-📍 Координаты: {CITY_COORDINATES.get(city, ['Неизвестно', 'Неизвестно'])}
+📍 Координаты: {catalog.coordinates(city) or ['Неизвестно', 'Неизвестно']}
 🗺 Нажмите кнопку ниже, чтобы открыть карту города
 """
     
@@ -283,6 +280,27 @@ async def process_city_selection(callback: types.CallbackQuery):
         reply_markup=create_webapp_keyboard(city)
     )
 
+# Обработчик листания страниц городов
+@dp.callback_query(lambda c: c.data.startswith('cities_page_'))
+async def process_cities_page(callback: types.CallbackQuery):
+    try:
+        page = int(callback.data.replace('cities_page_', ''))
+    except ValueError:
+        page = 0
+    await callback.message.edit_reply_markup(reply_markup=create_city_keyboard(page))
+    await callback.answer()
+
+# Номер страницы - просто надпись
+@dp.callback_query(lambda c: c.data == 'cities_noop')
+async def process_cities_noop(callback: types.CallbackQuery):
+    await callback.answer()
+
+# Поиск города по началу названия: @бот <текст> или кнопка "Найти город"
+@dp.inline_query()
+async def inline_city_search(query: types.InlineQuery):
+    results = [CITY_ARTICLES[city['name']] for city in catalog.search(query.query)]
+    await query.answer(results, cache_time=3600)
+
 # Обработчик кнопки "Назад к городам"
 @dp.callback_query(lambda c: c.data == "back_to_cities")
 async def process_back_to_cities(callback: types.CallbackQuery):
@@ -342,10 +360,42 @@ async def echo_message(message: types.Message):
         "🤖 Используйте команду /start для начала работы с ботом или /help для справки."
     )
 
+# Очередь уведомлений и чтение потока изменений backend
+async def start_notifications():
+    global notifications_task
+    notifier.start()
+    notifications_task = asyncio.create_task(follow_changes(backend, notifier, EVENTS_URL))
+
+async def stop_notifications():
+    if notifications_task is not None:
+        notifications_task.cancel()
+        await asyncio.gather(notifications_task, return_exceptions=True)
+    await notifier.stop()
+
 # Функция запуска бота
 async def main():
     logging.info("Запуск бота...")
-    await dp.start_polling(bot)
+    await start_notifications()
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await stop_notifications()
+        await backend.close()
+
+def run_webhook():
+    from aiohttp import web
+    from webhook import create_webhook_app
+    
+    if not WEBHOOK_URL:
+        raise SystemExit("Для BOT_MODE=webhook нужен WEBHOOK_URL")
+    logging.info("Запуск бота в режиме webhook...")
+    app = create_webhook_app(dp, bot, WEBHOOK_URL, WEBHOOK_SECRET,
+                             startup=[start_notifications],
+                             cleanup=[stop_notifications, backend.close, bot.session.close])
+    web.run_app(app, host='0.0.0.0', port=WEBHOOK_PORT)
 
 if __name__ == '__main__':
-    asyncio.run(main()) 
\ No newline at end of file
+    if BOT_MODE == 'webhook':
+        run_webhook()
+    else:
+        asyncio.run(main()) 
\ No newline at end of file
@@ -0,0 +1,58 @@
+"""
+Кэш сериализованных JSON-ответов API
+
+Запись кэша привязана к версии данных (ревизиям таблиц store): пока
+версия не изменилась, повторный запрос отдаёт готовые байты, а после
+любой записи в таблицу версия меняется и тело строится заново. Сжатая
+gzip-копия создаётся при первом запросе, который её принимает.
+"""
+
+import gzip
+import os
+import threading
+from collections import OrderedDict
+
+# Сколько разных ответов (URL с параметрами) держать в памяти
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 512))
+# Ответы меньше этого размера не сжимаются
+GZIP_MIN_SIZE = 1024
+
+
+class CachedBody:
+    """Тело ответа для одной версии данных"""
+
+    def __init__(self, version, body):
+        self.version = version
+        self.body = body
+        self._gzipped = None
+
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=6)
+        return self._gzipped
+
+
+class ResponseCache:
+    """LRU-кэш: ключ запроса -> CachedBody последней версии"""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.version != version:
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, version, body):
+        entry = CachedBody(version, body)
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
@@ -0,0 +1,89 @@
+"""
+Каталог городов, общий для бота и backend
+
+Загружается один раз из cities.json (тот же файл читает геокодер):
+названия без повторов, координаты, поиск по началу названия или
+любого его слова ("челны" -> Набережные Челны) и деление на страницы
+для клавиатуры бота. Все поиски - словарь или bisect по заранее
+отсортированным ключам, без перебора списка на каждый запрос.
+"""
+
+import bisect
+import json
+import os
+
+CITIES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cities.json')
+# Городов на странице клавиатуры (по 3 в ряд) и в ответе поиска
+CITY_PAGE_SIZE = 24
+CITY_SEARCH_LIMIT = 50
+
+
+def city_key(name):
+    """Ключ для сравнения названий: без регистра, ё = е"""
+    return name.strip().lower().replace('ё', 'е')
+
+
+class CityCatalog:
+    """Города в порядке файла (по убыванию размера) с индексами по названию"""
+
+    def __init__(self, path=CITIES_FILE):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.cities = []
+        self.by_key = {}
+        for city in data['cities']:
+            key = city_key(city['name'])
+            if key in self.by_key:
+                print(f"⚠️ Город {city['name']} повторяется в {os.path.basename(path)}, пропущен")
+                continue
+            self.by_key[key] = city
+            self.cities.append(city)
+        self.outline = data.get('outline', [])
+        self.foreign = data.get('foreign', [])
+        # (ключ с начала слова, номер города) по возрастанию ключа
+        self.search_keys = sorted(
+            (key[start:], index)
+            for index, key in enumerate(city_key(c['name']) for c in self.cities)
+            for start in [0] + [i + 1 for i, ch in enumerate(key) if ch in ' -']
+        )
+
+    def __len__(self):
+        return len(self.cities)
+
+    def get(self, name):
+        """Город по названию (без учёта регистра и ё) или None"""
+        return self.by_key.get(city_key(name or ''))
+
+    def coordinates(self, name):
+        city = self.get(name)
+        return [city['lat'], city['lng']] if city is not None else None
+
+    def search(self, prefix, limit=CITY_SEARCH_LIMIT):
+        """Города, название или слово названия которых начинается с prefix"""
+        prefix = city_key(prefix)
+        if not prefix:
+            return self.cities[:limit]
+        start = bisect.bisect_left(self.search_keys, (prefix,))
+        found = set()
+        for key, index in self.search_keys[start:]:
+            if not key.startswith(prefix):
+                break
+            found.add(index)
+        return [self.cities[index] for index in sorted(found)[:limit]]
+
+    @property
+    def page_count(self):
+        return max(1, -(-len(self.cities) // CITY_PAGE_SIZE))
+
+    def page(self, number):
+        return self.cities[number * CITY_PAGE_SIZE:(number + 1) * CITY_PAGE_SIZE]
+
+
+_catalog = None
+
+
+def get_catalog():
+    global _catalog
+    if _catalog is None:
+        _catalog = CityCatalog()
+    return _catalog
@@ -0,0 +1,183 @@
+"""
+Рассылка изменений меток, комментариев и маршрутов подписчикам (SSE)
+
+EventHub получает события от таблиц store (Table.listen), один раз
+сериализует каждое и раскладывает готовые строки по очередям подписчиков.
+Очередь каждого подписчика ограничена: если клиент не успевает читать,
+вместо того чтобы копить события, он получает событие resync и
+отключается - после переподключения клиент догоняет состояние через
+ленту ?since=.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Сколько событий может ждать отправки одному подписчику
+SUBSCRIBER_QUEUE_SIZE = int(os.environ.get('EVENTS_QUEUE_SIZE', 256))
+# Интервал комментария-пинга в потоке SSE (секунды)
+HEARTBEAT_INTERVAL = 15
+# Как часто подтягивать чужие изменения из общего хранилища (секунды)
+EVENTS_POLL_INTERVAL = float(os.environ.get('EVENTS_POLL_INTERVAL', 0.5))
+
+
+def format_sse(event):
+    """Событие в формате text/event-stream"""
+    data = json.dumps(event, ensure_ascii=False, separators=(',', ':'))
+    return f"event: {event['type']}\ndata: {data}\n\n"
+
+
+RESYNC_EVENT = format_sse({'type': 'resync'})
+
+
+class Subscription:
+    """Очередь готовых к отправке событий одного подписчика"""
+
+    def __init__(self, hub, maxsize, on_ready=None):
+        self.hub = hub
+        self.maxsize = maxsize
+        self.queue = deque()
+        self.closed = False
+        self.overflowed = False
+        self.condition = threading.Condition()
+        # Вызывается из потока публикации, когда появились события (для asyncio)
+        self.on_ready = on_ready
+
+    def push(self, message):
+        with self.condition:
+            if self.closed:
+                return
+            if len(self.queue) >= self.maxsize:
+                # Медленный клиент: отбрасываем очередь и просим переподключиться
+                self.queue.clear()
+                self.queue.append(RESYNC_EVENT)
+                self.overflowed = True
+                self.closed = True
+            else:
+                self.queue.append(message)
+            self.condition.notify()
+        if self.on_ready is not None:
+            self.on_ready()
+
+    def drain(self):
+        """Забирает все накопленные события без ожидания"""
+        with self.condition:
+            events = list(self.queue)
+            self.queue.clear()
+            return events
+
+    def wait(self, timeout):
+        """Ждёт событий до timeout секунд; пустой список - пора слать пинг"""
+        with self.condition:
+            if not self.queue and not self.closed:
+                self.condition.wait(timeout)
+            events = list(self.queue)
+            self.queue.clear()
+            return events
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.hub.unsubscribe(self)
+        # Будим и ожидающую корутину, чтобы поток завершился сразу
+        if self.on_ready is not None:
+            self.on_ready()
+
+
+class EventHub:
+    """Публикация событий всем подписчикам; publish не блокируется на клиентах"""
+
+    def __init__(self, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.subscribers = set()
+
+    def subscribe(self, on_ready=None):
+        subscription = Subscription(self, self.queue_size, on_ready)
+        with self.lock:
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def close_all(self):
+        """Закрывает все подписки (остановка сервера)"""
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            subscription.close()
+
+    def publish(self, message):
+        """Рассылает готовую строку SSE всем подписчикам"""
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            subscription.push(message)
+            if subscription.overflowed:
+                self.unsubscribe(subscription)
+
+    def publish_event(self, event):
+        self.publish(format_sse(event))
+
+    def watch(self, refresh, interval=EVENTS_POLL_INTERVAL):
+        """Фоновый поток, который вызывает refresh(), пока есть подписчики
+
+        Нужен, когда хранилище общее: чужие операции приходят в таблицы
+        только при обращении к ним, а подписчики сами запросов не делают.
+        """
+        def loop():
+            while True:
+                time.sleep(interval)
+                if not self.subscribers:
+                    continue
+                try:
+                    refresh()
+                except Exception as e:
+                    print(f"❌ Ошибка получения изменений: {e}")
+        threading.Thread(target=loop, daemon=True).start()
+
+    def listener(self, kind, view=None):
+        """Обработчик для Table.listen: событие вида '<kind>.put' / '<kind>.delete'
+
+        view, если задан, преобразует запись перед отправкой; если view
+        вернул None, событие не рассылается.
+        """
+        def on_change(op, record):
+            if op == 'reset':
+                # Состояние таблицы перезагружено целиком: клиентам нужен полный запрос
+                self.publish(RESYNC_EVENT)
+                return
+            event = {'type': f'{kind}.{op}', 'revision': record.get('revision')}
+            if op == 'put':
+                event['data'] = view(record) if view is not None else record
+                if event['data'] is None:
+                    return
+            else:
+                event['data'] = {'id': record['id']}
+                if 'marker_id' in record:
+                    event['data']['marker_id'] = record['marker_id']
+            self.publish_event(event)
+        return on_change
+
+    def stream(self, heartbeat=HEARTBEAT_INTERVAL):
+        """Генератор строк SSE для синхронного сервера (Flask)"""
+        subscription = self.subscribe()
+        try:
+            yield ': connected\n\n'
+            while True:
+                events = subscription.wait(heartbeat)
+                if not events:
+                    if subscription.closed:
+                        return
+                    yield ': ping\n\n'
+                    continue
+                # После закрытия wait не ждёт: остаток очереди (resync) уйдёт
+                # следующим проходом
+                yield ''.join(events)
+        finally:
+            subscription.close()
@@ -0,0 +1,490 @@
+"""
+Геометрия для карты: сеточный пространственный индекс по lat/lng и кластеры
+
+Метки раскладываются по ячейкам сетки GRID_CELL_DEG x GRID_CELL_DEG
+градусов. Ключ ячейки используется как обычный вторичный индекс
+таблицы (см. store.Table), запрос по прямоугольнику перебирает только
+пересекающиеся с ним ячейки. Для мелких масштабов ClusterPyramid
+хранит готовые агрегаты по уровням зума. Маршруты при сохранении
+очищаются от дублей и упрощаются до нескольких уровней детализации.
+Ближайшие соседи ищутся по расстоянию большого круга: для меток - по
+той же сетке расширяющимися кольцами, для постоянного списка городов -
+в KD-дереве.
+"""
+
+import heapq
+import itertools
+import math
+import os
+
+# Размер ячейки сетки в градусах
+GRID_CELL_DEG = 0.25
+# Столбцов сетки по долготе: от -GRID_COLS // 2 до GRID_COLS // 2 - 1
+GRID_COLS = int(round(360 / GRID_CELL_DEG))
+
+
+class BBox:
+    """Прямоугольник карты; west > east означает переход через 180-й меридиан"""
+
+    def __init__(self, west, south, east, north):
+        self.west = west
+        self.south = south
+        self.east = east
+        self.north = north
+
+    @classmethod
+    def parse(cls, value):
+        """Разбирает строку 'west,south,east,north' (L.LatLngBounds.toBBoxString)"""
+        try:
+            west, south, east, north = (float(part) for part in value.split(','))
+        except ValueError:
+            raise ValueError('bbox должен иметь вид west,south,east,north')
+        if not all(math.isfinite(v) for v in (west, south, east, north)):
+            raise ValueError('bbox содержит некорректные числа')
+        if south > north:
+            raise ValueError('bbox: south больше north')
+        south = max(south, -90.0)
+        north = min(north, 90.0)
+        if east - west >= 360:
+            west, east = -180.0, 180.0
+        else:
+            west = normalize_lng(west)
+            east = normalize_lng(east)
+        return cls(west, south, east, north)
+
+    def lng_ranges(self):
+        """Диапазоны долгот без перехода через 180-й меридиан"""
+        if self.west <= self.east:
+            return [(self.west, self.east)]
+        return [(self.west, 180.0), (-180.0, self.east)]
+
+    def contains(self, lat, lng):
+        if not self.south <= lat <= self.north:
+            return False
+        return any(west <= lng <= east for west, east in self.lng_ranges())
+
+    def cell_count(self):
+        rows = cell_index(self.north) - cell_index(self.south) + 1
+        cols = sum(cell_index(east) - cell_index(west) + 1 for west, east in self.lng_ranges())
+        return rows * cols
+
+    def cells(self):
+        """Ключи всех ячеек сетки, пересекающихся с прямоугольником"""
+        # Столбец у 180-го меридиана совпадает со столбцом у -180, он берётся один раз
+        cols = sorted({wrap_col(col) for west, east in self.lng_ranges()
+                       for col in range(cell_index(west), cell_index(east) + 1)})
+        for row in range(cell_index(self.south), cell_index(self.north) + 1):
+            for col in cols:
+                yield (row, col)
+
+    def intersects_cell(self, cell):
+        row, col = cell
+        south = row * GRID_CELL_DEG
+        west = col * GRID_CELL_DEG
+        if south > self.north or south + GRID_CELL_DEG < self.south:
+            return False
+        # Крайняя западная ячейка содержит и точки на 180-м меридиане
+        return any(w <= east_ and w + GRID_CELL_DEG >= west_
+                   for west_, east_ in self.lng_ranges() for w in (west, west + 360.0))
+
+
+def normalize_lng(lng):
+    """Приводит долготу к диапазону [-180, 180]"""
+    if -180.0 <= lng <= 180.0:
+        return lng
+    return (lng + 180.0) % 360.0 - 180.0
+
+
+def cell_index(value):
+    return int(math.floor(value / GRID_CELL_DEG))
+
+
+def wrap_col(col):
+    """Столбец сетки по модулю окружности: 180-й меридиан совпадает с -180"""
+    return (col + GRID_COLS // 2) % GRID_COLS - GRID_COLS // 2
+
+
+def grid_cell(lat, lng):
+    """Ключ ячейки сетки для точки; долгота 180 попадает в ячейку у -180"""
+    return (cell_index(lat), wrap_col(cell_index(normalize_lng(lng))))
+
+
+def records_in_bbox(grid, bbox):
+    """Записи из индекса ячейка -> {id: запись}, попадающие в прямоугольник
+
+    Для больших прямоугольников перебираются только непустые ячейки.
+    """
+    if bbox.cell_count() > len(grid):
+        cells = [cell for cell in grid if bbox.intersects_cell(cell)]
+    else:
+        cells = bbox.cells()
+    result = []
+    for cell in cells:
+        for record in grid.get(cell, {}).values():
+            if bbox.contains(record['lat'], record['lng']):
+                result.append(record)
+    return result
+
+
+# Кластеры меток для мелких масштабов карты
+# Начиная с этого зума отдаются отдельные метки, а не кластеры
+CLUSTER_MAX_ZOOM = 9
+# Размер ячейки кластеризации в пикселях тайла (256 px)
+CLUSTER_CELL_PX = 64
+# Предел широты проекции Web Mercator
+MERCATOR_MAX_LAT = 85.05112878
+
+
+def mercator_x(lng):
+    return (normalize_lng(lng) + 180.0) / 360.0
+
+
+def mercator_y(lat):
+    lat = max(-MERCATOR_MAX_LAT, min(MERCATOR_MAX_LAT, lat))
+    rad = math.radians(lat)
+    return (1.0 - math.log(math.tan(rad) + 1.0 / math.cos(rad)) / math.pi) / 2.0
+
+
+class ClusterPyramid:
+    """Пирамида кластеров по уровням зума, обновляемая при каждой записи
+
+    На каждом уровне z мир делится на ячейки по CLUSTER_CELL_PX пикселей;
+    для ячейки хранятся [количество, сумма lat, сумма lng, сумма рейтингов].
+    Добавление и удаление метки стоят O(CLUSTER_MAX_ZOOM).
+    """
+
+    def __init__(self, max_zoom=CLUSTER_MAX_ZOOM, cell_px=CLUSTER_CELL_PX):
+        self.max_zoom = max_zoom
+        self.cell_px = cell_px
+        self.levels = [{} for _ in range(max_zoom + 1)]
+
+    def _cells_per_axis(self, zoom):
+        return (2 ** zoom) * 256 // self.cell_px
+
+    def _cell(self, zoom, lat, lng):
+        n = self._cells_per_axis(zoom)
+        x = min(int(mercator_x(lng) * n), n - 1)
+        y = min(int(mercator_y(lat) * n), n - 1)
+        return (x, y)
+
+    def clear(self):
+        self.levels = [{} for _ in range(self.max_zoom + 1)]
+
+    def add(self, record):
+        self._update(record, 1)
+
+    def remove(self, record):
+        self._update(record, -1)
+
+    def _update(self, record, sign):
+        lat, lng = record['lat'], record['lng']
+        rating = record.get('rating', 0) or 0
+        for zoom, level in enumerate(self.levels):
+            key = self._cell(zoom, lat, lng)
+            agg = level.get(key)
+            if agg is None:
+                agg = level[key] = [0, 0.0, 0.0, 0]
+            agg[0] += sign
+            agg[1] += sign * lat
+            agg[2] += sign * lng
+            agg[3] += sign * rating
+            if agg[0] <= 0:
+                del level[key]
+
+    def clusters(self, zoom, bbox):
+        """Кластеры уровня zoom из ячеек, пересекающихся с прямоугольником"""
+        zoom = max(0, min(zoom, self.max_zoom))
+        level = self.levels[zoom]
+        n = self._cells_per_axis(zoom)
+        y_min = int(mercator_y(bbox.north) * n)
+        y_max = min(int(mercator_y(bbox.south) * n), n - 1)
+        ranges = [(int(mercator_x(west) * n), min(int(mercator_x(east) * n), n - 1))
+                  for west, east in bbox.lng_ranges()]
+        cell_count = (y_max - y_min + 1) * sum(x_max - x_min + 1 for x_min, x_max in ranges)
+
+        if cell_count > len(level):
+            cells = [key for key in level
+                     if y_min <= key[1] <= y_max
+                     and any(x_min <= key[0] <= x_max for x_min, x_max in ranges)]
+        else:
+            cells = [(x, y) for y in range(y_min, y_max + 1)
+                     for x_min, x_max in ranges for x in range(x_min, x_max + 1)
+                     if (x, y) in level]
+
+        result = []
+        for key in cells:
+            count, lat_sum, lng_sum, rating_sum = level[key]
+            result.append({
+                'lat': lat_sum / count,
+                'lng': lng_sum / count,
+                'count': count,
+                'average_rating': rating_sum / count,
+            })
+        return result
+
+
+# Упрощение маршрутов (Ramer-Douglas-Peucker) и уровни детализации
+EARTH_RADIUS_M = 6371000.0
+# Соседние точки ближе этого расстояния (метры) считаются дублями
+ROUTE_MIN_STEP_M = float(os.environ.get('ROUTE_MIN_STEP_M', 2))
+# Допуски уровней детализации маршрута (метры), по возрастанию
+ROUTE_LOD_TOLERANCES = (5, 20, 80, 320)
+# Метров в пикселе на экваторе при зуме 0 (тайл 256 px)
+METERS_PER_PIXEL_Z0 = 156543.03
+
+
+def clean_route(coordinates, previous=None):
+    """Проверяет точки [lat, lng] и убирает почти совпадающие соседние
+
+    previous - последняя уже сохранённая точка маршрута, если точки
+    дописываются к нему. Бросает ValueError, если координаты не являются
+    списком пар чисел в допустимых диапазонах.
+    """
+    if not isinstance(coordinates, list) or not coordinates:
+        raise ValueError('Координаты маршрута должны быть непустым списком точек [lat, lng]')
+    points = []
+    last = len(coordinates) - 1
+    for i, point in enumerate(coordinates):
+        try:
+            lat, lng = (float(v) for v in point)
+        except (TypeError, ValueError):
+            raise ValueError('Точка маршрута должна иметь вид [lat, lng]')
+        if not (math.isfinite(lat) and math.isfinite(lng)
+                and -90 <= lat <= 90 and -180 <= lng <= 180):
+            raise ValueError('Точка маршрута вне допустимых координат')
+        # Последнюю точку сохраняем, даже если она близко к предыдущей
+        before = points[-1] if points else previous
+        if before is not None and i < last and distance_m(before, (lat, lng)) < ROUTE_MIN_STEP_M:
+            continue
+        points.append([lat, lng])
+    return points
+
+
+def distance_m(a, b):
+    """Расстояние между точками в метрах (равнопромежуточная проекция)"""
+    x = math.radians(b[1] - a[1]) * math.cos(math.radians((a[0] + b[0]) / 2))
+    y = math.radians(b[0] - a[0])
+    return EARTH_RADIUS_M * math.hypot(x, y)
+
+
+def route_importance(points):
+    """Для каждой точки - наибольший допуск RDP (метры), при котором она остаётся
+
+    Один проход RDP до конца; важность точки не больше важности отрезка,
+    который она делит, поэтому упрощение с допуском t - это точки с
+    важностью больше t, и все уровни берутся из одного массива.
+    """
+    n = len(points)
+    if n <= 2:
+        return [math.inf] * n
+    # Плоские координаты в метрах относительно первой точки
+    lat0 = math.radians(points[0][0])
+    k = math.cos(lat0)
+    xy = [(math.radians(lng - points[0][1]) * k * EARTH_RADIUS_M,
+           math.radians(lat - points[0][0]) * EARTH_RADIUS_M) for lat, lng in points]
+    importance = [0.0] * n
+    importance[0] = importance[-1] = math.inf
+    stack = [(0, n - 1, math.inf)]
+    while stack:
+        first, last, limit = stack.pop()
+        if last - first < 2:
+            continue
+        ax, ay = xy[first]
+        bx, by = xy[last]
+        dx, dy = bx - ax, by - ay
+        length = math.hypot(dx, dy)
+        best, best_dist = first + 1, -1.0
+        for i in range(first + 1, last):
+            px, py = xy[i]
+            if length > 0:
+                dist = abs(dy * (px - ax) - dx * (py - ay)) / length
+            else:
+                dist = math.hypot(px - ax, py - ay)
+            if dist > best_dist:
+                best, best_dist = i, dist
+        value = min(best_dist, limit)
+        importance[best] = value
+        stack.append((first, best, value))
+        stack.append((best, last, value))
+    return importance
+
+
+def route_levels(points, tolerances=ROUTE_LOD_TOLERANCES):
+    """Упрощённые копии маршрута: {допуск в метрах (строкой): точки}"""
+    importance = route_importance(points)
+    return {str(t): [p for p, imp in zip(points, importance) if imp > t] for t in tolerances}
+
+
+def zoom_tolerance(lat, zoom):
+    """Допуск в метрах, равный одному пикселю карты на зуме zoom"""
+    zoom = max(0, min(zoom, 30))
+    return METERS_PER_PIXEL_Z0 * math.cos(math.radians(lat)) / (2 ** zoom)
+
+
+def route_level(route, tolerance=None, zoom=None):
+    """Маршрут для ответа: точки уровня детализации, не грубее tolerance
+
+    Без параметров отдаются все точки. Служебное поле lod не отдаётся.
+    """
+    view = {key: value for key, value in route.items() if key != 'lod'}
+    levels = route.get('lod')
+    if not levels or (tolerance is None and zoom is None):
+        return view
+    if tolerance is None:
+        points = route.get('coordinates') or [[0, 0]]
+        tolerance = zoom_tolerance(points[0][0], zoom)
+    usable = [t for t in ROUTE_LOD_TOLERANCES if t <= tolerance and str(t) in levels]
+    if usable:
+        view['coordinates'] = levels[str(usable[-1])]
+    return view
+
+
+def route_view(route, tolerance=None, zoom=None):
+    """Маршрут для ответа или None, если это неопубликованный черновик"""
+    if not route.get('published', True):
+        return None
+    return route_level(route, tolerance, zoom)
+
+
+# Ближайшие соседи по расстоянию большого круга
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+
+def haversine_m(a, b):
+    """Расстояние по поверхности Земли между точками [lat, lng] в метрах"""
+    lat1, lat2 = math.radians(a[0]), math.radians(b[0])
+    h = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin(math.radians(b[1] - a[1]) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(1.0, h)))
+
+
+def _ring_bound_m(lat, ring, threshold_m):
+    """Нижняя граница расстояния до записей за пределами ring колец ячеек
+
+    Считается для записей не дальше threshold_m: только у них широта
+    ограничена и можно оценить, насколько сходятся меридианы.
+    """
+    span = math.radians(ring * GRID_CELL_DEG)
+    max_lat = min(90.0, abs(lat) + math.degrees(threshold_m / EARTH_RADIUS_M))
+    across = 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.cos(math.radians(max_lat)) * math.sin(min(span, math.pi) / 2)))
+    return min(EARTH_RADIUS_M * span, across)
+
+
+def nearest_records(grid, lat, lng, k=None, radius_m=None, accept=None):
+    """Ближайшие записи индекса ячейка -> {id: запись}: [(метры, запись)] по возрастанию
+
+    k - сколько записей вернуть, radius_m - не дальше скольких метров;
+    задать можно оба. Ячейки обходятся кольцами вокруг точки, пока
+    следующее кольцо гарантированно не дальше найденного. Когда колец
+    становится больше, чем непустых ячеек, оставшиеся проверяются подряд.
+    accept отбрасывает записи (например, просроченные).
+    """
+    lng = normalize_lng(lng)
+    row0, col0 = grid_cell(lat, lng)
+    heap = []
+    counter = itertools.count()
+
+    def visit(cell):
+        for record in grid.get(cell, {}).values():
+            # Разница широт дешевле haversine и не больше расстояния
+            limit = -heap[0][0] if k is not None and len(heap) >= k else radius_m
+            if limit is not None and abs(record['lat'] - lat) * METERS_PER_DEGREE > limit:
+                continue
+            if accept is not None and not accept(record):
+                continue
+            distance = haversine_m((lat, lng), (record['lat'], record['lng']))
+            if radius_m is not None and distance > radius_m:
+                continue
+            if k is None or len(heap) < k:
+                heapq.heappush(heap, (-distance, next(counter), record))
+            elif distance < -heap[0][0]:
+                heapq.heapreplace(heap, (-distance, next(counter), record))
+
+    def col_offset(col):
+        return abs(wrap_col(col - col0))
+
+    ring = 0
+    while True:
+        if ring and (8 * ring > len(grid) or 2 * ring + 1 >= GRID_COLS):
+            for cell in list(grid):
+                if max(abs(cell[0] - row0), col_offset(cell[1])) >= ring:
+                    visit(cell)
+            break
+        if ring == 0:
+            visit((row0, col0))
+        else:
+            for row in range(row0 - ring, row0 + ring + 1):
+                step = 1 if abs(row - row0) == ring else 2 * ring
+                for col in range(col0 - ring, col0 + ring + 1, step):
+                    visit((row, wrap_col(col)))
+        if k is not None and len(heap) >= k:
+            threshold = -heap[0][0]
+        elif radius_m is not None:
+            threshold = radius_m
+        else:
+            threshold = None
+        if threshold is not None and _ring_bound_m(lat, ring, threshold) > threshold:
+            break
+        ring += 1
+    return [(-distance, record) for distance, _, record in sorted(heap, reverse=True)]
+
+
+def _unit_vector(lat, lng):
+    lat, lng = math.radians(lat), math.radians(lng)
+    return (math.cos(lat) * math.cos(lng), math.cos(lat) * math.sin(lng), math.sin(lat))
+
+
+class PointTree:
+    """KD-дерево по неизменному набору точек на сфере
+
+    Точки хранятся единичными векторами в 3D: длина хорды растёт вместе
+    с расстоянием большого круга, поэтому обычный евклидов поиск в
+    дереве находит ближайших по поверхности, без особых случаев у 180-го
+    меридиана и полюсов.
+    """
+
+    def __init__(self, items, position=lambda item: (item['lat'], item['lng'])):
+        points = [(_unit_vector(*position(item)), item) for item in items]
+        self.size = len(points)
+        self.root = self._build(points, 0)
+
+    def _build(self, points, axis):
+        if not points:
+            return None
+        points.sort(key=lambda point: point[0][axis])
+        middle = len(points) // 2
+        vector, item = points[middle]
+        next_axis = (axis + 1) % 3
+        return (vector, item, axis,
+                self._build(points[:middle], next_axis),
+                self._build(points[middle + 1:], next_axis))
+
+    def nearest(self, lat, lng, k=1, radius_m=None):
+        """До k ближайших точек (не дальше radius_m): [(метры, элемент)] по возрастанию"""
+        target = _unit_vector(lat, lng)
+        limit = math.inf
+        if radius_m is not None:
+            limit = (2 * math.sin(min(radius_m / EARTH_RADIUS_M, math.pi) / 2)) ** 2
+        heap = []
+        counter = itertools.count()
+
+        def search(node):
+            if node is None:
+                return
+            vector, item, axis, left, right = node
+            chord2 = sum((a - b) ** 2 for a, b in zip(vector, target))
+            bound = -heap[0][0] if len(heap) >= k else limit
+            if chord2 <= bound:
+                if len(heap) >= k:
+                    heapq.heapreplace(heap, (-chord2, next(counter), item))
+                else:
+                    heapq.heappush(heap, (-chord2, next(counter), item))
+            diff = target[axis] - vector[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            search(near)
+            if diff * diff <= (-heap[0][0] if len(heap) >= k else limit):
+                search(far)
+
+        search(self.root)
+        return [(2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(-chord2) / 2)), item)
+                for chord2, _, item in sorted(heap, reverse=True)]
@@ -0,0 +1,179 @@
+"""
+Локальный обратный геокодер: в России ли точка и в каком она городе
+
+Данные берутся из каталога городов (city_catalog, файл cities.json):
+города с центром и радиусом (круг приближает границу города) и грубый
+контур России (материк, Калининград, Сахалин, Курилы, острова Арктики)
+с точностью в десятки километров; там, где город стоит на сухопутной
+границе, контур проведён точнее. Кроме того, каталог перечисляет
+участки соседних стран у самых российских городов (foreign): там круг
+города не действует - Хэйхэ не становится Благовещенском.
+
+Оба набора разложены по сетке GEOCODER_CELL_DEG градусов. Для города
+ячейка хранит список кругов, которые её задевают. Для контура ячейка
+заранее помечена как целиком внутри, целиком снаружи или пограничная;
+честная проверка точки в многоугольнике (лучом) нужна только в
+пограничных ячейках. Ответы кэшируются по координатам, округлённым до
+GEOCODE_PRECISION знаков (около 100 м).
+
+Ближайший город ищется в KD-дереве (geo.PointTree); точке вне кругов
+городов достаётся ближайший город не дальше NEAREST_CITY_MAX_KM.
+"""
+
+import math
+import os
+from functools import lru_cache
+
+from city_catalog import get_catalog
+from geo import PointTree, distance_m
+
+GEOCODER_CELL_DEG = 0.5
+GEOCODE_PRECISION = 3
+GEOCODE_CACHE_SIZE = int(os.environ.get('GEOCODE_CACHE_SIZE', 65536))
+NEAREST_CITY_MAX_KM = float(os.environ.get('NEAREST_CITY_MAX_KM', 30))
+
+
+def _cell(lat, lng):
+    return (math.floor(lat / GEOCODER_CELL_DEG), math.floor(lng / GEOCODER_CELL_DEG))
+
+
+def _unwrap_lng(lng):
+    # Чукотка заходит за 180-й меридиан: в контуре её долготы больше 180
+    return lng + 360 if lng < -160 else lng
+
+
+def _inside_ring(lat, lng, ring):
+    """Проверка точки в многоугольнике лучом вдоль параллели"""
+    inside = False
+    for (lat1, lng1), (lat2, lng2) in zip(ring, ring[1:] + ring[:1]):
+        if (lat1 > lat) != (lat2 > lat):
+            cross = lng1 + (lat - lat1) * (lng2 - lng1) / (lat2 - lat1)
+            if lng < cross:
+                inside = not inside
+    return inside
+
+
+class Geocoder:
+    """Города и контур страны с сеточным индексом"""
+
+    def __init__(self, catalog=None):
+        catalog = catalog or get_catalog()
+        self.cities = catalog.cities
+        self.outline = [[tuple(point) for point in ring] for ring in catalog.outline]
+        self.foreign = [[tuple(point) for point in ring] for ring in catalog.foreign]
+        self.city_tree = PointTree(self.cities)
+        self.city_cells = {}
+        for city in self.cities:
+            self._index_city(city)
+        self.border_cells = set()
+        for ring in self.outline:
+            self._index_border(ring)
+        self.inside_cells = {}
+
+    def _index_city(self, city):
+        radius_deg = city['radius_km'] * 1000 / 111320
+        lng_deg = radius_deg / max(math.cos(math.radians(city['lat'])), 0.01)
+        south, west = _cell(city['lat'] - radius_deg, city['lng'] - lng_deg)
+        north, east = _cell(city['lat'] + radius_deg, city['lng'] + lng_deg)
+        for row in range(south, north + 1):
+            for col in range(west, east + 1):
+                self.city_cells.setdefault((row, col), []).append(city)
+
+    def _index_border(self, ring):
+        # Ячейки, через которые проходят рёбра контура, с соседями - на случай
+        # срезанного угла ячейки между шагами
+        step = GEOCODER_CELL_DEG / 4
+        for (lat1, lng1), (lat2, lng2) in zip(ring, ring[1:] + ring[:1]):
+            steps = max(1, int(max(abs(lat2 - lat1), abs(lng2 - lng1)) / step) + 1)
+            for i in range(steps + 1):
+                row, col = _cell(lat1 + (lat2 - lat1) * i / steps, lng1 + (lng2 - lng1) * i / steps)
+                for d_row in (-1, 0, 1):
+                    for d_col in (-1, 0, 1):
+                        self.border_cells.add((row + d_row, col + d_col))
+
+    def _inside_outline(self, lat, lng):
+        return any(_inside_ring(lat, lng, ring) for ring in self.outline)
+
+    def in_foreign(self, lat, lng):
+        """Точка на участке соседней страны рядом с российским городом"""
+        return any(_inside_ring(lat, lng, ring) for ring in self.foreign)
+
+    def in_country(self, lat, lng):
+        """Точка внутри контура страны"""
+        lng = _unwrap_lng(lng)
+        cell = _cell(lat, lng)
+        if cell in self.border_cells:
+            return self._inside_outline(lat, lng)
+        status = self.inside_cells.get(cell)
+        if status is None:
+            # Ячейка целиком по одну сторону границы: хватает проверить центр
+            status = self._inside_outline((cell[0] + 0.5) * GEOCODER_CELL_DEG,
+                                          (cell[1] + 0.5) * GEOCODER_CELL_DEG)
+            self.inside_cells[cell] = status
+        return status
+
+    def city(self, lat, lng):
+        """Город, в круг которого попадает точка, или None
+
+        Из пересекающихся кругов (города-спутники рядом с Москвой)
+        выбирается тот, к центру которого точка ближе относительно радиуса.
+        """
+        best = None
+        best_ratio = 1.0
+        for city in self.city_cells.get(_cell(lat, lng), ()):
+            ratio = distance_m((lat, lng), (city['lat'], city['lng'])) / (city['radius_km'] * 1000)
+            if ratio <= best_ratio:
+                best, best_ratio = city, ratio
+        return best['name'] if best is not None else None
+
+    def nearest_city(self, lat, lng):
+        """(название, расстояние в метрах) ближайшего города"""
+        distance, city = self.city_tree.nearest(lat, lng, k=1)[0]
+        return city['name'], distance
+
+    def reverse(self, lat, lng):
+        """{'in_russia', 'city', 'nearest_city', 'nearest_city_km'}
+
+        Точка в круге известного города считается российской, даже если
+        грубый контур проходит мимо, - кроме участков foreign за границей.
+        """
+        city = self.city(lat, lng)
+        if city is not None and self.in_foreign(lat, lng):
+            city = None
+        nearest, distance = self.nearest_city(lat, lng)
+        return {
+            'in_russia': city is not None or self.in_country(lat, lng),
+            'city': city,
+            'nearest_city': nearest,
+            'nearest_city_km': round(distance / 1000, 1),
+        }
+
+
+_geocoder = None
+
+
+def get_geocoder():
+    global _geocoder
+    if _geocoder is None:
+        _geocoder = Geocoder()
+    return _geocoder
+
+
+@lru_cache(maxsize=GEOCODE_CACHE_SIZE)
+def _reverse_rounded(lat, lng):
+    return get_geocoder().reverse(lat, lng)
+
+
+def reverse_geocode(lat, lng):
+    """Результат геокодера для координат, округлённых до GEOCODE_PRECISION знаков"""
+    result = _reverse_rounded(round(lat, GEOCODE_PRECISION), round(lng, GEOCODE_PRECISION))
+    return dict(result)
+
+
+def resolve_city(lat, lng):
+    """Город для метки: тот, в котором она стоит, иначе ближайший
+    не дальше NEAREST_CITY_MAX_KM, иначе None"""
+    result = reverse_geocode(lat, lng)
+    if result['city'] is None and result['in_russia'] and result['nearest_city_km'] <= NEAREST_CITY_MAX_KM:
+        return result['nearest_city']
+    return result['city']
@@ -1,6 +1,13 @@
+import os
+
 bind = "0.0.0.0:5000"
-workers = 2
+# Воркеры разделяют данные через STORAGE_BACKEND (sqlite или flock),
+# поэтому их число можно поднимать без потери записей
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+# Поток /api/events держал бы воркер на всё время подключения - его отдаёт stream.py
 timeout = 120
 keepalive = 5
 max_requests = 1000
-max_requests_jitter = 100 
\ No newline at end of file
+max_requests_jitter = 100
+# Однопроцессный журнал (log) небезопасен для нескольких воркеров
+raw_env = [f"STORAGE_BACKEND={os.environ.get('STORAGE_BACKEND', 'sqlite')}"]
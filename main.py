@@ -1,10 +1,20 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
+import base64
 import json
 import os
 from datetime import datetime
 import uuid
 
+from cache import GZIP_MIN_SIZE, ResponseCache
+from city_catalog import get_catalog
+from events import EventHub
+from geo import BBox, CLUSTER_MAX_ZOOM, clean_route, route_level, route_levels, route_view
+from geocoder import resolve_city, reverse_geocode
+from storage import create_storage
+from store import DataStore
+from wire import COMPACT_MIMETYPE, compact_markers, compact_routes, pack_route
+
 app = Flask(__name__)
 CORS(app)
 
@@ -13,105 +23,395 @@ MARKERS_FILE = 'zmarkers.json'
 COMMENTS_FILE = 'comments.json'
 ROUTES_FILE = 'routes.json'
 
-def load_data(filename):
-    """Загружает данные из JSON файла"""
-    if os.path.exists(filename):
-        with open(filename, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return []
+# Бэкенд хранилища выбирается в STORAGE_BACKEND (log, flock или sqlite)
+storage = create_storage()
+
+# Данные загружаются один раз при старте и дальше читаются из памяти
+store = DataStore(storage, MARKERS_FILE, COMMENTS_FILE, ROUTES_FILE)
+
+# Изменения таблиц рассылаются подписчикам /api/events
+events = EventHub()
+store.markers.listen(events.listener('marker'))
+store.comments.listen(events.listener('comment'))
+store.routes.listen(events.listener('route', route_view))
+events.watch(store.refresh)
+
+# Готовые тела ответов GET, пока не изменились данные
+response_cache = ResponseCache()
+
+def wants_compact():
+    """Клиент явно предпочитает компактный формат (wire.COMPACT_MIMETYPE)"""
+    return request.accept_mimetypes.best_match(['application/json', COMPACT_MIMETYPE]) == COMPACT_MIMETYPE
+
+def cached_json(version, build, pack=None):
+    """JSON-ответ с ETag по версии данных (ревизиям таблиц)
+
+    Если клиент прислал тот же ETag в If-None-Match, отвечаем 304 без тела.
+    Иначе тело берётся из кэша или строится вызовом build() и кэшируется.
+    pack упаковывает ответ в компактный формат, если клиент его запросил.
+    Просроченные, но ещё не удалённые записи могут оставаться в ответе
+    до очередного прохода удаления (EXPIRY_SWEEP_INTERVAL).
+    """
+    mimetype = 'application/json'
+    if pack is not None and wants_compact():
+        mimetype = COMPACT_MIMETYPE
+        version += '-c'
+    if request.if_none_match.contains_weak(version):
+        response = Response(status=304)
+    else:
+        key = (request.full_path, mimetype)
+        entry = response_cache.get(key, version)
+        if entry is None:
+            if mimetype == COMPACT_MIMETYPE:
+                body = app.json.dumps(pack(build()), ensure_ascii=False, separators=(',', ':'))
+            else:
+                body = app.json.dumps(build())
+            entry = response_cache.put(key, version, body.encode('utf-8'))
+        response = Response(entry.body, mimetype=mimetype)
+        if 'gzip' in request.accept_encodings and len(entry.body) >= GZIP_MIN_SIZE:
+            response.set_data(entry.gzipped())
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(version, weak=True)
+    # Кэшировать можно, но каждый раз с проверкой ETag
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    if pack is not None:
+        response.vary.add('Accept')
+    return response
+
+def changes_response(table, pack=None, view=None):
+    """Лента изменений таблицы после курсора ?since=...
+
+    view, если задан, преобразует каждую изменённую запись для ответа.
+    """
+    try:
+        cursor = int(request.args['since'])
+    except ValueError:
+        return jsonify({'error': 'Некорректный курсор since'}), 400
+    
+    def build():
+        changes = table.changes_since(cursor)
+        if view is not None:
+            changes['changes'] = [v for v in map(view, changes['changes']) if v is not None]
+        return changes
+    return cached_json(table.cursor(), build, pack)
+
+# Наибольший размер страницы (?limit=) и порция потоковой отдачи тела
+PAGE_MAX_LIMIT = 1000
+PAGE_CHUNK_SIZE = 64 * 1024
+
+def encode_cursor(key):
+    """Непрозрачный курсор страницы из ключа (время, id) последней записи"""
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(value):
+    try:
+        seconds, record_id = json.loads(base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)))
+        return (float(seconds), str(record_id))
+    except (TypeError, ValueError):
+        raise ValueError('Некорректный cursor')
 
-def save_data(data, filename):
-    """Сохраняет данные в JSON файл"""
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def paged_response(table, source=None, view=None, accept=None, version=None):
+    """Страница списка по ?limit=&cursor=&order=asc|desc (по времени создания)
+
+    Ответ: {'items': [...], 'next_cursor': ... или null на последней
+    странице}. source() возвращает подмножество записей (иначе - вся
+    таблица). JSON отдаётся порциями по мере сериализации записей, без
+    сборки всего тела в памяти и без кэша ответов; ETag по версии
+    таблицы (или переданной version) остаётся.
+    """
+    try:
+        limit = int(request.args['limit'])
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return jsonify({'error': 'Некорректные limit или cursor'}), 400
+    if not 1 <= limit <= PAGE_MAX_LIMIT:
+        return jsonify({'error': f'limit должен быть от 1 до {PAGE_MAX_LIMIT}'}), 400
+    order = request.args.get('order', 'asc')
+    if order not in ('asc', 'desc'):
+        return jsonify({'error': 'order должен быть asc или desc'}), 400
+    
+    version = version or table.cursor()
+    if request.if_none_match.contains_weak(version):
+        response = Response(status=304)
+    else:
+        items, last = table.page(limit, after, order == 'desc',
+                                 source() if source is not None else None, accept)
+        
+        def generate():
+            chunk = ['{"items":[']
+            size = 0
+            separator = ''
+            for record in items:
+                if view is not None:
+                    record = view(record)
+                text = separator + app.json.dumps(record)
+                separator = ','
+                chunk.append(text)
+                size += len(text)
+                if size >= PAGE_CHUNK_SIZE:
+                    yield ''.join(chunk)
+                    chunk = []
+                    size = 0
+            next_cursor = encode_cursor(last) if last is not None else None
+            chunk.append('],"next_cursor":' + app.json.dumps(next_cursor) + '}')
+            yield ''.join(chunk)
+        
+        response = Response(generate(), mimetype='application/json')
+    response.set_etag(version, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def route_detail():
+    """Функция выбора уровня детализации маршрута по ?tolerance=<метры> или ?zoom=
+
+    Для неопубликованного маршрута (черновика) функция возвращает None.
+    """
+    tolerance = request.args.get('tolerance')
+    zoom = request.args.get('zoom')
+    tolerance = float(tolerance) if tolerance is not None else None
+    zoom = int(zoom) if zoom is not None else None
+    return lambda route: route_view(route, tolerance, zoom)
 
 @app.route('/api/markers', methods=['GET'])
 def get_markers():
-    """Получить все метки"""
-    markers = load_data(MARKERS_FILE)
-    return jsonify(markers)
+    """Получить метки (все или в прямоугольнике карты ?bbox=west,south,east,north)
+    
+    С параметром ?since=<cursor> возвращает только изменения после курсора:
+    {'changes': [...], 'deleted': [id, ...], 'cursor': ..., 'reset': bool}
+    С ?limit=N - постранично (см. paged_response).
+    """
+    if 'since' in request.args:
+        return changes_response(store.markers, compact_markers)
+    
+    bbox = request.args.get('bbox')
+    user_id = request.args.get('user_id')
+    if bbox:
+        try:
+            bbox = BBox.parse(bbox)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        source = lambda: store.markers_in_bbox(bbox)
+    elif user_id:
+        source = lambda: store.markers.find('user_id', user_id)
+    else:
+        source = None
+    
+    return markers_listing(source)
 
-@app.route('/api/markers', methods=['POST'])
-def add_marker():
-    """Добавить новую метку"""
-    data = request.json
+def include_comment_summary():
+    return 'comment_summary' in request.args.get('include', '').split(',')
+
+def with_comment_summary(markers):
+    """Копии меток с полем comment_summary (количество, средний рейтинг, последние)"""
+    summaries = store.comment_summaries([m['id'] for m in markers])
+    return [dict(m, comment_summary=summaries[m['id']]) for m in markers]
+
+def markers_listing(source=None):
+    """Список меток source() (по умолчанию все) с ?limit= и ?include=comment_summary
+
+    Со сводкой комментариев версия ответа учитывает и таблицу комментариев.
+    """
+    version = store.markers.cursor()
+    view = None
+    if include_comment_summary():
+        version += '.' + store.comments.cursor()
+        view = lambda marker: with_comment_summary([marker])[0]
+    if 'limit' in request.args:
+        return paged_response(store.markers, source, view, version=version)
+    build = source or store.markers.all
+    if view is not None:
+        return cached_json(version, lambda: with_comment_summary(build()), compact_markers)
+    return cached_json(version, build, compact_markers)
+
+# Сколько меток отдаёт /api/markers/nearby за раз
+NEARBY_MAX_RESULTS = 1000
+
+@app.route('/api/markers/nearby', methods=['GET'])
+def get_nearby_markers():
+    """Ближайшие к точке метки: ?lat=&lng=&k=10 и/или &radius=<метры>
+
+    Каждая метка дополнена полем distance_m, список упорядочен по нему.
+    """
+    try:
+        lat, lng = parse_point(request.args['lat'], request.args['lng'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Нужны числовые параметры lat и lng'}), 400
+    # Через type= некорректное значение молча превратилось бы в None
+    try:
+        k = int(request.args['k']) if 'k' in request.args else None
+        radius = float(request.args['radius']) if 'radius' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'k должен быть целым числом, radius - числом'}), 400
+    if k is None and radius is None:
+        k = 10
+    if (k is not None and k <= 0) or (radius is not None and not radius > 0):
+        return jsonify({'error': 'k и radius должны быть положительными'}), 400
+    k = min(k or NEARBY_MAX_RESULTS, NEARBY_MAX_RESULTS)
+    
+    def build():
+        return [dict(marker, distance_m=round(distance, 1))
+                for distance, marker in store.nearby_markers(lat, lng, k, radius)]
+    
+    return cached_json(store.markers.cursor(), build, compact_markers)
+
+@app.route('/api/markers/clusters', methods=['GET'])
+def get_marker_clusters():
+    """Кластеры меток для видимой области (?bbox=...&zoom=...)
     
+    На крупных масштабах (zoom > CLUSTER_MAX_ZOOM) вместо кластеров
+    возвращаются сами метки.
+    """
+    try:
+        bbox = BBox.parse(request.args.get('bbox', '-180,-90,180,90'))
+        zoom = int(request.args.get('zoom', 0))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Курсор берётся до выборки: изменения во время запроса придут повторно
+    cursor = store.markers.cursor()
+    if zoom > CLUSTER_MAX_ZOOM:
+        if include_comment_summary():
+            return cached_json(cursor + '.' + store.comments.cursor(), lambda: {
+                'zoom': zoom, 'cursor': cursor,
+                'markers': with_comment_summary(store.markers_in_bbox(bbox))}, compact_markers)
+        return cached_json(cursor, lambda: {
+            'zoom': zoom, 'cursor': cursor, 'markers': store.markers_in_bbox(bbox)}, compact_markers)
+    return cached_json(cursor, lambda: {
+        'zoom': zoom, 'cursor': cursor, 'clusters': store.marker_clusters(zoom, bbox)})
+
+def parse_point(lat, lng):
+    """Координаты из запроса; ValueError, если это не точка на Земле"""
+    lat, lng = float(lat), float(lng)
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError('Координаты вне допустимого диапазона')
+    return lat, lng
+
+@app.route('/api/geocode', methods=['GET'])
+def geocode():
+    """В России ли точка и в каком она городе (локальный геокодер)"""
+    try:
+        lat, lng = parse_point(request.args['lat'], request.args['lng'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Нужны числовые параметры lat и lng'}), 400
+    
+    result = reverse_geocode(lat, lng)
+    result.update(lat=lat, lng=lng)
+    response = jsonify(result)
+    # Данные геокодера меняются только с новой версией приложения
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    return response
+
+def new_marker(data):
+    """Новая метка из данных запроса; ValueError, если данные некорректны"""
     # Валидация данных
     required_fields = ['lat', 'lng', 'comment', 'rating']
     for field in required_fields:
         if field not in data:
-            return jsonify({'error': f'Отсутствует обязательное поле: {field}'}), 400
+            raise ValueError(f'Отсутствует обязательное поле: {field}')
+    
+    try:
+        lat, lng = parse_point(data['lat'], data['lng'])
+        rating = int(data['rating'])
+    except (TypeError, ValueError):
+        raise ValueError('lat, lng и rating должны быть числами')
     
-    # Создание новой метки
-    marker = {
+    return {
         'id': str(uuid.uuid4()),
-        'lat': float(data['lat']),
-        'lng': float(data['lng']),
+        'lat': lat,
+        'lng': lng,
         'comment': data['comment'],
-        'rating': int(data['rating']),
-        'city': data.get('city', 'Неизвестный город'),
+        'rating': rating,
+        # Город определяется сервером, присланный клиентом не используется
+        'city': resolve_city(lat, lng) or 'Неизвестный город',
         'timestamp': data.get('timestamp', datetime.now().isoformat()),
         'user_id': data.get('user_id', 'anonymous')
     }
+
+def new_comment(marker_id, data):
+    """Новый комментарий к метке; ValueError, если данные некорректны"""
+    if 'comment' not in data:
+        raise ValueError('Отсутствует текст комментария')
+    
+    return {
+        'id': str(uuid.uuid4()),
+        'marker_id': marker_id,
+        'comment': data['comment'],
+        'rating': data.get('rating', 0),
+        'timestamp': data.get('timestamp', datetime.now().isoformat()),
+        'user_id': data.get('user_id', 'anonymous')
+    }
+
+def edited(record, data):
+    """Копия метки или комментария с изменёнными разрешенными полями"""
+    # Записи в хранилище не меняются на месте: обновляем копию
+    record = dict(record)
+    if 'comment' in data:
+        record['comment'] = data['comment']
+    if 'rating' in data:
+        try:
+            record['rating'] = int(data['rating'])
+        except (TypeError, ValueError):
+            raise ValueError('rating должен быть числом')
+    record['updated_at'] = datetime.now().isoformat()
+    return record
+
+@app.route('/api/markers', methods=['POST'])
+def add_marker():
+    """Добавить новую метку"""
+    try:
+        marker = new_marker(request.json)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    # Загрузка существующих меток и добавление новой
-    markers = load_data(MARKERS_FILE)
-    markers.append(marker)
-    save_data(markers, MARKERS_FILE)
+    store.markers.put(marker)
     
     return jsonify(marker), 201
 
 @app.route('/api/markers/<marker_id>/comments', methods=['GET'])
 def get_marker_comments(marker_id):
-    """Получить комментарии к метке"""
-    comments = load_data(COMMENTS_FILE)
-    marker_comments = [c for c in comments if c.get('marker_id') == marker_id]
-    return jsonify(marker_comments)
+    """Получить комментарии к метке (с ?limit=N - постранично)"""
+    if 'limit' in request.args:
+        return paged_response(store.comments, lambda: store.marker_comments(marker_id))
+    return cached_json(store.comments.cursor(), lambda: store.marker_comments(marker_id))
+
+# Сколько меток можно запросить в GET /api/comments?marker_ids=
+COMMENTS_MAX_MARKERS = 200
+
+@app.route('/api/comments', methods=['GET'])
+def get_comments_for_markers():
+    """Комментарии нескольких меток одним запросом: ?marker_ids=a,b,c
+
+    Ответ: {id метки: [комментарии по времени], ...}
+    """
+    marker_ids = [i for i in request.args.get('marker_ids', '').split(',') if i]
+    if not marker_ids:
+        return jsonify({'error': 'Нужен параметр marker_ids'}), 400
+    if len(marker_ids) > COMMENTS_MAX_MARKERS:
+        return jsonify({'error': f'Не больше {COMMENTS_MAX_MARKERS} меток за запрос'}), 400
+    return cached_json(store.comments.cursor(), lambda: store.comments_for_markers(marker_ids))
 
 @app.route('/api/markers/<marker_id>/comments', methods=['POST'])
 def add_comment(marker_id):
     """Добавить комментарий к метке"""
-    data = request.json
-    
-    # Валидация данных
-    if 'comment' not in data:
-        return jsonify({'error': 'Отсутствует текст комментария'}), 400
+    try:
+        comment = new_comment(marker_id, request.json)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     # Проверка существования метки
-    markers = load_data(MARKERS_FILE)
-    marker_exists = any(m['id'] == marker_id for m in markers)
-    if not marker_exists:
+    if store.markers.get(marker_id) is None:
         return jsonify({'error': 'Метка не найдена'}), 404
     
-    # Создание нового комментария
-    comment = {
-        'id': str(uuid.uuid4()),
-        'marker_id': marker_id,
-        'comment': data['comment'],
-        'rating': data.get('rating', 0),
-        'timestamp': data.get('timestamp', datetime.now().isoformat()),
-        'user_id': data.get('user_id', 'anonymous')
-    }
-    
-    # Загрузка существующих комментариев и добавление нового
-    comments = load_data(COMMENTS_FILE)
-    comments.append(comment)
-    save_data(comments, COMMENTS_FILE)
+    store.comments.put(comment)
     
     return jsonify(comment), 201
 
 @app.route('/api/markers/<marker_id>', methods=['DELETE'])
 def delete_marker(marker_id):
     """Удалить метку и все её комментарии"""
-    # Загрузка меток
-    markers = load_data(MARKERS_FILE)
-    markers = [m for m in markers if m['id'] != marker_id]
-    save_data(markers, MARKERS_FILE)
-    
-    # Удаление комментариев к метке
-    comments = load_data(COMMENTS_FILE)
-    comments = [c for c in comments if c.get('marker_id') != marker_id]
-    save_data(comments, COMMENTS_FILE)
+    store.delete_marker(marker_id)
     
     return jsonify({'message': 'Метка удалена'}), 200
 
@@ -120,90 +420,176 @@ def update_marker(marker_id):
     """Обновить метку"""
     data = request.json
     
-    markers = load_data(MARKERS_FILE)
-    for marker in markers:
-        if marker['id'] == marker_id:
-            # Обновляем только разрешенные поля
-            if 'comment' in data:
-                marker['comment'] = data['comment']
-            if 'rating' in data:
-                marker['rating'] = int(data['rating'])
-            marker['updated_at'] = datetime.now().isoformat()
-            save_data(markers, MARKERS_FILE)
-            return jsonify(marker)
+    marker = store.markers.get(marker_id)
+    if marker is None:
+        return jsonify({'error': 'Метка не найдена'}), 404
     
-    return jsonify({'error': 'Метка не найдена'}), 404
+    # Обновляем только разрешенные поля
+    try:
+        marker = edited(marker, data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    store.markers.put(marker)
+    return jsonify(marker)
+
+@app.route('/api/cities', methods=['GET'])
+def get_cities():
+    """Каталог городов (общий с ботом): все или по началу названия ?prefix="""
+    catalog = get_catalog()
+    prefix = request.args.get('prefix')
+    cities = catalog.search(prefix) if prefix else catalog.cities
+    response = jsonify([{'name': c['name'], 'lat': c['lat'], 'lng': c['lng']} for c in cities])
+    # Каталог меняется только с новой версией приложения
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    return response
 
 @app.route('/api/cities/<city>/markers', methods=['GET'])
 def get_city_markers(city):
-    """Получить метки для конкретного города"""
-    markers = load_data(MARKERS_FILE)
-    city_markers = [m for m in markers if m.get('city', '').lower() == city.lower()]
-    return jsonify(city_markers)
+    """Получить метки для конкретного города (с ?limit=N - постранично)"""
+    return markers_listing(lambda: store.city_markers(city))
 
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
-    """Получить статистику"""
-    markers = load_data(MARKERS_FILE)
-    comments = load_data(COMMENTS_FILE)
-    routes = load_data(ROUTES_FILE)
-    
-    stats = {
-        'total_markers': len(markers),
-        'total_comments': len(comments),
-        'total_routes': len(routes),
-        'cities': list(set(m.get('city', '') for m in markers if m.get('city'))),
-        'average_rating': sum(m.get('rating', 0) for m in markers) / len(markers) if markers else 0
-    }
+    """Получить статистику (?top=N - число городов в top_cities)"""
+    try:
+        top = int(request.args.get('top', 10))
+    except ValueError:
+        return jsonify({'error': 'top должен быть числом'}), 400
+    
+    version = '-'.join(table.cursor() for table in (store.markers, store.comments, store.routes))
+    return cached_json(version, lambda: store.stats(top))
+
+@app.route('/api/stats/cities', methods=['GET'])
+def get_city_stats():
+    """Статистика по городам: количество меток и средний рейтинг"""
+    top = request.args.get('top')
+    try:
+        top = int(top) if top is not None else None
+    except ValueError:
+        return jsonify({'error': 'top должен быть числом'}), 400
     
-    return jsonify(stats)
+    return cached_json(store.markers.cursor(), lambda: store.city_stats(top))
 
 # API для маршрутов
 @app.route('/api/routes', methods=['GET'])
 def get_routes():
-    """Получить все маршруты"""
-    routes = load_data(ROUTES_FILE)
-    return jsonify(routes)
+    """Получить все маршруты (или изменения после курсора ?since=...)
+    
+    ?tolerance=<метры> или ?zoom=<уровень> - упрощённые копии маршрутов,
+    ?limit=N - постранично (см. paged_response)
+    """
+    try:
+        view = route_detail()
+    except ValueError:
+        return jsonify({'error': 'tolerance и zoom должны быть числами'}), 400
+    
+    if 'since' in request.args:
+        return changes_response(store.routes, compact_routes, view)
+    
+    user_id = request.args.get('user_id')
+    if 'limit' in request.args:
+        # Черновики не попадают в страницу, чтобы не укорачивать её
+        source = (lambda: store.routes.find('user_id', user_id)) if user_id else None
+        return paged_response(store.routes, source, view, accept=lambda r: r.get('published', True))
+    if user_id:
+        return cached_json(store.routes.cursor(),
+                           lambda: [v for v in map(view, store.routes.find('user_id', user_id)) if v],
+                           compact_routes)
+    return cached_json(store.routes.cursor(), lambda: [v for v in map(view, store.routes.all()) if v],
+                       compact_routes)
 
 @app.route('/api/routes', methods=['POST'])
 def create_route():
-    """Создать новый маршрут"""
+    """Создать новый маршрут
+    
+    С 'draft': true маршрут создаётся черновиком: он не виден другим, пока
+    точки дописываются через POST /api/routes/<id>/points.
+    """
     data = request.json
     
     # Валидация данных
     if 'coordinates' not in data:
         return jsonify({'error': 'Отсутствуют координаты маршрута'}), 400
     
+    # Дубли GPS-точек отбрасываются, упрощённые уровни считаются один раз
+    try:
+        coordinates = clean_route(data['coordinates'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     route = {
         'id': str(uuid.uuid4()),
-        'coordinates': data['coordinates'],
+        'coordinates': coordinates,
         'user_id': data.get('user_id', 'anonymous'),
         'created_at': data.get('created_at', datetime.now().isoformat())
     }
+    if data.get('draft'):
+        route['published'] = False
+    else:
+        route['lod'] = route_levels(coordinates)
+    
+    store.routes.put(route)
+    
+    return jsonify(route_level(route)), 201
+
+@app.route('/api/routes/<route_id>/points', methods=['POST'])
+def append_route_points(route_id):
+    """Дописать порцию точек к черновику маршрута
+    
+    Тело: {'points': [[lat, lng], ...], 'publish': bool}. В хранилище
+    уходит только порция точек; с 'publish': true маршрут публикуется
+    и для него считаются уровни детализации.
+    """
+    data = request.json
+    
+    route = store.routes.get(route_id)
+    if not route:
+        return jsonify({'error': 'Маршрут не найден'}), 404
+    if route.get('published', True):
+        return jsonify({'error': 'Маршрут уже опубликован'}), 409
+    
+    points = data.get('points') or []
+    try:
+        previous = route['coordinates'][-1] if route.get('coordinates') else None
+        points = clean_route(points, previous) if points else []
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Черновик продлевается с каждой порцией, чтобы не истечь во время записи
+    route = store.routes.patch(route_id, {'coordinates': points},
+                               {'created_at': datetime.now().isoformat()})
+    if route is None:
+        return jsonify({'error': 'Маршрут не найден'}), 404
     
-    routes = load_data(ROUTES_FILE)
-    routes.append(route)
-    save_data(routes, ROUTES_FILE)
+    if data.get('publish'):
+        route = dict(route, published=True, lod=route_levels(route['coordinates']))
+        store.routes.put(route)
     
-    return jsonify(route), 201
+    return jsonify({
+        'id': route_id,
+        'points': len(route['coordinates']),
+        'published': route.get('published', True),
+    })
 
 @app.route('/api/routes/<route_id>', methods=['GET'])
 def get_route(route_id):
     """Получить конкретный маршрут"""
-    routes = load_data(ROUTES_FILE)
-    route = next((r for r in routes if r['id'] == route_id), None)
+    try:
+        view = route_detail()
+    except ValueError:
+        return jsonify({'error': 'tolerance и zoom должны быть числами'}), 400
     
-    if not route:
+    route = store.routes.get(route_id)
+    
+    if not route or not route.get('published', True):
         return jsonify({'error': 'Маршрут не найден'}), 404
     
-    return jsonify(route)
+    return cached_json(str(route.get('revision', 0)), lambda: view(route), pack_route)
 
 @app.route('/api/routes/<route_id>', methods=['DELETE'])
 def delete_route(route_id):
     """Удалить маршрут"""
-    routes = load_data(ROUTES_FILE)
-    routes = [r for r in routes if r['id'] != route_id]
-    save_data(routes, ROUTES_FILE)
+    store.routes.delete(route_id)
     
     return jsonify({'message': 'Маршрут удален'}), 200
 
@@ -212,39 +598,143 @@ def update_comment(comment_id):
     """Обновить комментарий"""
     data = request.json
     
-    comments = load_data(COMMENTS_FILE)
-    for comment in comments:
-        if comment['id'] == comment_id:
-            # Обновляем только разрешенные поля
-            if 'comment' in data:
-                comment['comment'] = data['comment']
-            if 'rating' in data:
-                comment['rating'] = int(data['rating'])
-            comment['updated_at'] = datetime.now().isoformat()
-            save_data(comments, COMMENTS_FILE)
-            return jsonify(comment)
+    comment = store.comments.get(comment_id)
+    if comment is None:
+        return jsonify({'error': 'Комментарий не найден'}), 404
     
-    return jsonify({'error': 'Комментарий не найден'}), 404
+    # Обновляем только разрешенные поля
+    try:
+        comment = edited(comment, data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    store.comments.put(comment)
+    return jsonify(comment)
 
 @app.route('/api/comments/<comment_id>', methods=['DELETE'])
 def delete_comment(comment_id):
     """Удалить комментарий"""
-    comments = load_data(COMMENTS_FILE)
-    comments = [c for c in comments if c['id'] != comment_id]
-    save_data(comments, COMMENTS_FILE)
+    store.comments.delete(comment_id)
     
     return jsonify({'message': 'Комментарий удален'}), 200
 
+# Сколько операций принимает один POST /api/batch
+BATCH_MAX_OPERATIONS = 10000
+
+@app.route('/api/batch', methods=['POST'])
+def batch_write():
+    """Пакет операций над метками и комментариями
+    
+    Тело: {'operations': [{'action': 'create'|'update'|'delete',
+    'type': 'marker'|'comment', 'id': ..., 'marker_id': ..., 'data': {...}}]}
+    
+    Все операции проверяются под блокировкой хранилища (DataStore.write_batch):
+    если хоть одна некорректна, ничего не записывается и возвращается 400
+    с ошибками по номерам операций. Иначе все операции пишутся в хранилище
+    одним обращением. Ответ:
+    {'results': [{'status': 201|200|404, 'data' | 'error': ...}, ...]}
+    """
+    data = request.json
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list):
+        return jsonify({'error': 'Ожидается список operations'}), 400
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return jsonify({'error': f'Не больше {BATCH_MAX_OPERATIONS} операций за запрос'}), 400
+    
+    tables = {'marker': store.markers, 'comment': store.comments}
+    results = []
+    errors = []
+    
+    def plan():
+        # Вызывается под блокировкой хранилища: проверки не устаревают до записи
+        # Записи, созданные или удалённые (None) предыдущими операциями пакета
+        pending = {'marker': {}, 'comment': {}}
+        
+        def lookup(kind, record_id):
+            if record_id in pending[kind]:
+                return pending[kind][record_id]
+            return tables[kind].get(record_id)
+        
+        writes = []
+        for index, operation in enumerate(operations):
+            try:
+                if not isinstance(operation, dict):
+                    raise ValueError('Операция должна быть объектом')
+                action = operation.get('action')
+                kind = operation.get('type')
+                if kind not in tables:
+                    raise ValueError('type должен быть marker или comment')
+                payload = operation.get('data') or {}
+                if not isinstance(payload, dict):
+                    raise ValueError('data должен быть объектом')
+            
+                if action == 'create':
+                    if kind == 'marker':
+                        record = new_marker(payload)
+                    else:
+                        marker_id = operation.get('marker_id') or payload.get('marker_id')
+                        record = new_comment(marker_id, payload)
+                        if lookup('marker', marker_id) is None:
+                            results.append({'status': 404, 'error': 'Метка не найдена'})
+                            continue
+                    pending[kind][record['id']] = record
+                    writes.append((tables[kind], 'put', record))
+                    results.append({'status': 201, 'data': record})
+                elif action == 'update':
+                    record = lookup(kind, operation.get('id'))
+                    if record is None:
+                        results.append({'status': 404, 'error': 'Запись не найдена'})
+                        continue
+                    record = edited(record, payload)
+                    pending[kind][record['id']] = record
+                    writes.append((tables[kind], 'put', record))
+                    results.append({'status': 200, 'data': record})
+                elif action == 'delete':
+                    record_id = operation.get('id')
+                    if lookup(kind, record_id) is None:
+                        results.append({'status': 404, 'error': 'Запись не найдена'})
+                        continue
+                    if kind == 'marker':
+                        # Комментарии удаляются вместе с меткой, как в DELETE /api/markers/<id>
+                        comments = {c['id'] for c in store.marker_comments(record_id)}
+                        comments.update(cid for cid, c in pending['comment'].items()
+                                        if c is not None and c['marker_id'] == record_id)
+                        for comment_id in comments:
+                            if lookup('comment', comment_id) is not None:
+                                pending['comment'][comment_id] = None
+                                writes.append((store.comments, 'del', comment_id))
+                    pending[kind][record_id] = None
+                    writes.append((tables[kind], 'del', record_id))
+                    results.append({'status': 200, 'data': {'id': record_id}})
+                else:
+                    raise ValueError('action должен быть create, update или delete')
+            except ValueError as e:
+                errors.append({'index': index, 'error': str(e)})
+        return None if errors else writes
+    
+    store.write_batch(plan)
+    if errors:
+        return jsonify({'error': 'Некорректные операции, ничего не записано', 'errors': errors}), 400
+    
+    return jsonify({'results': results})
+
+@app.route('/api/events', methods=['GET'])
+def get_events():
+    """Поток изменений меток, комментариев и маршрутов (Server-Sent Events)
+
+    Каждый подписчик занимает поток сервера; под gunicorn поток отдаёт stream.py.
+    """
+    response = Response(stream_with_context(events.stream()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/')
 def health_check():
     """Проверка здоровья сервиса"""
     return jsonify({'status': 'ok', 'service': 'russia-map-backend'})
 
 if __name__ == '__main__':
-    # Создаем файлы данных, если они не существуют
-    for filename in [MARKERS_FILE, COMMENTS_FILE, ROUTES_FILE]:
-        if not os.path.exists(filename):
-            save_data([], filename)
+    # Файлы данных создаются хранилищем при загрузке
     
     # Получаем порт из переменной окружения или используем 5000
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,380 @@
+"""
+Уведомления подписчикам города о новых метках и комментариях
+
+Подписки (город -> чаты) хранятся в SUBSCRIPTIONS_FILE. Изменения
+приходят из потока событий backend (/api/events, см. events.py) и
+раскладываются по чатам подписчиков. Отправка идёт через очередь:
+
+- события одного чата копятся NOTIFY_DIGEST_DELAY секунд и уходят одним
+  сообщением-сводкой, поэтому всплеск меток не превращается в поток
+  сообщений;
+- общий для всех чатов token bucket держит темп NOTIFY_RATE сообщений
+  в секунду (у Telegram предел около 30), а в один чат пишем не чаще
+  раза в NOTIFY_CHAT_INTERVAL секунд;
+- ответ 429 (RetryLater) приостанавливает всю отправку на retry_after и
+  возвращает сводку в очередь, прочие ошибки повторяются с нарастающей
+  паузой; чат, который нас заблокировал (ChatUnavailable), отписывается.
+
+Сама отправка - функция send(chat_id, text), её передаёт bot.py.
+"""
+
+import asyncio
+import heapq
+import json
+import logging
+import os
+import time
+from html import escape
+
+from backend_client import BackendError
+from city_catalog import city_key
+
+SUBSCRIPTIONS_FILE = os.environ.get('SUBSCRIPTIONS_FILE', 'subscriptions.json')
+SUBSCRIPTIONS_PER_CHAT = 20
+NOTIFY_RATE = float(os.environ.get('NOTIFY_RATE', 25))
+NOTIFY_CHAT_INTERVAL = float(os.environ.get('NOTIFY_CHAT_INTERVAL', 3))
+NOTIFY_DIGEST_DELAY = float(os.environ.get('NOTIFY_DIGEST_DELAY', 10))
+NOTIFY_WORKERS = int(os.environ.get('NOTIFY_WORKERS', 8))
+# Сколько событий показывать в сводке по городу и хранить на чат
+NOTIFY_DIGEST_ITEMS = 5
+NOTIFY_PENDING_LIMIT = 50
+NOTIFY_TEXT_LENGTH = 100
+NOTIFY_MAX_ATTEMPTS = 5
+NOTIFY_RETRY_DELAY = 2
+
+
+class RetryLater(Exception):
+    """Telegram просит подождать (429 Too Many Requests)"""
+
+    def __init__(self, retry_after):
+        super().__init__(f'retry after {retry_after}s')
+        self.retry_after = retry_after
+
+
+class ChatUnavailable(Exception):
+    """Чат недоступен: бот заблокирован или чат удалён"""
+
+
+class Subscriptions:
+    """Подписки чатов на города с индексом город -> чаты"""
+
+    def __init__(self, path=SUBSCRIPTIONS_FILE):
+        self.path = path
+        # chat_id -> {ключ города: название}
+        self.by_chat = {}
+        self.by_city = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        except json.JSONDecodeError:
+            print(f"⚠️ Файл {path} поврежден, подписки начинаются заново")
+            data = {}
+        for chat_id, cities in data.items():
+            for city in cities:
+                self._add(int(chat_id), city)
+
+    def _add(self, chat_id, city):
+        key = city_key(city)
+        self.by_chat.setdefault(chat_id, {})[key] = city
+        self.by_city.setdefault(key, set()).add(chat_id)
+
+    def _save(self):
+        data = {str(chat_id): list(cities.values()) for chat_id, cities in self.by_chat.items()}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def subscribe(self, chat_id, city):
+        """Подписывает чат; False, если уже подписан или подписок слишком много"""
+        cities = self.by_chat.get(chat_id, {})
+        if city_key(city) in cities or len(cities) >= SUBSCRIPTIONS_PER_CHAT:
+            return False
+        self._add(chat_id, city)
+        self._save()
+        return True
+
+    def unsubscribe(self, chat_id, city=None):
+        """Отписывает чат от города (или от всех); возвращает названия отписанных"""
+        cities = self.by_chat.get(chat_id, {})
+        keys = [city_key(city)] if city is not None else list(cities)
+        removed = []
+        for key in keys:
+            if key not in cities:
+                continue
+            removed.append(cities.pop(key))
+            chats = self.by_city.get(key)
+            chats.discard(chat_id)
+            if not chats:
+                del self.by_city[key]
+        if not cities:
+            self.by_chat.pop(chat_id, None)
+        if removed:
+            self._save()
+        return removed
+
+    def cities(self, chat_id):
+        return list(self.by_chat.get(chat_id, {}).values())
+
+    def chats(self, city):
+        return self.by_city.get(city_key(city or ''), ())
+
+
+class TokenBucket:
+    """Не больше rate событий в секунду, всплеск до burst
+
+    По умолчанию без всплеска: иначе за секунду уходит rate + burst
+    сообщений и сразу упирается в предел Telegram.
+    """
+
+    def __init__(self, rate, burst=1.0):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def pause(self, seconds):
+        """Останавливает выдачу на seconds (ответ 429 от Telegram)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def format_digest(events):
+    """Сводка событий одного чата, сгруппированная по городам (HTML)"""
+    by_city = {}
+    for event in events:
+        by_city.setdefault(event['city'], []).append(event)
+    lines = ['🔔 <b>Новое на карте</b>']
+    for city, items in by_city.items():
+        lines.append(f"\n🏙 <b>{escape(city)}</b>")
+        for event in items[:NOTIFY_DIGEST_ITEMS]:
+            text = escape((event.get('text') or '')[:NOTIFY_TEXT_LENGTH])
+            if event['kind'] == 'marker':
+                lines.append(f"📍 {text} (⭐ {event.get('rating', 0)}/5)")
+            else:
+                lines.append(f"💬 {text}")
+        if len(items) > NOTIFY_DIGEST_ITEMS:
+            lines.append(f"… и ещё {len(items) - NOTIFY_DIGEST_ITEMS}")
+    return '\n'.join(lines)
+
+
+class Notifier:
+    """Очередь сводок по чатам с общим и початовым ограничением темпа"""
+
+    def __init__(self, send, subscriptions, rate=NOTIFY_RATE, chat_interval=NOTIFY_CHAT_INTERVAL,
+                 digest_delay=NOTIFY_DIGEST_DELAY, workers=NOTIFY_WORKERS):
+        self.send = send
+        self.subscriptions = subscriptions
+        self.bucket = TokenBucket(rate)
+        self.chat_interval = chat_interval
+        self.digest_delay = digest_delay
+        self.workers = workers
+        # chat_id -> ожидающие события; очередь (срок, chat_id) и чаты в ней
+        self.pending = {}
+        self.schedule = []
+        self.scheduled = set()
+        # chat_id -> раньше этого момента (time.monotonic) в чат не пишем
+        self.next_allowed = {}
+        self.attempts = {}
+        self.ready = asyncio.Queue()
+        self.wakeup = asyncio.Event()
+        self.tasks = []
+        self.sent = 0
+        self.retried = 0
+        self.dropped = 0
+
+    def publish(self, event):
+        """Раскладывает событие {'kind', 'city', 'text', 'rating'} по подписчикам города"""
+        chats = self.subscriptions.chats(event['city'])
+        now = time.monotonic()
+        for chat_id in chats:
+            events = self.pending.setdefault(chat_id, [])
+            events.append(event)
+            if len(events) > NOTIFY_PENDING_LIMIT:
+                del events[0]
+            if chat_id not in self.scheduled:
+                self._schedule(chat_id, max(now + self.digest_delay, self.next_allowed.get(chat_id, 0)))
+        return len(chats)
+
+    def _schedule(self, chat_id, due):
+        heapq.heappush(self.schedule, (due, chat_id))
+        self.scheduled.add(chat_id)
+        self.wakeup.set()
+
+    async def _scheduler(self):
+        # Передаёт работникам чаты, чья сводка созрела
+        while True:
+            now = time.monotonic()
+            while self.schedule and self.schedule[0][0] <= now:
+                _, chat_id = heapq.heappop(self.schedule)
+                self.ready.put_nowait(chat_id)
+            timeout = self.schedule[0][0] - now if self.schedule else None
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self):
+        while True:
+            chat_id = await self.ready.get()
+            allowed = self.next_allowed.get(chat_id, 0)
+            if allowed > time.monotonic():
+                # Чат снова в очереди раньше срока (после повтора): ждём своей очереди
+                heapq.heappush(self.schedule, (allowed, chat_id))
+                self.wakeup.set()
+                continue
+            self.scheduled.discard(chat_id)
+            events = self.pending.pop(chat_id, None)
+            if not events:
+                continue
+            await self.bucket.acquire()
+            self.next_allowed[chat_id] = time.monotonic() + self.chat_interval
+            try:
+                await self.send(chat_id, format_digest(events))
+            except RetryLater as e:
+                logging.warning(f"Telegram просит паузу {e.retry_after} с")
+                self.bucket.pause(e.retry_after)
+                self._retry(chat_id, events, e.retry_after)
+            except ChatUnavailable:
+                self.subscriptions.unsubscribe(chat_id)
+                self.dropped += len(events)
+            except Exception as e:
+                attempts = self.attempts.get(chat_id, 0) + 1
+                if attempts >= NOTIFY_MAX_ATTEMPTS:
+                    logging.error(f"Сводка для чата {chat_id} не отправлена: {e}")
+                    self.attempts.pop(chat_id, None)
+                    self.dropped += len(events)
+                else:
+                    self.attempts[chat_id] = attempts
+                    self._retry(chat_id, events, NOTIFY_RETRY_DELAY * 2 ** (attempts - 1))
+            else:
+                self.sent += 1
+                self.attempts.pop(chat_id, None)
+
+    def _retry(self, chat_id, events, delay):
+        self.retried += 1
+        self.pending[chat_id] = (events + self.pending.get(chat_id, []))[-NOTIFY_PENDING_LIMIT:]
+        self.next_allowed[chat_id] = time.monotonic() + delay
+        if chat_id not in self.scheduled:
+            self._schedule(chat_id, self.next_allowed[chat_id])
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._scheduler())]
+        self.tasks += [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def stats(self):
+        return {
+            'pending_chats': len(self.pending),
+            'sent': self.sent,
+            'retried': self.retried,
+            'dropped': self.dropped,
+        }
+
+
+class MarkerFeed:
+    """Превращает события backend в уведомления о новых метках и комментариях
+
+    Город комментария берётся из его метки, поэтому лента помнит город
+    каждой живой метки.
+    """
+
+    def __init__(self):
+        self.marker_cities = {}
+
+    def reset(self, markers):
+        self.marker_cities = {m['id']: m.get('city') for m in markers}
+
+    def apply_changes(self, changes):
+        """Ответ /markers?since=: уведомления о пропущенных новых метках
+
+        При reset=True состояние строится заново, без уведомлений: какие
+        из меток новые, уже не узнать.
+        """
+        if changes['reset']:
+            self.reset(changes['changes'])
+            return []
+        for marker_id in changes['deleted']:
+            self.marker_cities.pop(marker_id, None)
+        notifications = (self.handle('marker.put', marker) for marker in changes['changes'])
+        return [n for n in notifications if n is not None]
+
+    def handle(self, event_type, data):
+        """Уведомление для события или None (изменения и удаления не сообщаются)"""
+        if event_type == 'marker.put':
+            known = data['id'] in self.marker_cities
+            self.marker_cities[data['id']] = data.get('city')
+            if known or data.get('updated_at'):
+                return None
+            return {'kind': 'marker', 'city': data.get('city'),
+                    'text': data.get('comment'), 'rating': data.get('rating', 0)}
+        if event_type == 'marker.delete':
+            self.marker_cities.pop(data['id'], None)
+        elif event_type == 'comment.put' and not data.get('updated_at'):
+            city = self.marker_cities.get(data.get('marker_id'))
+            if city:
+                return {'kind': 'comment', 'city': city, 'text': data.get('comment')}
+        return None
+
+
+async def follow_changes(backend, notifier, events_url):
+    """Читает поток событий backend и отдаёт уведомления notifier
+
+    Сначала подключается поток, затем догружаются изменения меток после
+    курсора (/markers?since=): изменения между загрузкой и подпиской не
+    теряются, а при переподключении скачиваются только пропущенные.
+    Полная загрузка - при первом подключении и когда backend отвечает
+    reset. После обрыва переподключается с нарастающей паузой.
+    """
+    feed = MarkerFeed()
+    cursor = None
+    delay = 1
+
+    async def catch_up():
+        nonlocal cursor
+        # Повторы уже известных меток в потоке feed.handle пропустит
+        changes = await backend.get_json('/markers', params={'since': str(cursor or 0)})
+        if cursor is None:
+            changes['reset'] = True
+        for notification in feed.apply_changes(changes):
+            notifier.publish(notification)
+        cursor = max(cursor or 0, int(changes['cursor']))
+
+    while True:
+        try:
+            async for event_type, data in backend.events(events_url):
+                delay = 1
+                if event_type in ('open', 'resync'):
+                    await catch_up()
+                    continue
+                if event_type.startswith('marker.'):
+                    cursor = max(cursor, data.get('revision') or 0)
+                notification = feed.handle(event_type, data)
+                if notification is not None:
+                    notifier.publish(notification)
+        except (BackendError, ValueError, KeyError) as e:
+            logging.warning(f"Поток событий backend прерван: {e}")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 60)
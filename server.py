@@ -3,14 +3,20 @@
 Веб-сервер для раздачи статических файлов приложения
 """
 
-from flask import Flask, render_template_string, send_from_directory
+from flask import Flask, Response, render_template_string, request
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from assets import Asset, AssetStore
 
 app = Flask(__name__)
 
 # Получаем URL backend из переменной окружения
 BACKEND_URL = os.environ.get('BACKEND_URL', 'http://localhost:5000')
+# Поток /api/events (stream.py): открытый поток не должен занимать воркер backend
+EVENTS_BACKEND_URL = os.environ.get('EVENTS_BACKEND_URL', BACKEND_URL)
 
 # HTML шаблон для главной страницы
 MAIN_PAGE_HTML = """
@@ -150,7 +156,7 @@ MAIN_PAGE_HTML = """
             </ul>
         </div>
 
-        <a href="/app" class="btn">🚀 Открыть приложение</a>
+        <a href="{{ asset_url('index.html') }}" class="btn">🚀 Открыть приложение</a>
         <a href="/api/stats" class="btn btn-secondary" target="_blank">📊 API Статистика</a>
         
         <div class="status online" id="status">
@@ -185,38 +191,122 @@ MAIN_PAGE_HTML = """
 </html>
 """
 
+# Файлы приложения и главная страница, подготовленные один раз при запуске
+APP_ASSETS = ('index.html',)
+static_assets = AssetStore(os.path.dirname(os.path.abspath(__file__)), APP_ASSETS)
+static_assets.preload()
+
+def render_main_page():
+    with app.app_context():
+        html = render_template_string(MAIN_PAGE_HTML, asset_url=static_assets.url)
+    return Asset('index.html', html.encode('utf-8'), 'text/html; charset=utf-8')
+
+main_page = render_main_page()
+
 @app.route('/')
 def index():
     """Главная страница"""
-    return render_template_string(MAIN_PAGE_HTML)
+    return main_page.response()
 
 @app.route('/app')
 def app_page():
     """Страница приложения (редирект на /)"""
-    return render_template_string(MAIN_PAGE_HTML)
+    return main_page.response()
 
 @app.route('/app/<path:filename>')
 def app_files(filename):
     """Статические файлы приложения"""
-    return send_from_directory('.', filename)
+    response = static_assets.response(filename)
+    if response is None:
+        return {'error': 'Файл не найден'}, 404
+    return response
+
+# Таймауты обращения к backend (секунды): соединение и ожидание данных.
+# Поток /api/events шлёт пинг раньше, чем истечёт таймаут чтения
+PROXY_CONNECT_TIMEOUT = float(os.environ.get('PROXY_CONNECT_TIMEOUT', 3))
+PROXY_READ_TIMEOUT = float(os.environ.get('PROXY_READ_TIMEOUT', 30))
+# Размер пула keep-alive соединений и порции потоковой передачи тела
+PROXY_POOL_SIZE = int(os.environ.get('PROXY_POOL_SIZE', 32))
+PROXY_CHUNK_SIZE = 64 * 1024
+
+# Заголовки одного соединения (RFC 7230), они не передаются через прокси
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailer', 'trailers', 'transfer-encoding', 'upgrade',
+}
+# Их ставит сам Flask, иначе в ответе они оказываются дважды
+UPSTREAM_RESPONSE_HEADERS = {'server', 'date'}
+
+def create_backend_session():
+    """Сессия с пулом соединений к backend и повтором идемпотентных запросов
 
-@app.route('/api/<path:path>')
+    Обрыв соединения до отправки запроса повторяется для любого метода,
+    ошибка чтения и ответы 502/503/504 - только для идемпотентных.
+    """
+    retry = Retry(total=2, connect=2, read=1, backoff_factor=0.1,
+                  allowed_methods=frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}),
+                  status_forcelist=(502, 503, 504), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=PROXY_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+backend = create_backend_session()
+
+def proxy_headers(headers, exclude=()):
+    """Заголовки без hop-by-hop, перечисленных в Connection и в exclude"""
+    listed = {name.strip().lower() for name in headers.get('Connection', '').split(',')}
+    return [(name, value) for name, value in headers.items()
+            if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() not in listed
+            and name.lower() not in exclude]
+
+@app.route('/api/<path:path>', methods=['GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'])
 def api_proxy(path):
-    """Прокси для API запросов к backend"""
+    """Прокси для API запросов к backend
+
+    Передаёт метод, строку запроса, тело и заголовки (в том числе ETag /
+    If-None-Match), а ответ отдаёт порциями, не собирая его в памяти.
+    Сжатое тело передаётся как есть.
+    """
+    upstream = EVENTS_BACKEND_URL if path == 'events' else BACKEND_URL
+    url = f'{upstream}/api/{path}'
+    if request.query_string:
+        url += '?' + request.query_string.decode('latin-1')
+    headers = {name: value for name, value in proxy_headers(request.headers)
+               if name.lower() not in ('host', 'content-length')}
+    # Без этого requests сам запросит gzip, а тело отдаётся клиенту несжатым
+    headers.setdefault('Accept-Encoding', 'identity')
+    headers['X-Forwarded-For'] = request.remote_addr or ''
+    headers['X-Forwarded-Proto'] = request.scheme
     try:
-        response = requests.get(f'{BACKEND_URL}/api/{path}')
-        return response.text, response.status_code, response.headers.items()
-    except:
+        response = backend.request(request.method, url, headers=headers,
+                                   data=request.get_data() or None, stream=True,
+                                   allow_redirects=False,
+                                   timeout=(PROXY_CONNECT_TIMEOUT, PROXY_READ_TIMEOUT))
+    except requests.Timeout:
+        return {'error': 'Backend не ответил вовремя'}, 504
+    except requests.RequestException:
         return {'error': 'Backend недоступен'}, 503
 
+    def body():
+        try:
+            yield from response.raw.stream(PROXY_CHUNK_SIZE, decode_content=False)
+        finally:
+            response.close()
+
+    return Response(body(), status=response.status_code,
+                    headers=proxy_headers(response.raw.headers, UPSTREAM_RESPONSE_HEADERS))
+
 @app.route('/health')
 def health_check():
     """Проверка здоровья сервиса"""
-    return {'status': 'ok', 'service': 'russia-map-frontend', 'backend_url': BACKEND_URL}
+    return {'status': 'ok', 'service': 'russia-map-frontend', 'backend_url': BACKEND_URL,
+            'events_backend_url': EVENTS_BACKEND_URL}
 
 @app.route('/index.html')
 def index_html():
-    return render_template_string(MAIN_PAGE_HTML)
+    return main_page.response()
 
 if __name__ == '__main__':
     # Получаем порт из переменной окружения или используем 3000
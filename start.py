@@ -2,21 +2,61 @@
 """
 Скрипт для запуска всех компонентов проекта
 Telegram Bot - Карта России с метками и комментариями
+
+Компоненты запускаются одновременно. Готовность проверяется по
+настоящим ответам: GET / у backend (main.py), GET /health у потока
+событий (stream.py) и веб-сервера (server.py), у бота - строка о начале
+опроса в его логе (в режиме webhook - GET /health). Backend и stream.py
+делят хранилище STORAGE_BACKEND (по умолчанию sqlite), веб-сервер
+направляет /api/events в stream.py. Вывод каждого процесса читает отдельный поток
+и печатает с именем компонента, поэтому заполненный канал не
+останавливает процесс. Упавший компонент перезапускается с
+нарастающей паузой, остальные продолжают работать.
+
+Ключ --no-install пропускает установку зависимостей.
 """
 
 import os
-import sys
+import signal
 import subprocess
-import time
+import sys
 import threading
+import time
+import urllib.error
+import urllib.request
 from pathlib import Path
 
+PROJECT_DIR = Path(__file__).resolve().parent
+BACKEND_PORT = int(os.environ.get('BACKEND_PORT', 5000))
+WEBAPP_PORT = int(os.environ.get('WEBAPP_PORT', 8080))
+STREAM_PORT = int(os.environ.get('STREAM_PORT', 5001))
+# Хранилище, общее для backend и stream.py (журнал log - только для одного процесса)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'sqlite')
+# Сколько ждать готовности компонента, прежде чем перезапустить его
+READY_TIMEOUT = 60
+READY_POLL_INTERVAL = 0.1
+HEALTH_TIMEOUT = 1
+# Пауза перед перезапуском: 1, 2, 4... секунд, но не больше RESTART_MAX_DELAY;
+# проработавший RESTART_RESET_AFTER секунд снова перезапускается через 1 с
+RESTART_BASE_DELAY = 1
+RESTART_MAX_DELAY = 60
+RESTART_RESET_AFTER = 60
+STOP_TIMEOUT = 5
+
+output_lock = threading.Lock()
+
+
+def log(message):
+    with output_lock:
+        print(message, flush=True)
+
+
 def print_banner():
     """Вывод баннера проекта"""
     banner = """
     🗺 Telegram Bot - Карта России с метками и комментариями
     ========================================================
-    
+
     🚀 Запуск всех компонентов...
     """
     print(banner)
@@ -33,7 +73,7 @@ def install_requirements(requirements_file):
     if os.path.exists(requirements_file):
         print(f"📦 Установка зависимостей из {requirements_file}...")
         try:
-            subprocess.run([sys.executable, "-m", "pip", "install", "-r", requirements_file], 
+            subprocess.run([sys.executable, "-m", "pip", "install", "-r", requirements_file],
                          check=True, capture_output=True)
             print(f"✅ Зависимости установлены")
         except subprocess.CalledProcessError as e:
@@ -41,168 +81,198 @@ def install_requirements(requirements_file):
             return False
     return True
 
-def start_backend():
-    """Запуск backend сервера"""
-    print("🔧 Запуск Flask Backend...")
-    backend_dir = Path("backend")
-    if not backend_dir.exists():
-        print("❌ Папка backend не найдена")
-        return False
-    
-    # Установка зависимостей backend
-    if not install_requirements("backend/requirements.txt"):
-        return False
-    
-    # Запуск backend
+def http_ok(url):
+    """True, если url отвечает 200"""
     try:
-        process = subprocess.Popen([sys.executable, "main.py"], 
-                                 cwd=backend_dir,
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE)
-        time.sleep(2)  # Даем время на запуск
-        if process.poll() is None:
-            print("✅ Backend запущен на http://localhost:5000")
-            return process
-        else:
-            print("❌ Ошибка запуска backend")
-            return False
-    except Exception as e:
-        print(f"❌ Ошибка запуска backend: {e}")
+        with urllib.request.urlopen(url, timeout=HEALTH_TIMEOUT) as response:
+            return response.status == 200
+    except (urllib.error.URLError, OSError):
         return False
 
-def start_webapp():
-    """Запуск веб-сервера для frontend"""
-    print("🌐 Запуск веб-сервера для frontend...")
-    webapp_dir = Path("webapp")
-    if not webapp_dir.exists():
-        print("❌ Папка webapp не найдена")
-        return False
-    
-    try:
-        process = subprocess.Popen([sys.executable, "-m", "http.server", "8080"], 
-                                 cwd=webapp_dir,
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE)
-        time.sleep(1)
-        if process.poll() is None:
-            print("✅ Веб-сервер запущен на http://localhost:8080")
-            return process
-        else:
-            print("❌ Ошибка запуска веб-сервера")
-            return False
-    except Exception as e:
-        print(f"❌ Ошибка запуска веб-сервера: {e}")
-        return False
 
-def start_bot():
-    """Запуск Telegram бота"""
-    print("🤖 Запуск Telegram бота...")
-    bot_dir = Path("bot")
-    if not bot_dir.exists():
-        print("❌ Папка bot не найдена")
-        return False
-    
+class Component:
+    """Дочерний процесс с проверкой готовности и перезапуском"""
+
+    def __init__(self, name, command, env=None, health_url=None, ready_line=None):
+        self.name = name
+        self.command = command
+        self.env = env or {}
+        # Готовность: ответ 200 по health_url или строка ready_line в выводе
+        self.health_url = health_url
+        self.ready_line = ready_line
+        self.process = None
+        self.started_at = None
+        self.ready = threading.Event()
+        self.failures = 0
+        self.restart_at = None
+
+    def start(self):
+        env = dict(os.environ, PYTHONUNBUFFERED='1', **self.env)
+        self.ready.clear()
+        self.started_at = time.monotonic()
+        self.process = subprocess.Popen(self.command, cwd=PROJECT_DIR, env=env,
+                                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        threading.Thread(target=self._read_output, args=(self.process,), daemon=True).start()
+        threading.Thread(target=self._wait_ready, args=(self.process,), daemon=True).start()
+
+    def _read_output(self, process):
+        # Вывод читается построчно всё время работы процесса
+        for raw in iter(process.stdout.readline, b''):
+            line = raw.decode('utf-8', errors='replace').rstrip()
+            log(f"[{self.name}] {line}")
+            if self.ready_line and self.ready_line in line:
+                self.ready.set()
+        process.stdout.close()
+
+    def _wait_ready(self, process):
+        deadline = self.started_at + READY_TIMEOUT
+        while process.poll() is None and not self.ready.is_set():
+            if self.health_url and http_ok(self.health_url):
+                self.ready.set()
+                break
+            if time.monotonic() > deadline:
+                log(f"⚠️  {self.name} не готов за {READY_TIMEOUT} с, перезапуск")
+                process.terminate()
+                return
+            self.ready.wait(READY_POLL_INTERVAL)
+        if self.ready.is_set():
+            log(f"✅ {self.name} готов за {time.monotonic() - self.started_at:.2f} с")
+
+    def exited(self):
+        return self.process is not None and self.process.poll() is not None
+
+    def schedule_restart(self):
+        """Запоминает, когда перезапустить упавший процесс; возвращает паузу"""
+        if time.monotonic() - self.started_at >= RESTART_RESET_AFTER:
+            self.failures = 0
+        delay = min(RESTART_MAX_DELAY, RESTART_BASE_DELAY * 2 ** self.failures)
+        self.failures += 1
+        self.restart_at = time.monotonic() + delay
+        return delay
+
+    def stop(self):
+        if self.process is None or self.process.poll() is not None:
+            return
+        try:
+            self.process.terminate()
+            self.process.wait(timeout=STOP_TIMEOUT)
+            print(f"✅ {self.name} остановлен")
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            print(f"⚠️  {self.name} принудительно остановлен")
+        except Exception as e:
+            print(f"❌ Ошибка остановки {self.name}: {e}")
+
+
+class Supervisor:
+    """Параллельный запуск компонентов и перезапуск упавших"""
+
+    def __init__(self, components):
+        self.components = components
+        self.stopping = threading.Event()
+
+    def run(self, on_ready=None):
+        """Запускает компоненты и следит за ними до вызова stop()"""
+        started = time.monotonic()
+        for component in self.components:
+            log(f"🔧 Запуск {component.name}...")
+            component.start()
+        all_ready = False
+        while not self.stopping.is_set():
+            if not all_ready and all(c.ready.is_set() for c in self.components):
+                all_ready = True
+                log(f"\n🎉 Все компоненты готовы за {time.monotonic() - started:.2f} с")
+                if on_ready:
+                    on_ready()
+            for component in self.components:
+                if component.restart_at is not None:
+                    if time.monotonic() >= component.restart_at:
+                        component.restart_at = None
+                        log(f"🔄 Перезапуск {component.name} (попытка {component.failures})")
+                        component.start()
+                elif component.exited():
+                    delay = component.schedule_restart()
+                    log(f"❌ {component.name} завершился с кодом {component.process.returncode}, "
+                        f"перезапуск через {delay} с")
+            self.stopping.wait(READY_POLL_INTERVAL)
+
+    def stop(self):
+        self.stopping.set()
+        for component in self.components:
+            component.stop()
+
+
+def default_components():
+    """Backend, поток событий, веб-сервер и бот (если в bot.py задан токен)"""
+    components = [
+        Component("Backend", [sys.executable, "main.py"],
+                  env={'PORT': str(BACKEND_PORT), 'STORAGE_BACKEND': STORAGE_BACKEND},
+                  health_url=f"http://localhost:{BACKEND_PORT}/"),
+        Component("Stream", [sys.executable, "stream.py"],
+                  env={'STREAM_PORT': str(STREAM_PORT), 'STORAGE_BACKEND': STORAGE_BACKEND},
+                  health_url=f"http://localhost:{STREAM_PORT}/health"),
+        Component("WebApp", [sys.executable, "server.py"],
+                  env={'PORT': str(WEBAPP_PORT), 'BACKEND_URL': f"http://localhost:{BACKEND_PORT}",
+                       'EVENTS_BACKEND_URL': f"http://localhost:{STREAM_PORT}"},
+                  health_url=f"http://localhost:{WEBAPP_PORT}/health"),
+    ]
+
     # Проверка токена бота
-    bot_file = bot_dir / "bot.py"
-    if bot_file.exists():
-        with open(bot_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-            if 'YOUR_BOT_TOKEN_HERE' in content:
-                print("⚠️  ВНИМАНИЕ: Не забудьте установить токен бота в bot/bot.py")
-                print("   Создайте бота через @BotFather и замените API_TOKEN")
-                return False
-    
-    # Установка зависимостей bot
-    if not install_requirements("bot/requirements.txt"):
-        return False
-    
-    # Запуск бота
-    try:
-        process = subprocess.Popen([sys.executable, "bot.py"], 
-                                 cwd=bot_dir,
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE)
-        time.sleep(2)
-        if process.poll() is None:
-            print("✅ Telegram бот запущен")
-            return process
-        else:
-            print("❌ Ошибка запуска бота")
-            return False
-    except Exception as e:
-        print(f"❌ Ошибка запуска бота: {e}")
-        return False
+    with open(PROJECT_DIR / "bot.py", 'r', encoding='utf-8') as f:
+        if 'YOUR_BOT_TOKEN_HERE' in f.read():
+            print("⚠️  ВНИМАНИЕ: Не забудьте установить токен бота в bot.py")
+            print("   Создайте бота через @BotFather и замените API_TOKEN")
+            print("   Бот не запускается")
+            return components
+
+    bot_env = {'EVENTS_URL': f"http://localhost:{STREAM_PORT}/api/events"}
+    if os.environ.get('BOT_MODE') == 'webhook':
+        port = os.environ.get('WEBHOOK_PORT', '8443')
+        components.append(Component("Bot", [sys.executable, "bot.py"], env=bot_env,
+                                    health_url=f"http://localhost:{port}/health"))
+    else:
+        # aiogram пишет это после успешного getMe
+        components.append(Component("Bot", [sys.executable, "bot.py"], env=bot_env,
+                                    ready_line="Run polling for bot"))
+    return components
+
+def print_instructions():
+    log(f"""
+📋 Доступные сервисы:
+   • Backend API: http://localhost:{BACKEND_PORT}
+   • Поток событий: http://localhost:{STREAM_PORT}/api/events
+   • WebApp: http://localhost:{WEBAPP_PORT}/app
+   • Telegram Bot: активен
+
+📖 Инструкции:
+   1. Откройте Telegram и найдите вашего бота
+   2. Отправьте команду /start
+   3. Выберите город и откройте карту
+   4. Добавляйте метки и комментарии!
+
+⏹  Для остановки нажмите Ctrl+C""")
+
+def handle_sigterm(signum, frame):
+    raise KeyboardInterrupt
 
 def main():
     """Основная функция"""
     print_banner()
     check_python_version()
-    
-    processes = []
-    
-    try:
-        # Запуск backend
-        backend_process = start_backend()
-        if backend_process:
-            processes.append(("Backend", backend_process))
-        
-        # Запуск веб-сервера
-        webapp_process = start_webapp()
-        if webapp_process:
-            processes.append(("WebApp", webapp_process))
-        
-        # Запуск бота
-        bot_process = start_bot()
-        if bot_process:
-            processes.append(("Bot", bot_process))
-        
-        if not processes:
-            print("\n❌ Не удалось запустить ни одного компонента")
+
+    if '--no-install' not in sys.argv:
+        if not install_requirements(str(PROJECT_DIR / "requirements.txt")):
             return
-        
-        print("\n🎉 Все компоненты запущены!")
-        print("\n📋 Доступные сервисы:")
-        print("   • Backend API: http://localhost:5000")
-        print("   • WebApp: http://localhost:8080")
-        print("   • Telegram Bot: активен")
-        
-        print("\n📖 Инструкции:")
-        print("   1. Откройте Telegram и найдите вашего бота")
-        print("   2. Отправьте команду /start")
-        print("   3. Выберите город и откройте карту")
-        print("   4. Добавляйте метки и комментарии!")
-        
-        print("\n⏹  Для остановки нажмите Ctrl+C")
-        
-        # Ожидание завершения
-        try:
-            while True:
-                time.sleep(1)
-                # Проверяем, что все процессы еще работают
-                for name, process in processes:
-                    if process.poll() is not None:
-                        print(f"\n❌ {name} неожиданно завершился")
-                        return
-        except KeyboardInterrupt:
-            print("\n\n🛑 Остановка всех компонентов...")
-            
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    supervisor = Supervisor(default_components())
+    try:
+        supervisor.run(on_ready=print_instructions)
     except KeyboardInterrupt:
-        print("\n\n🛑 Получен сигнал остановки")
-    
+        print("\n\n🛑 Остановка всех компонентов...")
     finally:
-        # Остановка всех процессов
-        for name, process in processes:
-            try:
-                process.terminate()
-                process.wait(timeout=5)
-                print(f"✅ {name} остановлен")
-            except subprocess.TimeoutExpired:
-                process.kill()
-                print(f"⚠️  {name} принудительно остановлен")
-            except Exception as e:
-                print(f"❌ Ошибка остановки {name}: {e}")
-        
+        supervisor.stop()
         print("\n👋 Все компоненты остановлены")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
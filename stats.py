@@ -0,0 +1,172 @@
+"""
+Статистика по меткам, обновляемая при каждой записи
+
+MarkerStats подключается к таблице меток как наблюдатель (store.Table.observe)
+и поддерживает счётчики за O(1) на операцию, поэтому /api/stats не
+перебирает метки. CommentSummary так же ведёт сводку комментариев
+каждой метки для списков меток, PublishedRoutes - опубликованные маршруты.
+"""
+
+import bisect
+import heapq
+import os
+
+# Сколько последних комментариев показывать в сводке и сколько символов текста
+COMMENT_PREVIEWS = int(os.environ.get('COMMENT_PREVIEWS', 3))
+COMMENT_PREVIEW_LENGTH = 140
+
+
+class MarkerStats:
+    """Количество меток, сумма рейтингов и разбивка по городам"""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.count = 0
+        self.rating_sum = 0
+        # Ключ города (lower) -> [название, количество, сумма рейтингов]
+        self.cities = {}
+
+    def add(self, record):
+        self._update(record, 1)
+
+    def remove(self, record):
+        self._update(record, -1)
+
+    def _update(self, record, sign):
+        rating = record.get('rating', 0) or 0
+        self.count += sign
+        self.rating_sum += sign * rating
+
+        city = record.get('city')
+        if not city:
+            return
+        key = city.lower()
+        entry = self.cities.get(key)
+        if entry is None:
+            entry = self.cities[key] = [city, 0, 0]
+        entry[1] += sign
+        entry[2] += sign * rating
+        if entry[1] <= 0:
+            del self.cities[key]
+
+    def without(self, records):
+        """Статистика без records (просроченных, ещё не удалённых меток)
+
+        Копируется только при непустом records: обычно между проходами
+        удаления таких меток немного.
+        """
+        if not records:
+            return self
+        stats = MarkerStats()
+        stats.count = self.count
+        stats.rating_sum = self.rating_sum
+        stats.cities = {key: list(entry) for key, entry in self.cities.items()}
+        for record in records:
+            stats.remove(record)
+        return stats
+
+    def average_rating(self):
+        return self.rating_sum / self.count if self.count else 0
+
+    def city_names(self):
+        return [entry[0] for entry in self.cities.values()]
+
+    def city_stats(self, top=None):
+        """Разбивка по городам, по убыванию числа меток (top - первые N)"""
+        entries = self.cities.values()
+        if top is not None:
+            entries = heapq.nlargest(top, entries, key=lambda e: e[1])
+        else:
+            entries = sorted(entries, key=lambda e: e[1], reverse=True)
+        return [{
+            'city': name,
+            'count': count,
+            'average_rating': rating_sum / count,
+        } for name, count, rating_sum in entries]
+
+
+class PublishedRoutes:
+    """id опубликованных маршрутов (черновики не считаются)"""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.ids = set()
+
+    def add(self, record):
+        if record.get('published', True):
+            self.ids.add(record['id'])
+
+    def remove(self, record):
+        self.ids.discard(record['id'])
+
+    def count(self, expired_ids=()):
+        """Число опубликованных маршрутов без просроченных, ещё не удалённых"""
+        return len(self.ids) - sum(1 for route_id in expired_ids if route_id in self.ids)
+
+
+class CommentSummary:
+    """Сводка по комментариям каждой метки: количество, средний рейтинг, последние
+
+    Рейтинг 0 означает комментарий без оценки и в среднее не входит.
+    key(comment) задаёт порядок "последних" - (время, id).
+    """
+
+    def __init__(self, key, previews=COMMENT_PREVIEWS):
+        self.key = key
+        self.previews = previews
+        self.clear()
+
+    def clear(self):
+        # id метки -> [количество, оценок, сумма оценок, ключи по порядку, ключ -> комментарий]
+        self.markers = {}
+
+    def add(self, comment):
+        entry = self.markers.get(comment.get('marker_id'))
+        if entry is None:
+            entry = self.markers[comment.get('marker_id')] = [0, 0, 0, [], {}]
+        key = self.key(comment)
+        entry[0] += 1
+        rating = comment.get('rating') or 0
+        if rating:
+            entry[1] += 1
+            entry[2] += rating
+        bisect.insort(entry[3], key)
+        entry[4][key] = comment
+
+    def remove(self, comment):
+        entry = self.markers.get(comment.get('marker_id'))
+        if entry is None:
+            return
+        key = self.key(comment)
+        if entry[4].pop(key, None) is None:
+            return
+        entry[3].pop(bisect.bisect_left(entry[3], key))
+        entry[0] -= 1
+        rating = comment.get('rating') or 0
+        if rating:
+            entry[1] -= 1
+            entry[2] -= rating
+        if entry[0] <= 0:
+            del self.markers[comment.get('marker_id')]
+
+    def summary(self, marker_id):
+        entry = self.markers.get(marker_id)
+        if entry is None:
+            return {'count': 0, 'average_rating': None, 'latest': []}
+        count, rated, rating_sum, keys, comments = entry
+        latest = [comments[key] for key in reversed(keys[-self.previews:])] if self.previews else []
+        return {
+            'count': count,
+            'average_rating': rating_sum / rated if rated else None,
+            'latest': [{
+                'id': c['id'],
+                'comment': (c.get('comment') or '')[:COMMENT_PREVIEW_LENGTH],
+                'rating': c.get('rating', 0),
+                'timestamp': c.get('timestamp'),
+                'user_id': c.get('user_id'),
+            } for c in latest],
+        }
@@ -0,0 +1,809 @@
+"""
+Хранилище данных: снимок JSON + журнал операций (write-ahead log)
+
+Каждая коллекция хранится в двух файлах:
+  <name>       - снимок: {'revision': N, 'records': [...]}
+                 (прежний формат - просто JSON список записей - тоже читается)
+  <name>.log   - журнал: по одной JSON-строке на операцию
+(у бэкенда flock журналы нумеруются поколениями, см. SharedLog)
+
+Запись добавляет одну строку в журнал, поэтому её стоимость не зависит
+от размера коллекции. fsync выполняется пачками фоновым потоком,
+компактор периодически сворачивает журнал в новый снимок.
+
+Бэкенд выбирается переменной окружения STORAGE_BACKEND:
+  log     - журнал в одном процессе (по умолчанию, python main.py)
+  flock   - тот же журнал, общий для нескольких процессов через flock
+  sqlite  - SQLite в режиме WAL
+
+Операции других процессов (flock, sqlite) доставляются подписчикам
+через subscribe(): запись журнала {'op': 'put'|'patch'|'del'|'reset', ...}.
+Операция patch дописывает элементы в списки записи (extend) и меняет
+отдельные поля (set), поэтому в журнал попадает только изменение.
+
+Каждая операция получает ревизию коллекции 'rev' (у записи - поле
+revision). Ревизия назначается под блокировкой записи, поэтому растёт
+в порядке журнала даже при нескольких процессах. Новый журнал после
+компактификации начинается строкой {'op': 'rev', 'rev': N}: ревизия
+удалений, свёрнутых в снимок, не теряется.
+
+Снимок хранит ревизию, до которой в него свёрнут журнал. При загрузке
+операции журнала с ревизией не больше неё пропускаются: если процесс упал
+между записью снимка и удалением старого журнала, patch с extend не
+применится к снимку второй раз.
+"""
+
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Как часто сбрасывать журнал на диск (секунды)
+FSYNC_INTERVAL = float(os.environ.get('STORAGE_FSYNC_INTERVAL', 0.05))
+# Сколько записей в журнале допускается до компактификации
+COMPACT_THRESHOLD = int(os.environ.get('STORAGE_COMPACT_THRESHOLD', 10000))
+# Как часто компактор проверяет размер журнала (секунды)
+COMPACT_INTERVAL = float(os.environ.get('STORAGE_COMPACT_INTERVAL', 30))
+# Файл базы данных для бэкенда sqlite
+SQLITE_PATH = os.environ.get('STORAGE_SQLITE_PATH', 'data.db')
+# Сколько секунд хранить ленту изменений sqlite для других процессов
+SQLITE_CHANGES_TTL = float(os.environ.get('STORAGE_SQLITE_CHANGES_TTL', 600))
+
+
+def _dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def _read_snapshot(filename):
+    """Возвращает (записи, ревизия снимка); у снимка старого формата ревизия 0"""
+    if not os.path.exists(filename):
+        return [], 0
+    with open(filename, 'r', encoding='utf-8') as f:
+        content = f.read()
+    if not content.strip():
+        return [], 0
+    data = json.loads(content)
+    if isinstance(data, list):
+        return data, 0
+    return data['records'], data['revision']
+
+
+def _write_snapshot(filename, records, revision):
+    """Атомарно записывает снимок коллекции вместе с его ревизией"""
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w', encoding='utf-8') as f:
+        json.dump({'revision': revision, 'records': records}, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+
+def next_revision(last):
+    """Следующая ревизия: время в микросекундах, но строго больше предыдущей"""
+    return max(last + 1, time.time_ns() // 1000)
+
+
+def stamp(entry, last):
+    """Назначает операции ревизию; возвращает её"""
+    rev = entry['rev'] = next_revision(last)
+    if entry['op'] == 'put':
+        entry['data']['revision'] = rev
+    return rev
+
+
+def records_revision(records):
+    return max((r.get('revision', 0) for r in records), default=0)
+
+
+def patch_record(record, extend=None, values=None, rev=None):
+    """Новая запись: record с дописанными списками extend и полями values
+
+    Исходная запись не меняется: её могут разделять хранилище и таблица.
+    """
+    patched = dict(record)
+    patched.update(values or {})
+    for field, items in (extend or {}).items():
+        patched[field] = list(record.get(field) or []) + items
+    if rev is not None:
+        patched['revision'] = rev
+    return patched
+
+
+def in_snapshot(entry, snapshot_revision):
+    """Операция журнала уже свёрнута в снимок с ревизией snapshot_revision"""
+    return entry.get('rev') is not None and entry['rev'] <= snapshot_revision
+
+
+def revision_entry(rev):
+    """Строка журнала, которая только сохраняет ревизию коллекции"""
+    return _dumps({'op': 'rev', 'rev': rev}) + '\n'
+
+
+def apply_entry(records, entry):
+    """Применяет запись журнала к словарю id -> запись (строка 'rev' ничего не меняет)"""
+    if entry['op'] == 'put':
+        records[entry['id']] = entry['data']
+    elif entry['op'] == 'patch':
+        record = records.get(entry['id'])
+        if record is not None:
+            records[entry['id']] = patch_record(record, entry.get('extend'), entry.get('set'),
+                                                entry.get('rev'))
+    elif entry['op'] == 'del':
+        records.pop(entry['id'], None)
+    elif entry['op'] == 'reset':
+        records.clear()
+        for record in entry['records']:
+            records[record['id']] = record
+
+
+class Collection:
+    """Одна коллекция: записи в памяти, снимок на диске и открытый журнал"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.log_filename = filename + '.log'
+        self.old_log_filename = filename + '.log.old'
+        self.records = {}
+        self.revision = 0
+        self.log_size = 0
+        self.dirty = False
+        self._load()
+        self.log = open(self.log_filename, 'a', encoding='utf-8')
+
+    def _load(self):
+        """Восстанавливает состояние: снимок + незавершённый журнал + текущий журнал"""
+        records, snapshot_revision = _read_snapshot(self.filename)
+        for record in records:
+            self.records[record['id']] = record
+        self.revision = max(snapshot_revision, records_revision(records))
+
+        for path in (self.old_log_filename, self.log_filename):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Оборванная последняя строка после падения процесса
+                        break
+                    if path == self.log_filename:
+                        self.log_size += 1
+                    if in_snapshot(entry, snapshot_revision):
+                        # Журнал, не удалённый после записи снимка
+                        continue
+                    apply_entry(self.records, entry)
+                    self.revision = max(self.revision, entry.get('rev', 0))
+
+    def append(self, entry):
+        """Применяет операцию в памяти и дописывает её в журнал"""
+        self.revision = stamp(entry, self.revision)
+        apply_entry(self.records, entry)
+        self.log.write(_dumps(entry) + '\n')
+        self.log.flush()
+        self.log_size += 1
+        self.dirty = True
+
+    def sync(self):
+        if self.dirty:
+            os.fsync(self.log.fileno())
+            self.dirty = False
+
+    def rotate(self):
+        """Переключает журнал на новый файл; возвращает (копия записей, ревизия) для снимка"""
+        self.sync()
+        self.log.close()
+        if os.path.exists(self.old_log_filename):
+            # Предыдущий снимок не был записан: дописываем журнал к несвёрнутому
+            with open(self.log_filename, 'r', encoding='utf-8') as src, \
+                    open(self.old_log_filename, 'a', encoding='utf-8') as dst:
+                dst.write(src.read())
+            os.remove(self.log_filename)
+        else:
+            os.replace(self.log_filename, self.old_log_filename)
+        self.log = open(self.log_filename, 'a', encoding='utf-8')
+        self.log.write(revision_entry(self.revision))
+        self.log.flush()
+        self.log_size = 0
+        return list(self.records.values()), self.revision
+
+    def write_snapshot(self, records, revision):
+        """Атомарно записывает снимок и удаляет свёрнутый журнал"""
+        _write_snapshot(self.filename, records, revision)
+        if os.path.exists(self.old_log_filename):
+            os.remove(self.old_log_filename)
+
+
+class BaseStorage:
+    """Общая часть бэкендов: подписчики и фоновые потоки fsync/компактификации"""
+
+    def __init__(self, fsync_interval=FSYNC_INTERVAL, compact_interval=COMPACT_INTERVAL):
+        self.fsync_interval = fsync_interval
+        self.compact_interval = compact_interval
+        self.lock = threading.RLock()
+        self.subscribers = {}
+        self._threads_started = False
+
+    def subscribe(self, filename, callback):
+        """Регистрирует обработчик операций, пришедших от других процессов"""
+        self.subscribers.setdefault(filename, []).append(callback)
+
+    def _notify(self, filename, entry):
+        for callback in self.subscribers.get(filename, []):
+            callback(entry)
+
+    def _start_threads(self):
+        if self._threads_started:
+            return
+        self._threads_started = True
+        threading.Thread(target=self._fsync_loop, daemon=True).start()
+        threading.Thread(target=self._compact_loop, daemon=True).start()
+
+    def _fsync_loop(self):
+        while True:
+            time.sleep(self.fsync_interval)
+            self.sync()
+
+    def _compact_loop(self):
+        while True:
+            time.sleep(self.compact_interval)
+            self.maintain()
+
+    def poll(self, filename):
+        """Подтягивает операции других процессов; в одном процессе ничего не делает"""
+
+    def revision(self, filename):
+        """Последняя ревизия коллекции, включая удаления"""
+        return 0
+
+    def sync(self):
+        pass
+
+    def maintain(self):
+        pass
+
+    def put(self, filename, record):
+        """Добавляет или заменяет запись (по полю id)"""
+        self.write_batch([(filename, {'op': 'put', 'id': record['id'], 'data': record})])
+        return record
+
+    def patch(self, filename, record_id, extend=None, values=None):
+        """Дописывает списки и меняет поля записи; возвращает ревизию или None"""
+        return self.write_batch([(filename, {
+            'op': 'patch', 'id': record_id, 'extend': extend or {}, 'set': values or {}})])[0]
+
+    def delete(self, filename, record_id):
+        """Удаляет запись; возвращает ревизию удаления или None, если записи не было"""
+        return self.write_batch([(filename, {'op': 'del', 'id': record_id})])[0]
+
+
+class LogStorage(BaseStorage):
+    """Набор коллекций одного процесса с общими потоками fsync и компактификации"""
+
+    def __init__(self, fsync_interval=FSYNC_INTERVAL, compact_threshold=COMPACT_THRESHOLD,
+                 compact_interval=COMPACT_INTERVAL):
+        super().__init__(fsync_interval, compact_interval)
+        self.compact_threshold = compact_threshold
+        self.collections = {}
+
+    def _collection(self, filename):
+        collection = self.collections.get(filename)
+        if collection is None:
+            with self.lock:
+                collection = self.collections.get(filename)
+                if collection is None:
+                    collection = Collection(filename)
+                    self.collections[filename] = collection
+                    self._start_threads()
+        return collection
+
+    def maintain(self):
+        for filename in list(self.collections):
+            if self.collections[filename].log_size >= self.compact_threshold:
+                self.compact(filename)
+
+    def load(self, filename):
+        """Возвращает текущие записи коллекции в порядке добавления"""
+        collection = self._collection(filename)
+        with self.lock:
+            return list(collection.records.values())
+
+    def revision(self, filename):
+        return self._collection(filename).revision
+
+    def write_batch(self, operations):
+        """Пишет операции [(коллекция, запись журнала), ...]; возвращает их ревизии
+
+        Для del и patch несуществующей записи вместо ревизии - None.
+        """
+        revisions = []
+        with self.lock:
+            for filename, entry in operations:
+                collection = self._collection(filename)
+                if entry['op'] != 'put' and entry['id'] not in collection.records:
+                    revisions.append(None)
+                    continue
+                collection.append(entry)
+                revisions.append(entry['rev'])
+        return revisions
+
+    def sync(self):
+        with self.lock:
+            for collection in self.collections.values():
+                collection.sync()
+
+    def compact(self, filename):
+        """Сворачивает журнал коллекции в новый снимок"""
+        collection = self._collection(filename)
+        with self.lock:
+            records, revision = collection.rotate()
+        # Снимок пишется вне блокировки: новые записи уже идут в свежий журнал
+        collection.write_snapshot(records, revision)
+
+
+class SharedLog:
+    """Журнал коллекции, общий для нескольких процессов
+
+    Все изменения файлов выполняются под эксклюзивным flock на <name>.lock,
+    чтение хвоста журнала - под разделяемым. Журналы нумеруются поколениями
+    (<name>.<N>.log), номер текущего лежит в <name>.gen. Компактификация
+    записывает снимок, заводит журнал следующего поколения и удаляет
+    старый; остальные процессы дочитывают старый файл через открытый
+    дескриптор и переходят на новый.
+
+    Прочитанные чужие операции копятся в pending, пока их не заберёт
+    вызывающий код: так компактор в фоне не трогает индексы напрямую.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.gen_filename = filename + '.gen'
+        self.pending = []
+        self.lock_file = open(filename + '.lock', 'a')
+        self.records = {}
+        self.log = None
+        self.gen = 0
+        self.revision = 0
+        self.snapshot_revision = 0
+        self.offset = 0
+        self.log_size = 0
+        self.dirty = False
+        with self._flock(fcntl.LOCK_SH):
+            self.gen = self._current_gen()
+            self._read_snapshot()
+            self._open_log()
+            self._read_tail(collect=False)
+
+    def _flock(self, mode):
+        lock_file = self.lock_file
+
+        class _Guard:
+            def __enter__(self):
+                fcntl.flock(lock_file, mode)
+
+            def __exit__(self, *exc):
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        return _Guard()
+
+    def _read_snapshot(self):
+        records, self.snapshot_revision = _read_snapshot(self.filename)
+        self.records = {r['id']: r for r in records}
+        self.revision = max(self.revision, self.snapshot_revision, records_revision(records))
+
+    def _log_filename(self, gen):
+        return f'{self.filename}.{gen}.log'
+
+    def _current_gen(self):
+        try:
+            with open(self.gen_filename, 'r') as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _open_log(self):
+        if self.log is not None:
+            self.log.close()
+        self.log = open(self._log_filename(self.gen), 'a+b')
+        self.offset = 0
+        self.log_size = 0
+
+    def _read_tail(self, collect=True):
+        """Читает полные строки журнала после self.offset"""
+        self.log.seek(self.offset)
+        for line in self.log:
+            if not line.endswith(b'\n'):
+                # Строка, оборванная упавшим процессом
+                break
+            self.offset += len(line)
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            self.log_size += 1
+            if in_snapshot(entry, self.snapshot_revision):
+                # Журнал, который компактор не успел сменить после записи снимка
+                continue
+            apply_entry(self.records, entry)
+            self.revision = max(self.revision, entry.get('rev', 0))
+            if collect and entry['op'] != 'rev':
+                self.pending.append(entry)
+
+    def _catch_up(self):
+        """Дочитывает журнал, в том числе после компактификации другим процессом"""
+        while True:
+            self._read_tail()
+            gen = self._current_gen()
+            if gen == self.gen:
+                return
+            if gen > self.gen + 1:
+                # Пропущено несколько поколений: их журналы уже удалены,
+                # перечитываем снимок, он соответствует началу журнала gen
+                self._read_snapshot()
+                self.pending = [{'op': 'reset', 'records': list(self.records.values())}]
+            # Журнал предыдущего поколения уже удалён, но дочитан через открытый дескриптор
+            self.gen = gen
+            self._open_log()
+
+    def _is_stale(self):
+        return (os.fstat(self.log.fileno()).st_size != self.offset
+                or self._current_gen() != self.gen)
+
+    def poll(self):
+        if not self._is_stale():
+            return
+        with self._flock(fcntl.LOCK_SH):
+            self._catch_up()
+
+    def append(self, entries):
+        """Дописывает операции одним блоком под эксклюзивной блокировкой
+
+        Возвращает ревизии операций; для del и patch несуществующей записи
+        операция пропускается и вместо ревизии возвращается None.
+        """
+        with self._flock(fcntl.LOCK_EX):
+            self._catch_up()
+            if os.fstat(self.log.fileno()).st_size != self.offset:
+                # Хвост без перевода строки от упавшего процесса отбрасываем
+                self.log.truncate(self.offset)
+            self.log.seek(0, os.SEEK_END)
+            revisions = []
+            lines = []
+            for entry in entries:
+                if entry['op'] != 'put' and entry['id'] not in self.records:
+                    revisions.append(None)
+                    continue
+                self.revision = stamp(entry, self.revision)
+                apply_entry(self.records, entry)
+                revisions.append(entry['rev'])
+                lines.append(_dumps(entry) + '\n')
+            if lines:
+                data = ''.join(lines).encode('utf-8')
+                self.log.write(data)
+                self.log.flush()
+                self.offset += len(data)
+                self.log_size += len(lines)
+                self.dirty = True
+            return revisions
+
+    def sync(self):
+        if self.dirty:
+            os.fsync(self.log.fileno())
+            self.dirty = False
+
+    def compact(self):
+        """Сворачивает журнал в снимок; выполняется под эксклюзивной блокировкой
+
+        Порядок шагов такой, что после падения на любом из них состояние
+        восстанавливается: снимок хранит свою ревизию, и операции журнала,
+        уже свёрнутые в него, при чтении пропускаются.
+        """
+        with self._flock(fcntl.LOCK_EX):
+            self._catch_up()
+            self.sync()
+            _write_snapshot(self.filename, list(self.records.values()), self.revision)
+            old_log_filename = self._log_filename(self.gen)
+            open(self._log_filename(self.gen + 1), 'ab').close()
+            tmp_filename = self.gen_filename + '.tmp'
+            with open(tmp_filename, 'w') as f:
+                f.write(str(self.gen + 1))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_filename, self.gen_filename)
+            os.remove(old_log_filename)
+            self.gen += 1
+            self._open_log()
+            line = revision_entry(self.revision).encode('utf-8')
+            self.log.write(line)
+            self.log.flush()
+            self.offset += len(line)
+
+
+class FileLockStorage(BaseStorage):
+    """Журнальное хранилище для нескольких процессов (gunicorn workers)"""
+
+    def __init__(self, fsync_interval=FSYNC_INTERVAL, compact_threshold=COMPACT_THRESHOLD,
+                 compact_interval=COMPACT_INTERVAL):
+        super().__init__(fsync_interval, compact_interval)
+        self.compact_threshold = compact_threshold
+        self.logs = {}
+
+    def _log(self, filename):
+        log = self.logs.get(filename)
+        if log is None:
+            with self.lock:
+                log = self.logs.get(filename)
+                if log is None:
+                    log = SharedLog(filename)
+                    self.logs[filename] = log
+                    self._start_threads()
+        return log
+
+    def _deliver(self, filename, log):
+        pending, log.pending = log.pending, []
+        for entry in pending:
+            self._notify(filename, entry)
+
+    def load(self, filename):
+        log = self._log(filename)
+        with self.lock:
+            # Всё, что уже прочитано, войдёт в загрузку
+            log.pending = []
+            return list(log.records.values())
+
+    def revision(self, filename):
+        return self._log(filename).revision
+
+    def write_batch(self, operations):
+        """Пишет операции [(коллекция, запись журнала), ...]; возвращает их ревизии
+
+        Операции одной коллекции дописываются одним блоком под одной блокировкой.
+        """
+        revisions = {}
+        by_filename = {}
+        for index, (filename, entry) in enumerate(operations):
+            by_filename.setdefault(filename, []).append((index, entry))
+        with self.lock:
+            for filename, items in by_filename.items():
+                log = self._log(filename)
+                for (index, _), rev in zip(items, log.append([entry for _, entry in items])):
+                    revisions[index] = rev
+                self._deliver(filename, log)
+        return [revisions[index] for index in range(len(operations))]
+
+    def poll(self, filename):
+        log = self._log(filename)
+        with self.lock:
+            log.poll()
+            self._deliver(filename, log)
+
+    def sync(self):
+        with self.lock:
+            for log in self.logs.values():
+                log.sync()
+
+    def maintain(self):
+        for filename in list(self.logs):
+            if self.logs[filename].log_size >= self.compact_threshold:
+                self.compact(filename)
+
+    def compact(self, filename):
+        log = self._log(filename)
+        with self.lock:
+            log.compact()
+
+
+class SQLiteStorage(BaseStorage):
+    """SQLite в режиме WAL: записи и лента изменений для других процессов
+
+    Каждая запись хранится JSON-строкой, часто используемые поля вынесены
+    в индексируемые столбцы. Таблица changes нумерует операции, по ней
+    процессы догоняют друг друга; старые строки удаляются по SQLITE_CHANGES_TTL.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS records (
+            collection TEXT NOT NULL,
+            id TEXT NOT NULL,
+            data TEXT NOT NULL,
+            marker_id TEXT,
+            city TEXT,
+            timestamp TEXT,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (collection, id)
+        );
+        CREATE INDEX IF NOT EXISTS records_marker_id ON records (collection, marker_id);
+        CREATE INDEX IF NOT EXISTS records_city ON records (collection, city);
+        CREATE INDEX IF NOT EXISTS records_timestamp ON records (collection, timestamp);
+        CREATE INDEX IF NOT EXISTS records_position ON records (collection, position);
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            collection TEXT NOT NULL,
+            op TEXT NOT NULL,
+            id TEXT NOT NULL,
+            data TEXT,
+            rev INTEGER NOT NULL,
+            created REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS changes_collection ON changes (collection, seq);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """
+
+    UPSERT_SQL = """
+        INSERT INTO records (collection, id, data, marker_id, city, timestamp, position)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (collection, id) DO UPDATE SET
+            data = excluded.data, marker_id = excluded.marker_id,
+            city = excluded.city, timestamp = excluded.timestamp
+    """
+    DELETE_SQL = 'DELETE FROM records WHERE collection = ? AND id = ?'
+    SELECT_SQL = 'SELECT data FROM records WHERE collection = ? AND id = ?'
+    PATCH_SQL = 'UPDATE records SET data = ?, timestamp = ? WHERE collection = ? AND id = ?'
+    CHANGE_SQL = 'INSERT INTO changes (collection, op, id, data, rev, created) VALUES (?, ?, ?, ?, ?, ?)'
+    CHANGES_SINCE_SQL = 'SELECT seq, collection, op, id, data, rev FROM changes WHERE seq > ? ORDER BY seq'
+    LAST_REV_SQL = 'SELECT MAX(rev) FROM changes WHERE collection = ?'
+    LAST_SEQ_SQL = "SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'changes'), 0)"
+    MIN_SEQ_SQL = 'SELECT MIN(seq) FROM changes'
+    PURGED_SEQ_SQL = "SELECT COALESCE((SELECT value FROM meta WHERE key = 'purged_seq'), 0)"
+    # Строки старше срока, кроме последней операции каждой коллекции
+    PURGEABLE_SQL = ('FROM changes WHERE created < ? AND seq NOT IN '
+                     '(SELECT MAX(seq) FROM changes GROUP BY collection)')
+
+    def __init__(self, path=SQLITE_PATH, compact_interval=COMPACT_INTERVAL,
+                 changes_ttl=SQLITE_CHANGES_TTL):
+        super().__init__(compact_interval=compact_interval)
+        self.changes_ttl = changes_ttl
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(self.SCHEMA)
+        # Последняя увиденная операция из ленты changes
+        self.last_seq = self.db.execute(self.LAST_SEQ_SQL).fetchone()[0]
+        # Последняя ревизия по каждой коллекции
+        self.revisions = {}
+        self._start_threads()
+
+    def _load_records(self, filename):
+        rows = self.db.execute(
+            'SELECT data FROM records WHERE collection = ? ORDER BY position', (filename,))
+        return [json.loads(data) for (data,) in rows]
+
+    def load(self, filename):
+        with self.lock:
+            # Сначала догоняем остальные коллекции, чтобы загрузка совпала с last_seq
+            self.db.execute('BEGIN')
+            try:
+                self._catch_up()
+                records = self._load_records(filename)
+                last_rev = self.db.execute(self.LAST_REV_SQL, (filename,)).fetchone()[0] or 0
+                self.revisions[filename] = max(last_rev, records_revision(records))
+                return records
+            finally:
+                self.db.execute('COMMIT')
+
+    def _catch_up(self):
+        """Доставляет подписчикам операции других процессов (внутри транзакции)"""
+        min_seq = self.db.execute(self.MIN_SEQ_SQL).fetchone()[0]
+        last_seq = self.db.execute(self.LAST_SEQ_SQL).fetchone()[0]
+        # Сохранённые строки других коллекций не закрывают дыру после очистки:
+        # отстаём, если очищено хоть что-то после нашей позиции
+        purged_seq = self.db.execute(self.PURGED_SEQ_SQL).fetchone()[0]
+        if self.last_seq < purged_seq or (
+                last_seq > self.last_seq and (min_seq is None or min_seq > self.last_seq + 1)):
+            # Лента уже очищена дальше нашей позиции (или целиком) - перечитываем коллекции
+            self.last_seq = last_seq
+            for filename in set(self.subscribers) | set(self.revisions):
+                records = self._load_records(filename)
+                last_rev = self.db.execute(self.LAST_REV_SQL, (filename,)).fetchone()[0] or 0
+                self.revisions[filename] = max(self.revisions.get(filename, 0), last_rev,
+                                               records_revision(records))
+                self._notify(filename, {'op': 'reset', 'records': records})
+            return
+        for seq, filename, op, record_id, data, rev in self.db.execute(self.CHANGES_SINCE_SQL, (self.last_seq,)).fetchall():
+            entry = {'op': op, 'id': record_id, 'rev': rev}
+            if op == 'patch':
+                entry.update(json.loads(data))
+            elif data is not None:
+                entry['data'] = json.loads(data)
+            self.last_seq = seq
+            self.revisions[filename] = max(self.revisions.get(filename, 0), rev)
+            self._notify(filename, entry)
+
+    def _apply(self, filename, entry):
+        """Выполняет операцию внутри транзакции; возвращает ревизию или None
+
+        Для patch строка записи переписывается целиком (запись хранится одним
+        JSON), а в ленту changes попадает только само изменение.
+        """
+        op, record_id = entry['op'], entry['id']
+        if op == 'patch':
+            row = self.db.execute(self.SELECT_SQL, (filename, record_id)).fetchone()
+            if row is None:
+                return None
+        elif op == 'del':
+            if self.db.execute(self.DELETE_SQL, (filename, record_id)).rowcount == 0:
+                return None
+        rev = self.revisions[filename] = stamp(entry, self.revisions.get(filename, 0))
+        data = None
+        if op == 'put':
+            record = entry['data']
+            data = _dumps(record)
+            self.db.execute(self.UPSERT_SQL, (
+                filename, record_id, data, record.get('marker_id'),
+                (record.get('city') or '').lower() or None,
+                record.get('timestamp') or record.get('created_at'),
+                time.time_ns(),
+            ))
+        elif op == 'patch':
+            patched = patch_record(json.loads(row[0]), entry['extend'], entry['set'], rev)
+            self.db.execute(self.PATCH_SQL, (
+                _dumps(patched), patched.get('timestamp') or patched.get('created_at'),
+                filename, record_id,
+            ))
+            data = _dumps({'extend': entry['extend'], 'set': entry['set']})
+        cursor = self.db.execute(self.CHANGE_SQL, (filename, op, record_id, data, rev, time.time()))
+        self.last_seq = cursor.lastrowid
+        return rev
+
+    def write_batch(self, operations):
+        """Пишет операции [(коллекция, запись журнала), ...] одной транзакцией
+
+        Возвращает ревизии операций; для del и patch несуществующей записи - None.
+        """
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                self._catch_up()
+                revisions = [self._apply(filename, entry) for filename, entry in operations]
+                self.db.execute('COMMIT')
+                return revisions
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def revision(self, filename):
+        return self.revisions.get(filename, 0)
+
+    def poll(self, filename):
+        with self.lock:
+            self.db.execute('BEGIN')
+            try:
+                self._catch_up()
+            finally:
+                self.db.execute('COMMIT')
+
+    def maintain(self):
+        # Последняя операция каждой коллекции остаётся: по ней восстанавливается ревизия.
+        # Наибольший удалённый seq запоминается в meta: отставший процесс сверяет
+        # с ним свою позицию и перечитывает коллекции целиком
+        cutoff = time.time() - self.changes_ttl
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                purged = self.db.execute('SELECT MAX(seq) ' + self.PURGEABLE_SQL, (cutoff,)).fetchone()[0]
+                if purged is not None:
+                    self.db.execute('DELETE ' + self.PURGEABLE_SQL, (cutoff,))
+                    self.db.execute("INSERT INTO meta (key, value) VALUES ('purged_seq', ?) "
+                                    "ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)",
+                                    (purged,))
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+
+
+def create_storage(backend=None):
+    """Создаёт хранилище, выбранное в STORAGE_BACKEND"""
+    backend = backend or os.environ.get('STORAGE_BACKEND', 'log')
+    if backend == 'log':
+        return LogStorage()
+    if backend == 'flock':
+        return FileLockStorage()
+    if backend == 'sqlite':
+        return SQLiteStorage()
+    raise ValueError(f'Неизвестный STORAGE_BACKEND: {backend}')
@@ -0,0 +1,605 @@
+"""
+Резидентное хранилище меток, комментариев и маршрутов с индексами
+
+Данные загружаются из storage один раз при старте, дальше все чтения
+обслуживаются из памяти: первичный ключ - словарь по id, вторичные
+индексы - словари ключ -> {id: запись}. Запись идёт в память и в журнал.
+
+Если хранилище разделяют несколько процессов (gunicorn workers), перед
+каждым обращением таблица подтягивает чужие операции через storage.poll().
+
+Метки и маршруты живут ограниченное время: просроченные записи не
+отдаются при чтении, а фоновый поток удаляет их вместе с комментариями.
+
+Каждая запись несёт ревизию (revision), назначенную хранилищем; таблица
+держит записи в порядке ревизий и журнал удалений (tombstones), чтобы
+отдавать клиенту только изменения после его курсора.
+"""
+
+import bisect
+import heapq
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+import geo
+from stats import CommentSummary, MarkerStats, PublishedRoutes
+from storage import patch_record
+
+# Время жизни метки и маршрута (секунды)
+MARKER_TTL = int(os.environ.get('MARKER_TTL', 24 * 60 * 60))
+ROUTE_TTL = int(os.environ.get('ROUTE_TTL', 90 * 60))
+# Как часто удалять просроченные записи (секунды)
+EXPIRY_SWEEP_INTERVAL = float(os.environ.get('EXPIRY_SWEEP_INTERVAL', 30))
+# Сколько помнить удаления для ленты изменений (секунды и штуки)
+TOMBSTONE_TTL = int(os.environ.get('TOMBSTONE_TTL', 48 * 60 * 60))
+TOMBSTONE_LIMIT = int(os.environ.get('TOMBSTONE_LIMIT', 100000))
+
+
+def parse_timestamp(value):
+    """ISO-время записи в секундах epoch; наивное время считается локальным"""
+    if not isinstance(value, str):
+        return None
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+class ExpiryIndex:
+    """Упорядоченный по времени истечения индекс записей (куча)
+
+    Удалённые и изменённые записи остаются в куче до извлечения и
+    пропускаются по несовпадению с expires; куча перестраивается, когда
+    устаревших элементов становится больше живых.
+    """
+
+    def __init__(self, field, ttl):
+        self.field = field
+        self.ttl = ttl
+        self.heap = []
+        self.expires = {}
+
+    def expires_at(self, record):
+        created = parse_timestamp(record.get(self.field))
+        # Запись с нечитаемым временем считается просроченной, как и в index.html
+        return created + self.ttl if created is not None else 0
+
+    def clear(self):
+        self.heap = []
+        self.expires = {}
+
+    def add(self, record):
+        expires = self.expires_at(record)
+        self.expires[record['id']] = expires
+        heapq.heappush(self.heap, (expires, record['id']))
+
+    def remove(self, record):
+        self.expires.pop(record['id'], None)
+        if len(self.heap) > 2 * len(self.expires) + 64:
+            self.heap = [(e, i) for i, e in self.expires.items()]
+            heapq.heapify(self.heap)
+
+    def is_live(self, record, now):
+        return self.expires.get(record['id'], 0) > now
+
+    def pending(self, now):
+        """id просроченных к моменту now записей, не извлекая их из кучи
+
+        Обходит только вершины кучи со сроком не позже now: у остальных
+        потомки истекают ещё позже.
+        """
+        result = []
+        stack = [0]
+        while stack:
+            index = stack.pop()
+            if index >= len(self.heap) or self.heap[index][0] > now:
+                continue
+            expires, record_id = self.heap[index]
+            if self.expires.get(record_id) == expires:
+                result.append(record_id)
+            stack += [2 * index + 1, 2 * index + 2]
+        return result
+
+    def expired(self, now):
+        """id записей, срок которых истёк к моменту now"""
+        result = []
+        while self.heap and self.heap[0][0] <= now:
+            expires, record_id = heapq.heappop(self.heap)
+            if self.expires.get(record_id) == expires:
+                result.append(record_id)
+        return result
+
+
+class OrderedIndex:
+    """Записи, упорядоченные по (время из поля field, id), для постраничной выдачи
+
+    Ключ записи - пара (секунды, id); она же служит курсором страницы.
+    Запись с нечитаемым временем идёт первой, с временем 0.
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self.clear()
+
+    def key(self, record):
+        return (parse_timestamp(record.get(self.field)) or 0.0, record['id'])
+
+    def clear(self):
+        self.keys = []
+        self.records = {}
+
+    def add(self, record):
+        key = self.key(record)
+        bisect.insort(self.keys, key)
+        self.records[key] = record
+
+    def remove(self, record):
+        key = self.key(record)
+        index = bisect.bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            del self.keys[index]
+        self.records.pop(key, None)
+
+    def scan(self, after=None, descending=False):
+        """Записи по порядку, начиная после ключа after"""
+        if descending:
+            index = len(self.keys) if after is None else bisect.bisect_left(self.keys, after)
+            for position in range(index - 1, -1, -1):
+                yield self.records[self.keys[position]]
+        else:
+            index = 0 if after is None else bisect.bisect_right(self.keys, after)
+            for position in range(index, len(self.keys)):
+                yield self.records[self.keys[position]]
+
+
+class Table:
+    """Коллекция записей с первичным ключом id и вторичными индексами"""
+
+    def __init__(self, storage, filename, lock, indexes=None, expiry=None, order=None):
+        self.storage = storage
+        self.filename = filename
+        self.lock = lock
+        # Имя индекса -> функция, вычисляющая ключ по записи
+        self.index_keys = indexes or {}
+        self.indexes = {name: {} for name in self.index_keys}
+        self.records = {}
+        # Записи в порядке возрастания ревизии и журнал удалений (ревизия, id)
+        self.by_revision = OrderedDict()
+        self.tombstones = deque()
+        self.revision = 0
+        # Удаления с ревизией не больше horizon уже забыты
+        self.horizon = 0
+        # Агрегаты, которые обновляются при каждой вставке/удалении записи
+        self.observers = []
+        # Индекс времени жизни (ExpiryIndex) для записей с ограниченным сроком
+        self.expiry = expiry
+        if expiry is not None:
+            self.observers.append(expiry)
+        # Порядок постраничной выдачи (OrderedIndex), если таблица её поддерживает
+        self.order = order
+        if order is not None:
+            self.observers.append(order)
+        # Подписчики на изменения: callback(op, record), op - put/delete/reset
+        self.listeners = []
+        self._load(storage.load(filename))
+        storage.subscribe(filename, self._apply_remote)
+
+    def _load(self, records):
+        for record in sorted(records, key=lambda r: r.get('revision', 0)):
+            self._insert(record)
+        # Удаления до загрузки (в том числе свёрнутые в снимок) неизвестны:
+        # более старые курсоры требуют полной загрузки. Ревизия берётся только
+        # из хранилища: операции других процессов с меньшей ревизией ещё придут
+        self.revision = max(self.revision, self.storage.revision(self.filename))
+        self.horizon = self.revision
+
+    def _apply_remote(self, entry):
+        """Применяет операцию, записанную другим процессом"""
+        if entry['op'] == 'reset':
+            self.records = {}
+            self.indexes = {name: {} for name in self.index_keys}
+            self.by_revision = OrderedDict()
+            self.tombstones = deque()
+            for observer in self.observers:
+                observer.clear()
+            self._load(entry['records'])
+            self._notify('reset', {})
+            return
+        old = self.records.get(entry['id'])
+        if entry['op'] == 'patch':
+            if old is not None:
+                record = patch_record(old, entry.get('extend'), entry.get('set'), entry.get('rev'))
+                self._remove(old)
+                self._insert(record)
+                self._notify('put', record)
+            return
+        if old is not None:
+            self._remove(old)
+        if entry['op'] == 'put':
+            self._insert(entry['data'])
+            self._notify('put', entry['data'])
+        elif entry['op'] == 'del':
+            self._add_tombstone(entry.get('rev', 0), entry['id'])
+            self._notify('delete', dict(old or {'id': entry['id']}, revision=entry.get('rev')))
+
+    def refresh(self):
+        self.storage.poll(self.filename)
+
+    def observe(self, observer):
+        """Подключает агрегат с методами add(record), remove(record), clear()"""
+        with self.lock:
+            self.observers.append(observer)
+            for record in self.records.values():
+                observer.add(record)
+        return observer
+
+    def listen(self, callback):
+        """Подключает callback(op, record), вызываемый после каждого изменения
+
+        Вызывается под блокировкой таблицы, поэтому не должен блокироваться.
+        """
+        with self.lock:
+            self.listeners.append(callback)
+        return callback
+
+    def _notify(self, op, record):
+        for callback in self.listeners:
+            try:
+                callback(op, record)
+            except Exception as e:
+                print(f"❌ Ошибка обработчика изменений {self.filename}: {e}")
+
+    def _add_tombstone(self, rev, record_id):
+        self.tombstones.append((rev, record_id))
+        self.revision = max(self.revision, rev)
+        # Ревизия - время в микросекундах, по ней же отсчитывается возраст
+        oldest = time.time_ns() // 1000 - TOMBSTONE_TTL * 1000000
+        while self.tombstones and (len(self.tombstones) > TOMBSTONE_LIMIT
+                                   or self.tombstones[0][0] < oldest):
+            self.horizon = self.tombstones.popleft()[0]
+
+    def _insert(self, record):
+        self.records[record['id']] = record
+        self.by_revision[record['id']] = record
+        self.revision = max(self.revision, record.get('revision', 0))
+        for name, key_func in self.index_keys.items():
+            key = key_func(record)
+            self.indexes[name].setdefault(key, {})[record['id']] = record
+        for observer in self.observers:
+            observer.add(record)
+
+    def _remove(self, record):
+        self.records.pop(record['id'], None)
+        self.by_revision.pop(record['id'], None)
+        for name, key_func in self.index_keys.items():
+            key = key_func(record)
+            bucket = self.indexes[name].get(key)
+            if bucket is not None:
+                bucket.pop(record['id'], None)
+                if not bucket:
+                    del self.indexes[name][key]
+        for observer in self.observers:
+            observer.remove(record)
+
+    def live(self, records):
+        """Отбрасывает записи, срок жизни которых истёк, но которые ещё не удалены"""
+        if self.expiry is None:
+            return list(records)
+        now = time.time()
+        return [r for r in records if self.expiry.is_live(r, now)]
+
+    def __len__(self):
+        with self.lock:
+            self.refresh()
+            return len(self.records)
+
+    def get(self, record_id):
+        with self.lock:
+            self.refresh()
+            record = self.records.get(record_id)
+            if record is None or not self.live([record]):
+                return None
+            return record
+
+    def all(self):
+        with self.lock:
+            self.refresh()
+            return self.live(self.records.values())
+
+    def find(self, index, key):
+        """Записи с заданным значением вторичного индекса"""
+        with self.lock:
+            self.refresh()
+            return self.live(self.indexes[index].get(key, {}).values())
+
+    def page(self, limit, after=None, descending=False, records=None, accept=None):
+        """Страница записей в порядке self.order: (записи, ключ последней или None)
+
+        after - ключ последней записи предыдущей страницы. Без records
+        страница читается прямо из упорядоченного индекса; подмножество
+        записей (из вторичного индекса) отбирается без полной сортировки.
+        Ключ возвращается, только если за страницей есть ещё записи.
+        """
+        with self.lock:
+            self.refresh()
+            key = self.order.key
+            now = time.time()
+
+            def wanted(record):
+                if self.expiry is not None and not self.expiry.is_live(record, now):
+                    return False
+                return accept is None or accept(record)
+
+            if records is None:
+                page = []
+                for record in self.order.scan(after, descending):
+                    if wanted(record):
+                        page.append(record)
+                        if len(page) > limit:
+                            break
+            else:
+                if after is not None:
+                    records = (r for r in records if (key(r) < after if descending else key(r) > after))
+                select = heapq.nlargest if descending else heapq.nsmallest
+                page = select(limit + 1, filter(wanted, records), key=key)
+            if len(page) > limit:
+                return page[:limit], key(page[limit - 1])
+            return page, None
+
+    def cursor(self):
+        """Текущая ревизия таблицы как курсор для changes_since"""
+        with self.lock:
+            self.refresh()
+            return str(self.revision)
+
+    def changes_since(self, cursor):
+        """Изменённые и удалённые записи с ревизией больше cursor
+
+        Если удаления после cursor уже забыты, возвращает reset=True и все
+        живые записи - клиент должен перестроить своё состояние целиком.
+        """
+        with self.lock:
+            self.refresh()
+            if cursor < self.horizon:
+                return {'reset': True, 'changes': self.live(self.records.values()),
+                        'deleted': [], 'cursor': str(self.revision)}
+            changes = []
+            for record in reversed(self.by_revision.values()):
+                if record.get('revision', 0) <= cursor:
+                    break
+                changes.append(record)
+            changes.reverse()
+            deleted = []
+            for rev, record_id in reversed(self.tombstones):
+                if rev <= cursor:
+                    break
+                deleted.append(record_id)
+            deleted.reverse()
+            return {'reset': False, 'changes': self.live(changes),
+                    'deleted': deleted, 'cursor': str(self.revision)}
+
+    def expired(self):
+        """id просроченных записей, ещё не удалённых из таблицы"""
+        if self.expiry is None:
+            return []
+        with self.lock:
+            self.refresh()
+            return self.expiry.expired(time.time())
+
+    def put(self, record):
+        """Добавляет или заменяет запись"""
+        with self.lock:
+            # Сначала пишем в хранилище: оно доставит чужие операции до нашей
+            self.storage.put(self.filename, record)
+            self._put_local(record)
+        return record
+
+    def _put_local(self, record):
+        """Применяет в памяти запись, уже сохранённую в хранилище"""
+        old = self.records.get(record['id'])
+        if old is not None:
+            self._remove(old)
+        self._insert(record)
+        self._notify('put', record)
+
+    def _delete_local(self, record_id, rev):
+        """Применяет в памяти удаление, уже записанное в хранилище"""
+        old = self.records.get(record_id)
+        if old is not None:
+            self._remove(old)
+        if rev is not None:
+            self._add_tombstone(rev, record_id)
+            self._notify('delete', dict(old or {'id': record_id}, revision=rev))
+        return old
+
+    def patch(self, record_id, extend=None, values=None):
+        """Дописывает элементы в списки записи и меняет поля, не переписывая её
+
+        В хранилище уходит только изменение. Возвращает новую запись или None.
+        """
+        with self.lock:
+            self.refresh()
+            if record_id not in self.records:
+                return None
+            rev = self.storage.patch(self.filename, record_id, extend, values)
+            # Пока ждали блокировку хранилища, запись могли удалить
+            old = self.records.get(record_id)
+            if rev is None or old is None:
+                return None
+            record = patch_record(old, extend, values, rev)
+            self._put_local(record)
+        return record
+
+    def delete(self, record_id):
+        """Удаляет запись; возвращает удалённую запись или None"""
+        with self.lock:
+            self.refresh()
+            old = self.records.get(record_id)
+            if old is None:
+                return None
+            rev = self.storage.delete(self.filename, record_id)
+            return self._delete_local(record_id, rev)
+
+
+def city_key(city):
+    return (city or '').lower()
+
+
+class DataStore:
+    """Метки, комментарии и маршруты приложения"""
+
+    def __init__(self, storage, markers_file, comments_file, routes_file, sweep=True):
+        self.storage = storage
+        self.lock = threading.RLock()
+        self.markers = Table(storage, markers_file, self.lock, {
+            'city': lambda m: city_key(m.get('city')),
+            'user_id': lambda m: m.get('user_id'),
+            'cell': lambda m: geo.grid_cell(m['lat'], m['lng']),
+        }, expiry=ExpiryIndex('timestamp', MARKER_TTL), order=OrderedIndex('timestamp'))
+        self.clusters = self.markers.observe(geo.ClusterPyramid())
+        self.marker_stats = self.markers.observe(MarkerStats())
+        self.comments = Table(storage, comments_file, self.lock, {
+            'marker_id': lambda c: c.get('marker_id'),
+        }, order=OrderedIndex('timestamp'))
+        self.comment_summary = self.comments.observe(CommentSummary(self.comments.order.key))
+        self.routes = Table(storage, routes_file, self.lock, {
+            'user_id': lambda r: r.get('user_id'),
+        }, expiry=ExpiryIndex('created_at', ROUTE_TTL), order=OrderedIndex('created_at'))
+        self.published_routes = self.routes.observe(PublishedRoutes())
+        # Процесс только для чтения (stream.py) не удаляет просроченные записи сам
+        if sweep:
+            threading.Thread(target=self._sweep_loop, daemon=True).start()
+
+    def refresh(self):
+        """Подтягивает операции других процессов во все таблицы"""
+        with self.lock:
+            for table in (self.markers, self.comments, self.routes):
+                table.refresh()
+
+    def write_batch(self, operations):
+        """Записывает операции [(таблица, 'put'|'del', запись или id), ...] разом
+
+        operations может быть и функцией без аргументов, которая строит этот
+        список: она вызывается под блокировкой после refresh, поэтому её
+        проверки не устаревают к моменту записи. Если функция вернула None,
+        ничего не пишется. Все операции уходят в хранилище одним вызовом
+        (в sqlite - одной транзакцией). Возвращает для каждой записанную
+        запись, удалённую запись или None, если удалять было нечего.
+        """
+        with self.lock:
+            self.refresh()
+            if callable(operations):
+                operations = operations()
+                if operations is None:
+                    return None
+            entries = []
+            for table, op, payload in operations:
+                if op == 'put':
+                    entries.append((table.filename, {'op': 'put', 'id': payload['id'], 'data': payload}))
+                else:
+                    entries.append((table.filename, {'op': 'del', 'id': payload}))
+            revisions = self.storage.write_batch(entries)
+            results = []
+            for (table, op, payload), rev in zip(operations, revisions):
+                if op == 'put':
+                    table._put_local(payload)
+                    results.append(payload)
+                else:
+                    results.append(table._delete_local(payload, rev))
+            return results
+
+    def marker_comments(self, marker_id):
+        return self.comments.find('marker_id', marker_id)
+
+    def comment_summaries(self, marker_ids):
+        """id метки -> сводка её комментариев (stats.CommentSummary)"""
+        with self.lock:
+            self.comments.refresh()
+            return {marker_id: self.comment_summary.summary(marker_id) for marker_id in marker_ids}
+
+    def comments_for_markers(self, marker_ids):
+        """id метки -> её комментарии по времени (одним обращением для нескольких меток)"""
+        with self.lock:
+            self.comments.refresh()
+            key = self.comments.order.key
+            return {marker_id: sorted(self.comments.find('marker_id', marker_id), key=key)
+                    for marker_id in marker_ids}
+
+    def city_markers(self, city):
+        return self.markers.find('city', city_key(city))
+
+    def markers_in_bbox(self, bbox):
+        """Метки внутри прямоугольника карты (по сеточному индексу)"""
+        with self.lock:
+            self.markers.refresh()
+            return self.markers.live(geo.records_in_bbox(self.markers.indexes['cell'], bbox))
+
+    def nearby_markers(self, lat, lng, k=None, radius_m=None):
+        """[(метры, метка)] ближайших живых меток (см. geo.nearest_records)"""
+        with self.lock:
+            self.markers.refresh()
+            expiry = self.markers.expiry
+            now = time.time()
+            return geo.nearest_records(self.markers.indexes['cell'], lat, lng, k, radius_m,
+                                       accept=lambda m: expiry.is_live(m, now))
+
+    def marker_clusters(self, zoom, bbox):
+        with self.lock:
+            self.markers.refresh()
+            return self.clusters.clusters(zoom, bbox)
+
+    def stats(self, top=10):
+        """Сводная статистика из поддерживаемых агрегатов, без перебора записей"""
+        with self.lock:
+            self.markers.refresh()
+            self.routes.refresh()
+            now = time.time()
+            marker_stats = self._live_marker_stats(now)
+            # Как в GET /api/routes: без просроченных маршрутов и черновиков
+            expired_routes = self.routes.expiry.pending(now)
+            return {
+                'total_markers': marker_stats.count,
+                'total_comments': len(self.comments),
+                'total_routes': self.published_routes.count(expired_routes),
+                'cities': marker_stats.city_names(),
+                'average_rating': marker_stats.average_rating(),
+                'top_cities': marker_stats.city_stats(top),
+            }
+
+    def city_stats(self, top=None):
+        with self.lock:
+            self.markers.refresh()
+            return self._live_marker_stats(time.time()).city_stats(top)
+
+    def _live_marker_stats(self, now):
+        """Статистика меток без просроченных, но ещё не удалённых (как в GET /api/markers)"""
+        expired = [self.markers.records[marker_id] for marker_id in self.markers.expiry.pending(now)]
+        return self.marker_stats.without(expired)
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(EXPIRY_SWEEP_INTERVAL)
+            try:
+                self.purge_expired()
+            except Exception as e:
+                print(f"❌ Ошибка удаления просроченных записей: {e}")
+
+    def purge_expired(self):
+        """Удаляет просроченные метки (с комментариями) и маршруты"""
+        for marker_id in self.markers.expired():
+            self.delete_marker(marker_id)
+        for route_id in self.routes.expired():
+            self.routes.delete(route_id)
+
+    def delete_marker(self, marker_id):
+        """Удаляет метку вместе со всеми её комментариями"""
+        with self.lock:
+            marker = self.markers.delete(marker_id)
+            for comment in self.marker_comments(marker_id):
+                self.comments.delete(comment['id'])
+        return marker
@@ -0,0 +1,106 @@
+"""
+Отдельный процесс для потока событий /api/events (Server-Sent Events)
+
+Под gunicorn каждый открытый поток занимал бы синхронный воркер, поэтому
+подписчиков обслуживает этот асинхронный сервер на aiohttp: тысячи
+простаивающих соединений стоят по одной корутине. Процесс держит свою
+копию данных и подтягивает изменения воркеров из общего хранилища
+(STORAGE_BACKEND=flock или sqlite), сам ничего не записывает. С журналом
+одного процесса (log) не запускается: он открыл бы свой журнал, не видел
+бы записей main.py, а его компактор удалял бы чужой журнал.
+
+Браузеры попадают сюда через server.py (EVENTS_BACKEND_URL), бот - по
+EVENTS_URL; start.py запускает этот процесс вместе с остальными.
+"""
+
+import asyncio
+import os
+
+from aiohttp import web
+
+from events import EventHub, HEARTBEAT_INTERVAL
+from geo import route_view
+from storage import create_storage
+from store import DataStore
+
+# Те же файлы данных, что и в main.py (импорт main запустил бы Flask-приложение)
+MARKERS_FILE = 'zmarkers.json'
+COMMENTS_FILE = 'comments.json'
+ROUTES_FILE = 'routes.json'
+# Сколько ждать, пока клиент примет очередную порцию событий (секунды)
+WRITE_TIMEOUT = 30
+# Бэкенды хранилища, которые можно делить с процессами main.py
+SHARED_BACKENDS = ('flock', 'sqlite')
+# Рассылка событий приложения (app[HUB_KEY])
+HUB_KEY = web.AppKey('hub', EventHub)
+
+
+def create_app(backend=None):
+    backend = backend or os.environ.get('STORAGE_BACKEND', 'log')
+    if backend not in SHARED_BACKENDS:
+        raise SystemExit(f"❌ stream.py работает только с общим хранилищем "
+                         f"(STORAGE_BACKEND={' или '.join(SHARED_BACKENDS)}), сейчас: {backend}")
+    storage = create_storage(backend)
+    store = DataStore(storage, MARKERS_FILE, COMMENTS_FILE, ROUTES_FILE, sweep=False)
+    hub = EventHub()
+    store.markers.listen(hub.listener('marker'))
+    store.comments.listen(hub.listener('comment'))
+    store.routes.listen(hub.listener('route', route_view))
+    hub.watch(store.refresh)
+
+    async def handle_events(request):
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        subscription = hub.subscribe(on_ready=lambda: loop.call_soon_threadsafe(ready.set))
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+            'Access-Control-Allow-Origin': '*',
+        })
+        try:
+            await response.prepare(request)
+            await response.write(b': connected\n\n')
+            while True:
+                if not subscription.closed:
+                    try:
+                        await asyncio.wait_for(ready.wait(), HEARTBEAT_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                ready.clear()
+                messages = subscription.drain()
+                if messages:
+                    chunk = ''.join(messages)
+                elif subscription.closed:
+                    # Очередь дописана до конца: resync после переполнения
+                    # во время записи тоже дошёл до клиента
+                    break
+                else:
+                    chunk = ': ping\n\n'
+                # Медленный клиент не держит корутину дольше WRITE_TIMEOUT
+                await asyncio.wait_for(response.write(chunk.encode('utf-8')), WRITE_TIMEOUT)
+        except (ConnectionResetError, asyncio.TimeoutError):
+            pass
+        finally:
+            subscription.close()
+        return response
+
+    async def handle_health(request):
+        return web.json_response({'status': 'ok', 'subscribers': len(hub.subscribers)})
+
+    async def close_streams(app):
+        # Открытые потоки иначе держали бы остановку до shutdown_timeout aiohttp
+        hub.close_all()
+
+    app = web.Application()
+    app[HUB_KEY] = hub
+    app.router.add_get('/api/events', handle_events)
+    app.router.add_get('/health', handle_health)
+    app.on_shutdown.append(close_streams)
+    return app
+
+
+if __name__ == '__main__':
+    port = int(os.environ.get('STREAM_PORT', 5001))
+    print(f"📡 Поток событий на порту {port}")
+    web.run_app(create_app(), host='0.0.0.0', port=port)
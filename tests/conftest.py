@@ -0,0 +1,24 @@
+import os
+import sys
+
+# Модули проекта лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def main_module(tmp_path_factory):
+    """main.py, открывший файлы данных во временном каталоге"""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('data'))
+    try:
+        import main
+    finally:
+        os.chdir(cwd)
+    return main
+
+
+@pytest.fixture
+def api(main_module):
+    return main_module.app.test_client()
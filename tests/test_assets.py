@@ -0,0 +1,39 @@
+"""Раздача файлов приложения (assets.AssetStore) и главная страница server.py"""
+
+import pytest
+
+import server
+from assets import AssetStore
+
+
+def test_variants_are_built_at_startup():
+    asset = server.static_assets.assets['index.html']
+    assert {'gzip', 'identity'} <= set(asset.variants)
+
+
+@pytest.fixture
+def fingerprinted(monkeypatch):
+    monkeypatch.setattr(server, 'static_assets',
+                        AssetStore(server.static_assets.directory, server.APP_ASSETS,
+                                   fingerprint=True))
+    monkeypatch.setattr(server, 'main_page', server.render_main_page())
+    return server.app.test_client()
+
+
+def test_main_page_links_fingerprinted_app(fingerprinted):
+    name = server.static_assets.assets['index.html'].fingerprinted_name
+    assert name != 'index.html'
+    page = fingerprinted.get('/').get_data(as_text=True)
+    assert f'href="/app/{name}"' in page
+    response = fingerprinted.get(f'/app/{name}', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'immutable' in response.headers['Cache-Control']
+
+
+@pytest.mark.parametrize('name', ['bot.py', 'server.py', 'main.py', 'markers.json',
+                                  'requests.jsonl', '../server.py', 'tests/conftest.py'])
+def test_only_app_files_are_served(name):
+    client = server.app.test_client()
+    assert client.get(f'/app/{name}').status_code == 404
+    assert set(server.static_assets.assets) == set(server.APP_ASSETS)
@@ -0,0 +1,60 @@
+"""Кэш ответов backend для бота (backend_client.TTLCache)"""
+
+import asyncio
+
+import pytest
+
+from backend_client import BackendError, TTLCache
+
+
+class Loader:
+    def __init__(self, delay=0.01, error=None):
+        self.calls = 0
+        self.delay = delay
+        self.error = error
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return {'call': self.calls}
+
+
+def test_concurrent_misses_share_one_load():
+    async def run():
+        cache, load = TTLCache(), Loader()
+        results = await asyncio.gather(*(cache.get('/stats', 30, load) for _ in range(2000)))
+        assert load.calls == 1
+        assert all(result == {'call': 1} for result in results)
+        # Свежее значение отдаётся без загрузки, устаревшее загружается заново
+        assert await cache.get('/stats', 30, load) == {'call': 1}
+        assert await cache.get('/other', 0, load) == {'call': 2}
+        assert await cache.get('/other', 0, load) == {'call': 3}
+    asyncio.run(run())
+
+
+def test_errors_are_shared_but_not_cached():
+    async def run():
+        cache, load = TTLCache(), Loader(error=BackendError('нет связи'))
+        results = await asyncio.gather(*(cache.get('/stats', 30, load) for _ in range(100)),
+                                       return_exceptions=True)
+        assert load.calls == 1
+        assert all(isinstance(result, BackendError) for result in results)
+        load.error = None
+        assert await cache.get('/stats', 30, load) == {'call': 2}
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_does_not_cancel_load():
+    async def run():
+        cache, load = TTLCache(), Loader(delay=0.05)
+        first = asyncio.ensure_future(cache.get('/stats', 30, load))
+        second = asyncio.ensure_future(cache.get('/stats', 30, load))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == {'call': 1}
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert load.calls == 1
+    asyncio.run(run())
@@ -0,0 +1,63 @@
+"""POST /api/batch (main.batch_write)"""
+
+import uuid
+
+
+def marker_data(user_id, comment='метка'):
+    return {'lat': 55.75, 'lng': 37.62, 'comment': comment, 'rating': 5, 'user_id': user_id}
+
+
+def user_markers(main_module, user_id):
+    return main_module.store.markers.find('user_id', user_id)
+
+
+def test_invalid_operation_rejects_whole_batch(api, main_module):
+    user_id = str(uuid.uuid4())
+    response = api.post('/api/batch', json={'operations': [
+        {'action': 'create', 'type': 'marker', 'data': marker_data(user_id)},
+        {'action': 'create', 'type': 'marker', 'data': {'lat': 55.0, 'user_id': user_id}},
+        {'action': 'rename', 'type': 'marker', 'id': 'x'},
+    ]})
+    assert response.status_code == 400
+    assert [e['index'] for e in response.json['errors']] == [1, 2]
+    assert user_markers(main_module, user_id) == []
+
+
+def test_missing_records_are_404_per_item(api, main_module):
+    user_id = str(uuid.uuid4())
+    response = api.post('/api/batch', json={'operations': [
+        {'action': 'update', 'type': 'marker', 'id': 'missing', 'data': {'rating': 1}},
+        {'action': 'create', 'type': 'marker', 'data': marker_data(user_id)},
+        {'action': 'create', 'type': 'comment', 'marker_id': 'missing', 'data': {'comment': 'к чему?'}},
+        {'action': 'delete', 'type': 'comment', 'id': 'missing'},
+    ]})
+    assert response.status_code == 200
+    assert [r['status'] for r in response.json['results']] == [404, 201, 404, 404]
+    [marker] = user_markers(main_module, user_id)
+    assert marker['id'] == response.json['results'][1]['data']['id']
+
+
+def test_results_carry_revisions_in_operation_order(api, main_module):
+    user_id = str(uuid.uuid4())
+    response = api.post('/api/batch', json={'operations': [
+        {'action': 'create', 'type': 'marker', 'data': marker_data(user_id, 'первая')},
+        {'action': 'create', 'type': 'marker', 'data': marker_data(user_id, 'вторая')},
+    ]})
+    created = [r['data'] for r in response.json['results']]
+    marker_id = created[0]['id']
+    response = api.post('/api/batch', json={'operations': [
+        {'action': 'update', 'type': 'marker', 'id': marker_id, 'data': {'rating': 2}},
+        {'action': 'create', 'type': 'comment', 'marker_id': marker_id, 'data': {'comment': 'да'}},
+        {'action': 'delete', 'type': 'marker', 'id': created[1]['id']},
+    ]})
+    results = response.json['results']
+    assert [r['status'] for r in results] == [200, 201, 200]
+    updated, comment = results[0]['data'], results[1]['data']
+
+    # Ревизии меток растут в порядке операций (у комментариев - своя лента)
+    assert created[0]['revision'] < created[1]['revision'] < updated['revision']
+    # Ответ содержит ту же ревизию, что и хранилище
+    assert main_module.store.markers.get(marker_id)['revision'] == updated['revision']
+    assert updated['rating'] == 2
+    assert main_module.store.comments.get(comment['id'])['revision'] == comment['revision']
+    assert main_module.store.markers.get(created[1]['id']) is None
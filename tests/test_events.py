@@ -0,0 +1,34 @@
+"""Рассылка событий подписчикам (events.EventHub)"""
+
+from events import RESYNC_EVENT, EventHub
+
+
+def test_close_all_wakes_async_subscribers():
+    hub = EventHub()
+    woken = []
+    subscriptions = [hub.subscribe(on_ready=lambda i=i: woken.append(i)) for i in range(3)]
+    hub.close_all()
+    assert sorted(woken) == [0, 1, 2]
+    assert all(s.closed for s in subscriptions)
+    assert not hub.subscribers
+
+
+def test_slow_subscriber_gets_resync_and_is_dropped():
+    hub = EventHub(queue_size=2)
+    subscription = hub.subscribe()
+    for i in range(3):
+        hub.publish_event({'type': 'marker.put', 'data': {'id': str(i)}})
+    assert subscription.closed and not hub.subscribers
+    assert [m.split('\n', 1)[0] for m in subscription.drain()] == ['event: resync']
+
+
+def test_sync_stream_sends_resync_queued_during_yield():
+    hub = EventHub(queue_size=2)
+    stream = hub.stream()
+    assert next(stream) == ': connected\n\n'
+    hub.publish_event({'type': 'marker.put', 'data': {'id': 'first'}})
+    assert next(stream).startswith('event: marker.put')
+    # Клиент ещё принимает первое событие, а очередь уже переполнена
+    for i in range(3):
+        hub.publish_event({'type': 'marker.put', 'data': {'id': str(i)}})
+    assert list(stream) == [RESYNC_EVENT]
@@ -0,0 +1,152 @@
+"""Сетка меток и поиск ближайших (geo.nearest_records, geo.records_in_bbox),
+уровни детализации маршрутов (geo.route_levels, geo.clean_route)"""
+
+import math
+import random
+
+import pytest
+
+from geo import (EARTH_RADIUS_M, ROUTE_LOD_TOLERANCES, ROUTE_MIN_STEP_M, BBox, clean_route, grid_cell,
+                 haversine_m, nearest_records, records_in_bbox, route_importance, route_levels)
+
+
+def build_grid(records):
+    grid = {}
+    for record in records:
+        grid.setdefault(grid_cell(record['lat'], record['lng']), {})[record['id']] = record
+    return grid
+
+
+def brute_force(records, lat, lng, k=None, radius_m=None):
+    found = sorted((haversine_m((lat, lng), (r['lat'], r['lng'])), r['id']) for r in records)
+    if radius_m is not None:
+        found = [item for item in found if item[0] <= radius_m]
+    return found[:k] if k is not None else found
+
+
+def ids(result):
+    return [(round(distance, 6), record['id']) for distance, record in result]
+
+
+@pytest.fixture
+def antimeridian():
+    rng = random.Random(180)
+    records = [{'id': f'r{i}', 'lat': rng.uniform(60, 70), 'lng': rng.choice((-1, 1)) * rng.uniform(179, 180)}
+               for i in range(500)]
+    # Точно на 180-м меридиане (в том числе у полюса)
+    records += [{'id': 'east', 'lat': 65.0, 'lng': 180.0}, {'id': 'west', 'lat': 65.0, 'lng': -180.0},
+                {'id': 'pole', 'lat': 90.0, 'lng': 180.0}]
+    return records
+
+
+def test_lng_180_shares_cell_with_minus_180():
+    assert grid_cell(65.0, 180.0) == grid_cell(65.0, -180.0)
+
+
+@pytest.mark.parametrize('lat, lng', [(65.0, 180.0), (65.0, -180.0), (65.0, 179.99), (89.9, 0.0)])
+def test_nearest_matches_brute_force_across_antimeridian(antimeridian, lat, lng):
+    grid = build_grid(antimeridian)
+    for k in (1, 10, 100):
+        expected = [(round(d, 6), i) for d, i in brute_force(antimeridian, lat, lng, k=k)]
+        assert ids(nearest_records(grid, lat, lng, k=k)) == expected
+    for radius in (1000, 50000):
+        expected = [(round(d, 6), i) for d, i in brute_force(antimeridian, lat, lng, radius_m=radius)]
+        assert ids(nearest_records(grid, lat, lng, radius_m=radius)) == expected
+
+
+def test_point_on_180_is_nearest_to_itself(antimeridian):
+    grid = build_grid(antimeridian)
+    (distance, record), = nearest_records(grid, 65.0, 180.0, k=1)
+    assert record['id'] in ('east', 'west') and distance == 0
+
+
+@pytest.mark.parametrize('bbox', ['179.5,60,180,70', '179,60,-179,70', '-180,-90,180,90'])
+def test_bbox_finds_points_on_180_once(antimeridian, bbox):
+    box = BBox.parse(bbox)
+    found = [r['id'] for r in records_in_bbox(build_grid(antimeridian), box)]
+    expected = [r['id'] for r in antimeridian if box.contains(r['lat'], r['lng'])]
+    assert sorted(found) == sorted(expected)
+    assert 'east' in found
+
+
+def rdp(points, tolerance):
+    """Обычный рекурсивный RDP в той же плоской проекции, что и route_importance"""
+    lat0, lng0 = points[0]
+    k = math.cos(math.radians(lat0))
+    xy = [(math.radians(lng - lng0) * k * EARTH_RADIUS_M, math.radians(lat - lat0) * EARTH_RADIUS_M)
+          for lat, lng in points]
+
+    def simplify(first, last):
+        (ax, ay), (bx, by) = xy[first], xy[last]
+        length = math.hypot(bx - ax, by - ay)
+        best, best_dist = None, -1.0
+        for i in range(first + 1, last):
+            px, py = xy[i]
+            if length > 0:
+                dist = abs((by - ay) * (px - ax) - (bx - ax) * (py - ay)) / length
+            else:
+                dist = math.hypot(px - ax, py - ay)
+            if dist > best_dist:
+                best, best_dist = i, dist
+        if best is None or best_dist <= tolerance:
+            return [first]
+        return simplify(first, best) + simplify(best, last)
+
+    if len(points) <= 2:
+        return list(points)
+    return [points[i] for i in simplify(0, len(points) - 1)] + [points[-1]]
+
+
+def random_route(rng, n, step):
+    lat, lng = 55.75, 37.62
+    points = []
+    for _ in range(n):
+        lat += rng.gauss(0, step)
+        lng += rng.gauss(0, step)
+        points.append([lat, lng])
+    return points
+
+
+@pytest.mark.parametrize('seed, n, step', [(1, 300, 0.0005), (2, 1000, 0.002), (3, 50, 0.00002)])
+def test_route_levels_match_reference_rdp(seed, n, step):
+    points = random_route(random.Random(seed), n, step)
+    levels = route_levels(points)
+    assert set(levels) == {str(t) for t in ROUTE_LOD_TOLERANCES}
+    for tolerance in ROUTE_LOD_TOLERANCES:
+        assert levels[str(tolerance)] == rdp(points, tolerance)
+
+
+def test_closed_route_matches_reference_rdp():
+    # Первая и последняя точки совпадают: расстояние считается до точки
+    points = random_route(random.Random(4), 200, 0.001)
+    points.append(list(points[0]))
+    for tolerance in ROUTE_LOD_TOLERANCES:
+        assert route_levels(points)[str(tolerance)] == rdp(points, tolerance)
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 500])
+def test_route_levels_keep_endpoints(n):
+    points = random_route(random.Random(n), n, 0.01)
+    importance = route_importance(points)
+    assert importance[0] == importance[-1] == math.inf
+    levels = [route_levels(points)[str(t)] for t in ROUTE_LOD_TOLERANCES]
+    for level in levels:
+        assert level[0] == points[0] and level[-1] == points[-1]
+        assert len(level) == min(n, max(2, len(level)))
+    # Уровень с большим допуском - подмножество уровня с меньшим
+    for finer, coarser in zip(levels, levels[1:]):
+        assert [p for p in finer if p in coarser] == coarser
+
+
+def test_clean_route_drops_near_duplicates_but_keeps_last_point():
+    step = ROUTE_MIN_STEP_M / 2 / 111320
+    points = [[55.0, 37.0], [55.0 + step, 37.0], [55.001, 37.0], [55.001 + step, 37.0]]
+    assert clean_route(points) == [[55.0, 37.0], [55.001, 37.0], [55.001 + step, 37.0]]
+    # Продолжение маршрута: первая точка рядом с уже сохранённой отбрасывается
+    assert clean_route(points[1:], previous=points[0]) == [[55.001, 37.0], [55.001 + step, 37.0]]
+
+
+@pytest.mark.parametrize('coordinates', [[], 'x', [[55.0]], [[91.0, 37.0]], [[55.0, float('nan')]]])
+def test_clean_route_rejects_bad_points(coordinates):
+    with pytest.raises(ValueError):
+        clean_route(coordinates)
@@ -0,0 +1,42 @@
+"""Локальный обратный геокодер (geocoder.py) на точках у границ и на островах"""
+
+import pytest
+
+from geocoder import Geocoder, resolve_city
+
+
+@pytest.fixture(scope='module')
+def geocoder():
+    return Geocoder()
+
+
+@pytest.mark.parametrize('lat, lng', [
+    (45.0, 147.5),      # Итуруп, Курилы
+    (50.7, 156.2),      # Парамушир
+    (73.0, 55.0),       # Новая Земля
+    (71.2, -179.5),     # остров Врангеля за 180-м меридианом
+    (71.2, 179.5),      # он же до меридиана
+    (80.5, 55.0),       # Земля Франца-Иосифа
+    (79.0, 100.0),      # Северная Земля
+    (75.0, 140.0),      # Новосибирские острова
+    (55.0, 166.0),      # остров Беринга
+    (50.29, 127.53),    # Благовещенск
+])
+def test_russian_islands_and_border_cities(geocoder, lat, lng):
+    assert geocoder.reverse(lat, lng)['in_russia']
+
+
+@pytest.mark.parametrize('lat, lng', [
+    (50.24, 127.49),    # Хэйхэ, Китай, через Амур от Благовещенска
+    (43.33, 145.58),    # Немуро, Хоккайдо
+    (44.35, 145.33),    # полуостров Сиретоко
+    (45.75, 126.65),    # Харбин
+])
+def test_foreign_points_near_border(geocoder, lat, lng):
+    assert not geocoder.reverse(lat, lng)['in_russia']
+
+
+def test_city_circle_does_not_cross_border(geocoder):
+    assert geocoder.reverse(50.24, 127.49)['city'] is None
+    assert resolve_city(50.24, 127.49) is None
+    assert resolve_city(50.29, 127.53) == 'Благовещенск'
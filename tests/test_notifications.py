@@ -0,0 +1,60 @@
+"""Лента уведомлений бота (notifications.follow_changes) против поддельного backend"""
+
+import asyncio
+
+import pytest
+
+from backend_client import BackendError
+from notifications import follow_changes
+
+
+class FakeBackend:
+    """Два подключения к потоку; между ними пропущена метка m3"""
+
+    def __init__(self):
+        self.log = []
+        self.connections = 0
+
+    async def get_json(self, path, params=None):
+        self.log.append(('get', path, params['since']))
+        if params['since'] == '0':
+            # Метка m2 создана, пока шла загрузка: она уже есть и в потоке
+            return {'reset': False, 'changes': [marker('m1', 1), marker('m2', 2)],
+                    'deleted': [], 'cursor': '2'}
+        return {'reset': False, 'changes': [marker('m3', 4)], 'deleted': ['m1'], 'cursor': '4'}
+
+    async def events(self, url):
+        self.connections += 1
+        self.log.append(('open', self.connections))
+        yield 'open', None
+        if self.connections == 1:
+            yield 'marker.put', marker('m2', 2)
+            yield 'comment.put', {'id': 'c1', 'marker_id': 'm2', 'comment': 'ok'}
+            raise BackendError('обрыв')
+        yield 'marker.put', marker('m3', 4)
+        raise asyncio.CancelledError
+
+
+class FakeNotifier:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, notification):
+        self.published.append(notification)
+
+
+def marker(marker_id, revision):
+    return {'id': marker_id, 'city': 'Москва', 'comment': marker_id, 'revision': revision}
+
+
+def test_subscribes_first_and_resumes_from_cursor(monkeypatch):
+    async def no_sleep(delay):
+        pass
+    monkeypatch.setattr('notifications.asyncio.sleep', no_sleep)
+    backend, notifier = FakeBackend(), FakeNotifier()
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(follow_changes(backend, notifier, '/api/events'))
+    # Поток подключается до загрузки; после обрыва догружается только хвост
+    assert backend.log == [('open', 1), ('get', '/markers', '0'), ('open', 2), ('get', '/markers', '2')]
+    # m1 и m2 загружены при старте без уведомлений, m3 пропущена во время обрыва
+    assert [(n['kind'], n['text']) for n in notifier.published] == [('comment', 'ok'), ('marker', 'm3')]
@@ -0,0 +1,64 @@
+"""Черновики маршрутов: POST /api/routes/<id>/points и публикация (main.append_route_points)"""
+
+import uuid
+
+
+def create_draft(api, user_id):
+    response = api.post('/api/routes', json={
+        'coordinates': [[55.70, 37.50], [55.71, 37.51]], 'user_id': user_id, 'draft': True})
+    assert response.status_code == 201
+    return response.json['id']
+
+
+def listed_ids(api, user_id):
+    return [r['id'] for r in api.get(f'/api/routes?user_id={user_id}').json]
+
+
+def test_points_are_appended_to_draft(api, main_module):
+    route_id = create_draft(api, str(uuid.uuid4()))
+    response = api.post(f'/api/routes/{route_id}/points',
+                        json={'points': [[55.72, 37.52], [55.73, 37.53]]})
+    assert response.status_code == 200
+    assert response.json == {'id': route_id, 'points': 4, 'published': False}
+    route = main_module.store.routes.get(route_id)
+    assert route['coordinates'] == [[55.70, 37.50], [55.71, 37.51], [55.72, 37.52], [55.73, 37.53]]
+
+
+def test_draft_is_hidden_until_published(api):
+    user_id = str(uuid.uuid4())
+    route_id = create_draft(api, user_id)
+    assert api.get(f'/api/routes/{route_id}').status_code == 404
+    assert route_id not in listed_ids(api, user_id)
+
+    response = api.post(f'/api/routes/{route_id}/points',
+                        json={'points': [[55.72, 37.52]], 'publish': True})
+    assert response.json['published'] is True
+    route = api.get(f'/api/routes/{route_id}')
+    assert route.status_code == 200
+    assert route.json['coordinates'][-1] == [55.72, 37.52]
+    assert listed_ids(api, user_id) == [route_id]
+
+    # Опубликованный маршрут больше не дописывается
+    response = api.post(f'/api/routes/{route_id}/points', json={'points': [[55.73, 37.53]]})
+    assert response.status_code == 409
+
+
+def test_append_changes_etag(api):
+    route_id = create_draft(api, str(uuid.uuid4()))
+    etag = api.get('/api/routes').headers['ETag']
+    assert api.get('/api/routes', headers={'If-None-Match': etag}).status_code == 304
+
+    # Каждая порция точек меняет версию: закэшированный список не подходит
+    for points, publish in (([[55.72, 37.52]], False), ([[55.73, 37.53]], True)):
+        api.post(f'/api/routes/{route_id}/points', json={'points': points, 'publish': publish})
+        response = api.get('/api/routes', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+        etag = response.headers['ETag']
+
+
+def test_append_errors(api):
+    route_id = create_draft(api, str(uuid.uuid4()))
+    assert api.post('/api/routes/missing/points', json={'points': [[55.0, 37.0]]}).status_code == 404
+    response = api.post(f'/api/routes/{route_id}/points', json={'points': [[95.0, 37.0]]})
+    assert response.status_code == 400
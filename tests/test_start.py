@@ -0,0 +1,60 @@
+"""Запуск компонентов (start.Component и start.Supervisor) с подставными процессами"""
+
+import sys
+import threading
+import time
+
+import pytest
+
+import start
+
+
+@pytest.fixture
+def lines(monkeypatch):
+    lines = []
+    monkeypatch.setattr(start, 'log', lines.append)
+    return lines
+
+
+def test_chatty_child_is_drained_and_becomes_ready(lines):
+    script = "for i in range(200000): print('строка', i, 'x' * 80)\nprint('Run polling for bot')\n" \
+             "import time; time.sleep(30)"
+    component = start.Component('Bot', [sys.executable, '-c', script], ready_line='Run polling for bot')
+    component.start()
+    try:
+        assert component.ready.wait(30)
+        assert sum(line.startswith('[Bot] строка') for line in lines) == 200000
+    finally:
+        component.stop()
+
+
+def test_restart_delay_doubles_and_resets(monkeypatch):
+    component = start.Component('Crash', [sys.executable, '-c', 'pass'])
+    now = [1000.0]
+    monkeypatch.setattr(start.time, 'monotonic', lambda: now[0])
+    component.started_at = now[0]
+    assert [component.schedule_restart() for _ in range(8)] == [1, 2, 4, 8, 16, 32, 60, 60]
+    # Проработавший RESTART_RESET_AFTER секунд снова перезапускается через 1 с
+    now[0] += start.RESTART_RESET_AFTER
+    assert component.schedule_restart() == 1
+
+
+def test_supervisor_restarts_crashed_child(lines, monkeypatch):
+    monkeypatch.setattr(start, 'RESTART_BASE_DELAY', 0.1)
+    crash = start.Component('Crash', [sys.executable, '-c', 'import sys; sys.exit(3)'])
+    healthy = start.Component('Bot', [sys.executable, '-c', "print('Run polling for bot'); "
+                                      "import time; time.sleep(30)"], ready_line='Run polling for bot')
+    supervisor = start.Supervisor([crash, healthy])
+    runner = threading.Thread(target=supervisor.run)
+    runner.start()
+    try:
+        deadline = time.monotonic() + 10
+        while crash.failures < 3 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert crash.failures >= 3
+        assert healthy.ready.is_set() and not healthy.exited()
+        assert any('Crash завершился с кодом 3' in line for line in lines)
+    finally:
+        supervisor.stop()
+        runner.join(5)
+    assert not runner.is_alive()
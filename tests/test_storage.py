@@ -0,0 +1,134 @@
+"""
+Нагрузочная проверка бэкендов для нескольких процессов (flock и sqlite)
+
+WRITERS процессов одновременно добавляют свои записи и дописывают
+элементы в одну общую запись, а компактификация (для sqlite - очистка
+ленты изменений) вызывается чаще, чем в работе. После этого свежий
+экземпляр хранилища должен видеть каждую запись и каждый patch.
+"""
+
+import multiprocessing
+import os
+
+import pytest
+
+import storage as storage_module
+from storage import FileLockStorage, LogStorage, SQLiteStorage
+
+WRITERS = 6
+WRITES_PER_WRITER = 300
+COMPACT_EVERY = 20
+
+
+def open_storage(backend, directory):
+    if backend == 'flock':
+        # Порог ниже числа записей: компактор срабатывает и сам
+        return FileLockStorage(fsync_interval=0.01, compact_threshold=50, compact_interval=0.02)
+    return SQLiteStorage(os.path.join(directory, 'data.db'), compact_interval=0.02, changes_ttl=0)
+
+
+def writer(backend, directory, number):
+    storage = open_storage(backend, directory)
+    filename = os.path.join(directory, 'markers.json')
+    for i in range(WRITES_PER_WRITER):
+        record_id = f'{number}-{i}'
+        storage.put(filename, {'id': record_id, 'writer': number})
+        storage.patch(filename, 'shared', extend={'items': [record_id]}, values={'last': record_id})
+        if i % COMPACT_EVERY == 0:
+            if backend == 'flock':
+                storage.compact(filename)
+            else:
+                storage.maintain()
+    storage.sync()
+
+
+@pytest.mark.parametrize('backend', ['flock', 'sqlite'])
+def test_concurrent_writers_lose_nothing(backend, tmp_path):
+    directory = str(tmp_path)
+    filename = os.path.join(directory, 'markers.json')
+    storage = open_storage(backend, directory)
+    storage.put(filename, {'id': 'shared', 'items': []})
+    storage.sync()
+
+    # spawn, а не fork: фоновые потоки хранилища этого процесса могут держать
+    # блокировки SQLite в момент fork, и процесс-потомок зависнет на них навсегда
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=writer, args=(backend, directory, n)) for n in range(WRITERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(120)
+        assert process.exitcode == 0
+
+    records = {r['id']: r for r in open_storage(backend, directory).load(filename)}
+    expected = {f'{n}-{i}' for n in range(WRITERS) for i in range(WRITES_PER_WRITER)}
+    assert set(records) == expected | {'shared'}
+    items = records['shared']['items']
+    assert len(items) == len(expected)
+    assert set(items) == expected
+    # Элементы одного процесса дописаны в порядке записи
+    for n in range(WRITERS):
+        own = [item for item in items if item.startswith(f'{n}-')]
+        assert own == [f'{n}-{i}' for i in range(WRITES_PER_WRITER)]
+
+    # Процесс, открывший хранилище до записи, догоняет все операции
+    storage.poll(filename)
+    assert storage.revision(filename) == max(r['revision'] for r in records.values())
+
+
+def test_sqlite_reader_behind_purge_reloads(tmp_path):
+    path = os.path.join(tmp_path, 'data.db')
+    markers = os.path.join(tmp_path, 'markers.json')
+    routes = os.path.join(tmp_path, 'routes.json')
+    writer = SQLiteStorage(path, changes_ttl=0)
+    reader = SQLiteStorage(path, changes_ttl=0)
+    writer.put(routes, {'id': 'r0'})
+    reader.load(markers)
+    reader.load(routes)
+    entries = []
+    reader.subscribe(markers, entries.append)
+
+    for i in range(5):
+        writer.put(markers, {'id': f'm{i}'})
+    # Остаются последние строки routes (seq 1) и markers: дыру за позицией
+    # читателя не видно по MIN(seq)
+    writer.maintain()
+    reader.poll(markers)
+    assert [e['op'] for e in entries] == ['reset']
+    assert [r['id'] for r in entries[0]['records']] == [f'm{i}' for i in range(5)]
+    assert reader.revision(markers) == writer.revision(markers)
+
+
+@pytest.mark.parametrize('backend', ['log', 'flock'])
+def test_crash_after_snapshot_does_not_replay_extend(backend, tmp_path, monkeypatch):
+    filename = os.path.join(tmp_path, 'routes.json')
+    open_backend = LogStorage if backend == 'log' else FileLockStorage
+    storage = open_backend()
+    storage.put(filename, {'id': 'r1', 'points': [[1, 1]]})
+    # put уже в снимке, в журнале остаётся только extend
+    storage.compact(filename)
+    storage.patch(filename, 'r1', extend={'points': [[2, 2]]})
+    storage.sync()
+
+    write_snapshot = storage_module._write_snapshot
+
+    def crash_after_snapshot(*args):
+        # Снимок записан, а старый журнал не удалён и поколение не сменено
+        write_snapshot(*args)
+        raise RuntimeError('crash')
+
+    monkeypatch.setattr(storage_module, '_write_snapshot', crash_after_snapshot)
+    with pytest.raises(RuntimeError):
+        storage.compact(filename)
+    monkeypatch.undo()
+
+    reopened = open_backend()
+    [route] = reopened.load(filename)
+    assert route['points'] == [[1, 1], [2, 2]]
+    assert reopened.revision(filename) == storage.revision(filename)
+
+    # Следующая запись и компактификация после перезапуска ничего не теряют
+    reopened.patch(filename, 'r1', extend={'points': [[3, 3]]})
+    reopened.compact(filename)
+    [route] = open_backend().load(filename)
+    assert route['points'] == [[1, 1], [2, 2], [3, 3]]
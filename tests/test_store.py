@@ -0,0 +1,124 @@
+"""Резидентное хранилище (store.DataStore) поверх журнала в одном процессе"""
+
+import os
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from storage import FileLockStorage, LogStorage, SQLiteStorage
+from store import MARKER_TTL, ROUTE_TTL, DataStore
+
+
+def open_store(storage, directory):
+    return DataStore(storage, *(os.path.join(directory, name) for name in
+                                ('markers.json', 'comments.json', 'routes.json')), sweep=False)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return open_store(LogStorage(), tmp_path)
+
+
+def test_stats_count_only_live_published_routes(store):
+    now = datetime.now()
+    store.routes.put({'id': 'published', 'created_at': now.isoformat(), 'coordinates': []})
+    store.routes.put({'id': 'draft', 'created_at': now.isoformat(), 'coordinates': [],
+                      'published': False})
+    expired = (now - timedelta(seconds=ROUTE_TTL + 60)).isoformat()
+    store.routes.put({'id': 'expired', 'created_at': expired, 'coordinates': []})
+    assert store.stats()['total_routes'] == 1
+
+    # Публикация черновика и удаление просроченного учитываются сразу
+    store.routes.put({'id': 'draft', 'created_at': now.isoformat(), 'coordinates': []})
+    store.purge_expired()
+    assert store.stats()['total_routes'] == 2
+
+
+def test_stats_skip_expired_markers_before_purge(store):
+    now = datetime.now()
+    expired = (now - timedelta(seconds=MARKER_TTL + 60)).isoformat()
+    store.markers.put({'id': 'live', 'lat': 55.75, 'lng': 37.62, 'rating': 4,
+                       'city': 'Москва', 'timestamp': now.isoformat()})
+    store.markers.put({'id': 'old', 'lat': 59.93, 'lng': 30.36, 'rating': 2,
+                       'city': 'Санкт-Петербург', 'timestamp': expired})
+    stats = store.stats()
+    assert stats['total_markers'] == len(store.markers.all()) == 1
+    assert stats['average_rating'] == 4
+    assert stats['cities'] == ['Москва']
+    assert store.city_stats() == [{'city': 'Москва', 'count': 1, 'average_rating': 4}]
+
+    store.purge_expired()
+    assert store.stats() == stats
+
+
+def marker(marker_id):
+    return {'id': marker_id, 'lat': 55.75, 'lng': 37.62, 'timestamp': datetime.now().isoformat()}
+
+
+def test_write_batch_plans_after_refresh_under_lock(tmp_path):
+    store = open_store(FileLockStorage(), tmp_path)
+    other = open_store(FileLockStorage(), tmp_path)
+    store.markers.put(marker('m'))
+    other.markers.refresh()
+    # Другой процесс удаляет метку уже после того, как мы её видели
+    other.markers.delete('m')
+    inside = threading.Event()
+    release = threading.Event()
+    seen = []
+
+    def plan():
+        seen.append(store.markers.records.get('m'))
+        inside.set()
+        release.wait(5)
+        return [(store.markers, 'put', marker('n'))]
+
+    writer = threading.Thread(target=store.write_batch, args=(plan,))
+    writer.start()
+    inside.wait(5)
+    # Пока план строится, запись из другого потока ждёт блокировку
+    deleter = threading.Thread(target=store.markers.delete, args=('n',))
+    deleter.start()
+    deleter.join(0.2)
+    assert deleter.is_alive()
+    release.set()
+    writer.join(5)
+    deleter.join(5)
+    assert seen == [None]
+    assert store.markers.get('n') is None
+    assert store.write_batch(lambda: None) is None
+
+
+def compact(storage, filename):
+    if isinstance(storage, SQLiteStorage):
+        storage.changes_ttl = 0
+        storage.maintain()
+    else:
+        storage.compact(filename)
+
+
+@pytest.mark.parametrize('backend', [LogStorage, FileLockStorage, SQLiteStorage])
+def test_cursor_survives_compaction_and_restart(backend, tmp_path):
+    def open_storage():
+        if backend is SQLiteStorage:
+            return SQLiteStorage(os.path.join(tmp_path, 'data.db'))
+        return backend()
+
+    storage = open_storage()
+    store = open_store(storage, tmp_path)
+    now = datetime.now().isoformat()
+    store.routes.put({'id': 'a', 'created_at': now, 'coordinates': []})
+    store.routes.put({'id': 'b', 'created_at': now, 'coordinates': []})
+    before_delete = int(store.routes.cursor())
+    store.routes.delete('b')
+    after_delete = int(store.routes.cursor())
+    compact(storage, store.routes.filename)
+    storage.sync()
+
+    restarted = open_store(open_storage(), tmp_path)
+    # Курсор - ревизия хранилища, а не время запуска процесса
+    assert int(restarted.routes.cursor()) == after_delete
+    assert restarted.routes.changes_since(after_delete) == {
+        'reset': False, 'changes': [], 'deleted': [], 'cursor': str(after_delete)}
+    # Удаление свёрнуто в снимок: более старый курсор получает полную загрузку
+    assert restarted.routes.changes_since(before_delete)['reset'] is True
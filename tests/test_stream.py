@@ -0,0 +1,38 @@
+"""Поток событий SSE (stream.py)"""
+
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import stream
+
+
+def test_resync_after_overflow_during_write_reaches_client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    app = stream.create_app('flock')
+    hub = app[stream.HUB_KEY]
+    write = web.StreamResponse.write
+
+    async def slow_write(response, data):
+        if b'marker.put' in data and hub.subscribers:
+            # Пока клиент принимает первое событие, очередь переполняется
+            for i in range(hub.queue_size + 1):
+                hub.publish_event({'type': 'marker.put', 'data': {'id': f'late-{i}'}})
+            await asyncio.sleep(0.05)
+        await write(response, data)
+
+    monkeypatch.setattr(web.StreamResponse, 'write', slow_write)
+
+    async def run():
+        async with TestClient(TestServer(app)) as client:
+            response = await client.get('/api/events')
+            assert await response.content.readuntil(b'\n\n') == b': connected\n\n'
+            hub.publish_event({'type': 'marker.put', 'data': {'id': 'first'}})
+            body = await asyncio.wait_for(response.content.read(), 5)
+            return body.decode('utf-8')
+
+    body = asyncio.run(run())
+    events = [block.split('\n', 1)[0] for block in body.split('\n\n') if block]
+    assert events == ['event: marker.put', 'event: resync']
+    assert not hub.subscribers
@@ -0,0 +1,23 @@
+"""Компактный формат ответов (wire.py)"""
+
+import random
+
+from wire import decode_polyline, pack_markers, pack_route
+
+
+def test_polyline_round_trip_keeps_6_digits():
+    rng = random.Random(1)
+    points = [(-90.0, -180.0), (90.0, 180.0), (-90.0, -180.0), (0.0, 0.0)]
+    points += [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(1000)]
+    decoded = decode_polyline(pack_route({'id': 'r', 'coordinates': points})['polyline'])
+    assert len(decoded) == len(points)
+    assert max(abs(a - b) for p, q in zip(points, decoded) for a, b in zip(p, q)) <= 5e-7 + 1e-12
+
+
+def test_pack_markers_by_columns():
+    markers = [{'id': 'a', 'lat': 55.75, 'lng': 37.61, 'rating': 5},
+               {'id': 'b', 'lat': 59.93, 'lng': 30.36, 'city': 'Санкт-Петербург'}]
+    packed = pack_markers(markers)
+    assert packed['count'] == 2
+    assert packed['columns'] == {'id': ['a', 'b'], 'rating': [5, None], 'city': [None, 'Санкт-Петербург']}
+    assert decode_polyline(packed['position']) == [[55.75, 37.61], [59.93, 30.36]]
@@ -0,0 +1,131 @@
+"""
+Приём обновлений Telegram через webhook (aiohttp) вместо долгого опроса
+
+Telegram сам присылает каждое обновление POST-запросом на WEBHOOK_PATH.
+Запрос проверяется по секретному заголовку X-Telegram-Bot-Api-Secret-Token,
+обновление передаётся диспетчеру в фоне, но одновременно обрабатывается
+не больше WEBHOOK_MAX_CONCURRENCY: когда все места заняты, ответ
+задерживается, и Telegram сам снижает темп. При остановке новые
+обновления получают 503 (Telegram повторит их позже), а начатые
+дорабатываются не дольше WEBHOOK_SHUTDOWN_TIMEOUT секунд.
+
+Для проверки без Telegram бот направляется на локальный сервер Bot API
+(TELEGRAM_API_URL в bot.py), а обновления присылаются на WEBHOOK_PATH
+с тем же секретом.
+"""
+
+import asyncio
+import hmac
+import logging
+import os
+import secrets
+import time
+
+from aiogram import types
+from aiohttp import web
+
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram/webhook')
+WEBHOOK_MAX_CONCURRENCY = int(os.environ.get('WEBHOOK_MAX_CONCURRENCY', 32))
+WEBHOOK_SHUTDOWN_TIMEOUT = float(os.environ.get('WEBHOOK_SHUTDOWN_TIMEOUT', 10))
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookHandler:
+    """Проверка, разбор и ограниченная по числу параллельная обработка обновлений"""
+
+    def __init__(self, dp, bot, secret, max_concurrency=WEBHOOK_MAX_CONCURRENCY):
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret.encode('utf-8')
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.tasks = set()
+        self.closing = False
+        # Счётчики для /health: сколько обработано, с ошибкой и суммарное время
+        self.processed = 0
+        self.failed = 0
+        self.latency_total = 0.0
+
+    async def handle(self, request):
+        token = request.headers.get(SECRET_HEADER, '').encode('utf-8')
+        if not hmac.compare_digest(token, self.secret):
+            return web.json_response({'error': 'Неверный секретный токен'}, status=403)
+        if self.closing:
+            return web.json_response({'error': 'Бот останавливается'}, status=503)
+        try:
+            update = types.Update.model_validate(await request.json(), context={'bot': self.bot})
+        except ValueError:
+            return web.json_response({'error': 'Некорректное обновление'}, status=400)
+
+        received = time.perf_counter()
+        # Ждём свободного места: так Telegram не присылает больше, чем мы успеваем
+        await self.slots.acquire()
+        task = asyncio.create_task(self._process(update, received))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return web.Response()
+
+    async def _process(self, update, received):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            self.failed += 1
+            logging.error(f"Ошибка обработки обновления {update.update_id}: {e}")
+        finally:
+            self.slots.release()
+            self.processed += 1
+            self.latency_total += time.perf_counter() - received
+
+    async def shutdown(self, timeout=WEBHOOK_SHUTDOWN_TIMEOUT):
+        """Перестаёт принимать обновления и ждёт начатые"""
+        self.closing = True
+        if self.tasks:
+            logging.info(f"Ожидание {len(self.tasks)} обработчиков...")
+            _, pending = await asyncio.wait(self.tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        return {
+            'in_flight': len(self.tasks),
+            'processed': self.processed,
+            'failed': self.failed,
+            'average_latency_ms': round(self.latency_total / self.processed * 1000, 2) if self.processed else None,
+        }
+
+
+def create_webhook_app(dp, bot, base_url, secret=None, startup=(), cleanup=()):
+    """aiohttp-приложение webhook; при старте регистрирует адрес в Telegram
+
+    base_url - публичный адрес бота (https://...), к нему добавляется
+    WEBHOOK_PATH. Без secret генерируется случайный на каждый запуск.
+    startup и cleanup - корутинные функции, вызываемые при запуске
+    и после остановки.
+    """
+    secret = secret or secrets.token_urlsafe(32)
+    handler = WebhookHandler(dp, bot, secret)
+
+    async def on_startup(app):
+        await bot.set_webhook(base_url.rstrip('/') + WEBHOOK_PATH, secret_token=secret,
+                              allowed_updates=dp.resolve_used_update_types())
+        logging.info(f"Webhook зарегистрирован: {base_url.rstrip('/')}{WEBHOOK_PATH}")
+        for start in startup:
+            await start()
+
+    async def on_shutdown(app):
+        await handler.shutdown()
+
+    async def on_cleanup(app):
+        for close in cleanup:
+            await close()
+
+    async def handle_health(request):
+        return web.json_response(dict(handler.stats(), status='ok'))
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handler.handle)
+    app.router.add_get('/health', handle_health)
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    app.on_cleanup.append(on_cleanup)
+    app['webhook'] = handler
+    return app